@@ -0,0 +1,22 @@
+"""Add last_user_id checkpoint to broadcasts
+
+Revision ID: 028
+Revises: 027
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '028'
+down_revision = '027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcasts', sa.Column('last_user_id', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'last_user_id')
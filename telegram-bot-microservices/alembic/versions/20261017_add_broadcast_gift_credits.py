@@ -0,0 +1,41 @@
+"""Add broadcast_gift_credits table (gift images credited once per recipient)
+
+Revision ID: 030
+Revises: 029
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '030'
+down_revision = '029'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'broadcast_gift_credits',
+        sa.Column('broadcast_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('broadcast_id', 'user_id')
+    )
+    op.create_index(op.f('ix_broadcast_gift_credits_user_id'), 'broadcast_gift_credits', ['user_id'], unique=False)
+
+    # Already credited gifts: recipients with a successful log of a gift broadcast
+    op.execute("""
+        INSERT INTO broadcast_gift_credits (broadcast_id, user_id)
+        SELECT DISTINCT l.broadcast_id, l.user_id
+        FROM broadcast_logs l
+        JOIN broadcasts b ON b.id = l.broadcast_id
+        WHERE l.success AND b.gift_images > 0
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_broadcast_gift_credits_user_id'), table_name='broadcast_gift_credits')
+    op.drop_table('broadcast_gift_credits')
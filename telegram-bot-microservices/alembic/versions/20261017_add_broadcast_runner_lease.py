@@ -0,0 +1,24 @@
+"""Add runner_id / heartbeat_at lease to broadcasts
+
+Revision ID: 029
+Revises: 028
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '029'
+down_revision = '028'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcasts', sa.Column('runner_id', sa.String(64), nullable=True))
+    op.add_column('broadcasts', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'heartbeat_at')
+    op.drop_column('broadcasts', 'runner_id')
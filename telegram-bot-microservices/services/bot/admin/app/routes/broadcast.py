@@ -1,6 +1,7 @@
 """
 Broadcast management routes for admin panel
 """
+import asyncio
 import os
 import uuid
 from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
@@ -21,7 +22,7 @@ from shared.database import (
     BroadcastStatus,
     ImageBalance,
 )
-from shared.utils import get_logger
+from shared.utils import get_logger, redis_client, BROADCAST_CANCEL_KEY, BROADCAST_CANCEL_TTL
 
 logger = get_logger(__name__)
 router = APIRouter(prefix="/broadcast", tags=["broadcast"])
@@ -33,6 +34,9 @@ MINIO_SECRET_KEY = os.getenv("MINIO_ROOT_PASSWORD")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "broadcasts")
 MINIO_PUBLIC_URL = os.getenv("MINIO_PUBLIC_URL", "https://craveme.tech")
 
+# Попыток выставить флаг отмены для воркера
+CANCEL_FLAG_ATTEMPTS = 3
+
 
 # ==================== SCHEMAS ====================
 
@@ -393,6 +397,30 @@ async def cancel_broadcast(broadcast_id: int):
             await db.commit()
             await db.refresh(broadcast)
 
+            # Флаг для воркера: запущенная рассылка проверяет его перед каждой пачкой
+            # (статус в БД воркер перечитывает реже - раз в несколько пачек)
+            for attempt in range(1, CANCEL_FLAG_ATTEMPTS + 1):
+                try:
+                    await redis_client.set(
+                        BROADCAST_CANCEL_KEY.format(broadcast_id=broadcast_id),
+                        "1",
+                        expire=BROADCAST_CANCEL_TTL,
+                    )
+                    break
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to set cancel flag for broadcast {broadcast_id} "
+                        f"(attempt {attempt}/{CANCEL_FLAG_ATTEMPTS}): {e}"
+                    )
+                    if attempt < CANCEL_FLAG_ATTEMPTS:
+                        await asyncio.sleep(0.5 * attempt)
+            else:
+                # Отмена уже сохранена - воркер увидит её при проверке статуса в БД
+                logger.error(
+                    f"Cancel flag for broadcast {broadcast_id} not set, "
+                    f"worker will stop on its next DB status check"
+                )
+
             logger.info(f"Cancelled broadcast {broadcast_id}")
 
             return broadcast_to_response(broadcast)
@@ -9,6 +9,9 @@ from sqlalchemy import text
 from shared.database import get_db
 from shared.schemas import HealthResponse
 from shared.utils import redis_client, get_logger
+from app.services.llm_client import llm_client
+from app.services.embedding_service import embedding_service
+from app.services.image_results import image_result_waiter
 
 logger = get_logger(__name__)
 router = APIRouter()
@@ -81,5 +84,8 @@ async def metrics():
     return {
         "api_requests_total": 0,
         "api_requests_duration_seconds": 0.0,
+        "llm_client": llm_client.get_stats(),
+        "embeddings": embedding_service.get_stats(),
+        "image_results": image_result_waiter.get_stats(),
         "timestamp": datetime.utcnow()
     }
@@ -3,16 +3,23 @@ Chat API routes for webapp
 
 Main endpoint for chatting with personas
 """
+import asyncio
+import json
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional
 
-from shared.database import get_db
+from shared.database import get_db, AsyncSessionLocal
 
-from app.services.chat_flow import process_chat_message, generate_persona_greeting
+from app.services.chat_flow import ChatResult, process_chat_message, generate_persona_greeting
 from app.api.webapp.dependencies import WebAppUser
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -58,6 +65,34 @@ class GreetingResponse(BaseModel):
     dialog_id: Optional[int] = None
 
 
+def _to_chat_response(result: ChatResult) -> ChatResponse:
+    """Convert ChatFlow result to API response"""
+    return ChatResponse(
+        success=result.success,
+        response=result.response,
+        error=result.error,
+        dialog_id=result.dialog_id,
+        is_safety_block=result.is_safety_block,
+        message_count=result.message_count,
+        image_url=result.image_url,
+        no_image_quota=result.no_image_quota,
+    )
+
+
+def _validate_message(request: ChatRequest) -> None:
+    """Reject empty and oversized messages"""
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+
+    if len(request.message) > 4000:
+        raise HTTPException(status_code=400, detail="Message too long (max 4000 chars)")
+
+
+def _sse(event: dict) -> str:
+    """Format event as Server-Sent Events chunk"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
 # ==================== ROUTES ====================
 
 @router.post("/chat", response_model=ChatResponse)
@@ -83,11 +118,7 @@ async def send_message(
     Returns:
         ChatResponse with persona's reply
     """
-    if not request.message.strip():
-        raise HTTPException(status_code=400, detail="Message cannot be empty")
-
-    if len(request.message) > 4000:
-        raise HTTPException(status_code=400, detail="Message too long (max 4000 chars)")
+    _validate_message(request)
 
     result = await process_chat_message(
         db=db,
@@ -99,16 +130,74 @@ async def send_message(
         atmosphere=request.atmosphere,
     )
 
-    return ChatResponse(
-        success=result.success,
-        response=result.response,
-        error=result.error,
-        dialog_id=result.dialog_id,
-        is_safety_block=result.is_safety_block,
-        message_count=result.message_count,
-        image_url=result.image_url,
-        no_image_quota=result.no_image_quota,
-    )
+    return _to_chat_response(result)
+
+
+@router.post("/chat/stream")
+async def send_message_stream(request: ChatRequest):
+    """
+    Send a message and stream the persona's reply (SSE).
+
+    Same flow as POST /chat, but the LLM reply is streamed as it is generated.
+
+    Events (each is `data: {json}`):
+    - {"type": "delta", "content": "..."} - next text fragment
+    - {"type": "result", ...ChatResponse} - final result (post-processed
+      response, image_url, etc.), always the last event
+
+    Args:
+        request: ChatRequest with message and optional settings
+    """
+    _validate_message(request)
+
+    async def event_stream():
+        queue: asyncio.Queue[str] = asyncio.Queue()
+
+        async def on_delta(text: str) -> None:
+            await queue.put(text)
+
+        # Own session: dependencies with yield are closed before a
+        # StreamingResponse body is sent
+        async with AsyncSessionLocal() as db:
+            task = asyncio.create_task(process_chat_message(
+                db=db,
+                telegram_id=request.telegram_id,
+                message=request.message.strip(),
+                persona_id=request.persona_id,
+                mode=request.mode,
+                story_id=request.story_id,
+                atmosphere=request.atmosphere,
+                on_delta=on_delta,
+            ))
+            try:
+                while not task.done():
+                    getter = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter.done():
+                        yield _sse({"type": "delta", "content": getter.result()})
+                    else:
+                        getter.cancel()
+
+                while not queue.empty():
+                    yield _sse({"type": "delta", "content": queue.get_nowait()})
+
+                # Same transaction semantics as get_db: commit on normal
+                # exit (early returns included), roll back on error
+                try:
+                    result = task.result()
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    logger.error(f"Chat stream failed for user {request.telegram_id}: {e}", exc_info=True)
+                    result = ChatResult(success=False, error="Internal server error")
+
+                yield _sse({"type": "result", **_to_chat_response(result).model_dump()})
+            finally:
+                # Client went away mid-stream: the session closes uncommitted
+                if not task.done():
+                    task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @router.post("/chat/greeting", response_model=GreetingResponse)
@@ -8,6 +8,7 @@ from typing import Optional
 from pydantic import BaseModel
 
 from shared.database import get_db, User, Persona, AccessStatus
+from shared.llm.services.prompt_builder import invalidate_prompt_cache
 from app.api.webapp.dependencies import WebAppUser
 
 router = APIRouter()
@@ -326,6 +327,7 @@ async def create_custom_persona(
             existing.short_description = request.short_description
             existing.description_short = request.vibe or ""
             await db.commit()
+            invalidate_prompt_cache(existing.key)
             return CreateCustomPersonaResponse(
                 success=True,
                 persona_id=existing.id,
@@ -27,14 +27,28 @@ class APIConfig(BaseSettings):
 
     # LLM Gateway
     llm_gateway_url: str = os.getenv("LLM_GATEWAY_URL", "http://llm-gateway:8001")
+    llm_http2: bool = os.getenv("LLM_HTTP2", "True").lower() == "true"
+    llm_max_connections: int = int(os.getenv("LLM_MAX_CONNECTIONS", 500))  # Streaming chats hold one each for the whole reply
+    llm_max_keepalive_connections: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+    llm_keepalive_expiry: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30.0))
+    llm_connect_timeout: float = float(os.getenv("LLM_CONNECT_TIMEOUT", 5.0))
+    llm_read_timeout: float = float(os.getenv("LLM_READ_TIMEOUT", 90.0))  # Must be > LLM_TIMEOUT (80s) in gateway
+    llm_pool_timeout: float = float(os.getenv("LLM_POOL_TIMEOUT", 30.0))  # Wait for a free pooled connection
 
     # OpenRouter (for embeddings)
     openrouter_api_key: str = os.getenv("OPENROUTER_API_KEY", "")
     embedding_model: str = os.getenv("EMBEDDING_MODEL", "openai/text-embedding-3-small")
+    embedding_cache_size: int = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))  # LRU entries (~6KB each)
+    embedding_cache_ttl: int = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))  # Redis tier, seconds
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+    embedding_batch_window_ms: int = int(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 15))
 
     # Qdrant
     qdrant_url: str = os.getenv("QDRANT_URL", "http://qdrant:6333")
     qdrant_collection: str = os.getenv("QDRANT_COLLECTION", "vitte_memories")
+    memory_write_queue_size: int = int(os.getenv("MEMORY_WRITE_QUEUE_SIZE", 2000))
+    memory_write_batch_size: int = int(os.getenv("MEMORY_WRITE_BATCH_SIZE", 64))
+    memory_write_flush_ms: int = int(os.getenv("MEMORY_WRITE_FLUSH_MS", 500))
     
     # CORS
     cors_origins: str = os.getenv("CORS_ORIGINS", "http://localhost:3000")
@@ -7,6 +7,9 @@ from contextlib import asynccontextmanager
 
 from app.config import config
 from app.api import v1_router, webapp_router, payments_router
+from app.services.llm_client import llm_client
+from app.services.embedding_service import embedding_service
+from app.services.image_results import image_result_waiter
 from shared.database import init_db, close_db
 from shared.utils import get_logger
 
@@ -19,11 +22,17 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info(f"Starting API service in {config.environment} mode...")
     logger.info("Database migrations should be run separately before starting services")
+    await llm_client.start()
+    await embedding_service.start()
+    await image_result_waiter.start()
 
     yield
 
     # Shutdown
     logger.info("Shutting down API service...")
+    await llm_client.close()
+    await embedding_service.close()
+    await image_result_waiter.close()
     await close_db()
     logger.info("API service shutdown complete")
 
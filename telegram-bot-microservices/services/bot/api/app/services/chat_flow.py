@@ -3,8 +3,9 @@ Chat Flow - главный оркестратор чата
 
 Управляет потоком:
 1. Safety check входящего сообщения
-2. Получение/создание диалога (5-slot система)
-3. Загрузка истории из PostgreSQL (последние 12 сообщений)
+2. Загрузка контекста одним запросом: пользователь, подписка, персонаж,
+   диалог и история (последние 12 сообщений) — см. dialog_context
+3. Создание диалога, если активного ещё нет (слот-система)
 4. Поиск релевантных воспоминаний из Qdrant
 5. Построение промпта через PromptBuilder
 6. Отправка в LLM Gateway
@@ -15,14 +16,15 @@ import logging
 import json
 import re
 from dataclasses import dataclass
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 from datetime import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_
 
-from shared.database.models import User, Dialog, Message, Persona, FeatureUnlock, Subscription
-from shared.database.image_service import get_images_remaining, use_image_quota
+from shared.database.models import User, Dialog, Message, Persona, FeatureUnlock
+from shared.database.image_service import ImageQuotaResult, reserve_image_quota, refund_image_quota
+from shared.database.session import AsyncSessionLocal
 from shared.llm.services.safety import run_safety_check, get_supportive_reply, get_supportive_reply_en
 from shared.llm.services.intimacy import get_intimacy_instruction
 from shared.llm.services.prompt_builder import (
@@ -30,9 +32,9 @@ from shared.llm.services.prompt_builder import (
     Message as PromptMessage,
     build_chat_messages,
 )
-from shared.utils import redis_client
+from shared.database.services import get_daily_message_limit
+from shared.utils import redis_client, DAILY_MESSAGES_KEY
 
-from celery.result import AsyncResult
 
 from shared.llm.services.image_prompt_builder import (
     build_image_prompt_messages,
@@ -47,9 +49,11 @@ from shared.llm.services.sex_images import (
 )
 from shared.llm.services.sex_scene_detector import detect_sex_scene
 
-from .llm_client import llm_client
+from .llm_client import llm_client, LLMStreamError
 from .embedding_service import embedding_service
+from .dialog_context import load_dialog_context
 from .image_generation import ImageGenerationService
+from .image_results import image_result_waiter
 from app.utils.celery_client import celery_app
 
 logger = logging.getLogger(__name__)
@@ -59,6 +63,9 @@ MAX_DIALOG_SLOTS = 10
 RECENT_MESSAGES_COUNT = 12
 FEATURES_CACHE_TTL = 300  # 5 минут кэш для фич
 
+# Колбэк для стриминга ответа: вызывается с каждым новым фрагментом текста
+DeltaCallback = Callable[[str], Awaitable[None]]
+
 
 @dataclass
 class ChatResult:
@@ -176,6 +183,16 @@ class ChatFlow:
                 dialog.atmosphere = atmosphere
             return dialog
 
+        return await self.create_dialog(user, persona_id, story_id, atmosphere)
+
+    async def create_dialog(
+        self,
+        user: User,
+        persona_id: int,
+        story_id: Optional[str] = None,
+        atmosphere: Optional[str] = None,
+    ) -> Dialog:
+        """Создать новый диалог, заняв свободный слот (если есть)."""
         # Считаем активные слоты
         result = await self.db.execute(
             select(func.count(Dialog.id)).where(
@@ -262,6 +279,29 @@ class ChatFlow:
         await self.db.flush()
         return message
 
+    async def _reserve_image(self, telegram_id: int) -> ImageQuotaResult:
+        """
+        Зарезервировать изображение в отдельной короткой транзакции.
+
+        Резерв фиксируется сразу: блокировка строки баланса не держится,
+        пока ждём LLM и ComfyUI, а параллельные генерации видят списание.
+        """
+        async with AsyncSessionLocal() as session:
+            result = await reserve_image_quota(session, telegram_id)
+            if result.can_generate:
+                await session.commit()
+            return result
+
+    async def _refund_image(self, telegram_id: int, source: Optional[str]):
+        """Вернуть зарезервированное изображение (генерация не удалась)."""
+        try:
+            async with AsyncSessionLocal() as session:
+                if await refund_image_quota(session, telegram_id, source):
+                    await session.commit()
+            debug_logger.warning(f"IMG: refunded 1 image to {source}")
+        except Exception as e:
+            logger.error(f"Image quota refund failed for user {telegram_id}: {e}")
+
     async def get_user_features(self, user_id: int) -> set[str]:
         """
         Получить активные фичи пользователя.
@@ -300,6 +340,28 @@ class ChatFlow:
 
         return features
 
+    async def _stream_llm(
+        self,
+        messages: list[dict],
+        on_delta: DeltaCallback,
+        **params,
+    ) -> Optional[str]:
+        """
+        Стримить ответ LLM, передавая фрагменты в on_delta.
+
+        Returns:
+            Полный текст ответа или None при ошибке
+        """
+        parts = []
+        try:
+            async for delta in llm_client.chat_completion_stream(messages=messages, **params):
+                parts.append(delta)
+                await on_delta(delta)
+        except LLMStreamError as e:
+            debug_logger.warning(f"LLM stream error after {len(parts)} chunks: {e}")
+            return None
+        return "".join(parts) or None
+
     async def process_message(
         self,
         telegram_id: int,
@@ -308,6 +370,7 @@ class ChatFlow:
         mode: str = "default",
         story_id: Optional[str] = None,
         atmosphere: Optional[str] = None,
+        on_delta: Optional[DeltaCallback] = None,
     ) -> ChatResult:
         """
         Обработать сообщение пользователя.
@@ -319,6 +382,8 @@ class ChatFlow:
             mode: Режим диалога (default, greeting_first, etc.)
             story_id: ID истории/сценария
             atmosphere: Атмосфера диалога
+            on_delta: Если указан - ответ LLM стримится, фрагменты
+                передаются в колбэк по мере генерации
 
         Returns:
             ChatResult с ответом или ошибкой
@@ -328,17 +393,21 @@ class ChatFlow:
         # 1. Safety check (синхронный, мгновенный)
         safety_result = run_safety_check(user_message)
 
-        # 2. Получаем пользователя
-        user = await self.get_user(telegram_id)
-        if not user:
+        # 2. Загружаем пользователя, подписку, персонажа, диалог и историю
+        # одним запросом к PostgreSQL
+        context = await load_dialog_context(
+            self.db,
+            telegram_id=telegram_id,
+            persona_id=persona_id,
+            story_id=story_id,
+            messages_limit=RECENT_MESSAGES_COUNT,
+        )
+        if not context:
             return ChatResult(success=False, error="User not found")
+        user = context.user
+        persona = context.persona
 
         if not safety_result.is_safe:
-            persona = None
-            if persona_id:
-                persona = await self.get_persona(persona_id)
-            elif user.active_persona_id:
-                persona = await self.get_persona(user.active_persona_id)
             persona_name = persona.name if persona else "Vitte"
             lang = user.language_code or "ru"
             if lang == "en":
@@ -351,33 +420,18 @@ class ChatFlow:
                 is_safety_block=True,
             )
 
-        # 2.5. Check message limit (free users: 20/day)
+        # 2.5. Check message limit (лимит по тарифу, атомарно: проверка + инкремент)
         try:
-            sub_result = await self.db.execute(
-                select(Subscription).where(Subscription.user_id == telegram_id)
-            )
-            subscription = sub_result.scalar_one_or_none()
-            has_active_sub = False
-            if subscription and subscription.is_active:
-                now = datetime.utcnow()
-                if subscription.expires_at and subscription.expires_at > now:
-                    has_active_sub = True
-
-            if not has_active_sub:
-                redis_key = f"user:{telegram_id}:messages:daily"
-                current_count = await redis_client.get(redis_key)
-                if current_count is not None and int(current_count) >= 20:
+            daily_limit = get_daily_message_limit(context.subscription)
+            if daily_limit is not None:
+                allowed, _ = await redis_client.increment_daily(
+                    DAILY_MESSAGES_KEY.format(user_id=telegram_id), daily_limit
+                )
+                if not allowed:
                     return ChatResult(
                         success=False,
-                        error="Дневной лимит сообщений исчерпан (20/день). Оформите подписку для безлимитного общения.",
+                        error=f"Дневной лимит сообщений исчерпан ({daily_limit}/день). Оформите подписку для безлимитного общения.",
                     )
-                if current_count is None:
-                    now = datetime.utcnow()
-                    midnight = datetime(now.year, now.month, now.day, 23, 59, 59)
-                    seconds_until_midnight = int((midnight - now).total_seconds()) + 1
-                    await redis_client.set(redis_key, "1", expire=seconds_until_midnight)
-                else:
-                    await redis_client.increment(redis_key)
         except Exception as e:
             debug_logger.warning(f"Message limit check error (allowing): {e}")
 
@@ -386,21 +440,24 @@ class ChatFlow:
             persona_id = user.active_persona_id
         if not persona_id:
             return ChatResult(success=False, error="No persona selected")
-
-        persona = await self.get_persona(persona_id)
         if not persona:
             return ChatResult(success=False, error="Persona not found")
 
-        # 4. Получаем диалог
-        dialog = await self.get_or_create_dialog(
-            user=user,
-            persona_id=persona_id,
-            story_id=story_id,
-            atmosphere=atmosphere,
-        )
+        # 4. Получаем диалог (создаём только если активного ещё нет)
+        dialog = context.dialog
+        recent_messages = context.recent_messages
+        if dialog:
+            if atmosphere and dialog.atmosphere != atmosphere:
+                dialog.atmosphere = atmosphere
+        else:
+            dialog = await self.create_dialog(
+                user=user,
+                persona_id=persona_id,
+                story_id=story_id,
+                atmosphere=atmosphere,
+            )
 
-        # 5. Параллельно: история (DB) + features (Redis) + Qdrant (HTTP)
-        # Эти три запроса идут в РАЗНЫЕ сервисы — безопасно параллелить
+        # 5. Параллельно: features (Redis) + Qdrant (HTTP)
         need_memories = dialog.message_count and dialog.message_count > 5
 
         async def _search_memories():
@@ -417,9 +474,7 @@ class ChatFlow:
                 debug_logger.warning(f"Qdrant search error: {e}")
                 return None
 
-        # DB query (messages) — sequential, т.к. та же session
-        recent_messages = await self.get_recent_messages(dialog.id)
-
+        # История уже загружена вместе с контекстом
         # Redis + Qdrant — параллельно (разные сервисы)
         features, memories = await asyncio.gather(
             self.get_user_features(telegram_id),
@@ -523,17 +578,23 @@ class ChatFlow:
         from sqlalchemy.orm.attributes import flag_modified
         image_url = None
         image_celery_task = None
+        image_quota_source = None  # Откуда зарезервировано изображение для ComfyUI
         sex_image_from_pool = False
         no_quota_flag = False
 
         # Launch main LLM in parallel with image pipeline
-        llm_task = asyncio.ensure_future(llm_client.chat_completion(
-            messages=messages,
+        llm_params = dict(
             temperature=0.85,
             max_tokens=600,
             presence_penalty=0.3,
             frequency_penalty=0.4,
-        ))
+            route="chat",
+            tenant=str(user.id),
+        )
+        if on_delta:
+            llm_task = asyncio.ensure_future(self._stream_llm(messages, on_delta, **llm_params))
+        else:
+            llm_task = asyncio.ensure_future(llm_client.chat_completion(messages=messages, **llm_params))
 
         try:
             service = ImageGenerationService(celery_app)
@@ -585,6 +646,8 @@ class ChatFlow:
                             messages=img_messages,
                             temperature=0.7,
                             max_tokens=120,
+                            cache=True,
+                            route="image_prompt",
                         )
                         if raw:
                             result = assemble_final_prompt(persona.key, raw)
@@ -639,10 +702,13 @@ class ChatFlow:
                         debug_logger.warning(f"IMG: nude context detected → using Moody model")
 
                     # Not sex pool → ComfyUI generation (ZIT or Moody)
-                    image_quota = await get_images_remaining(self.db, telegram_id)
-                    debug_logger.warning(f"IMG: ComfyUI path (moody={use_moody}), quota: can={image_quota.can_generate}, remaining={image_quota.total_remaining}")
+                    # Резервируем изображение до запуска генерации (атомарно);
+                    # если генерация не удастся - вернём его
+                    image_quota = await self._reserve_image(telegram_id)
+                    debug_logger.warning(f"IMG: ComfyUI path (moody={use_moody}), quota: can={image_quota.can_generate}, reserved from={image_quota.source}, remaining={image_quota.total_remaining}")
 
                     if image_quota.can_generate:
+                        image_quota_source = image_quota.source
                         story_seed = get_story_seed(persona.key, story_id or dialog.story_id)
                         model_override = 2 if use_moody else None
                         image_celery_task = celery_app.send_task(
@@ -657,6 +723,10 @@ class ChatFlow:
                         debug_logger.warning(f"IMG: skipped - no image quota remaining")
         except Exception as e:
             debug_logger.warning(f"IMG ERROR: {e}", exc_info=True)
+            if image_quota_source and not image_celery_task:
+                # Зарезервировали, но задачу так и не отправили
+                await self._refund_image(telegram_id, image_quota_source)
+                image_quota_source = None
 
         # 10. Await main LLM (was launched in parallel with image pipeline above)
         response = await llm_task
@@ -669,6 +739,9 @@ class ChatFlow:
             response = _remove_duplicate_sentences(response)
 
         if not response:
+            if image_quota_source:
+                # Ответа нет - картинку пользователь не получит
+                await self._refund_image(telegram_id, image_quota_source)
             return ChatResult(
                 success=False,
                 error="LLM Gateway error",
@@ -680,48 +753,33 @@ class ChatFlow:
         if image_celery_task:
             try:
                 debug_logger.warning(f"IMG: LLM done, waiting for ComfyUI task_id={image_celery_task.id} (max 90s)")
-                async_result = AsyncResult(image_celery_task.id, app=celery_app)
-                result_data = await asyncio.to_thread(
-                    async_result.get, timeout=90, propagate=False
-                )
+                # Ждём через pub/sub результата Celery - без потока на каждый запрос
+                result_data = await image_result_waiter.wait(image_celery_task.id, timeout=90)
                 if result_data and isinstance(result_data, dict) and result_data.get('success'):
+                    # Резерв остаётся списанным (only for ComfyUI, not sex pool)
                     image_url = result_data.get('image_url')
-                    # Deduct 1 image from quota (only for ComfyUI, not sex pool)
-                    quota_result = await use_image_quota(self.db, telegram_id)
-                    debug_logger.warning(f"IMG: got image: {image_url}, deducted from={quota_result.source}, remaining={quota_result.total_remaining}")
+                    debug_logger.warning(f"IMG: got image: {image_url}, charged from={image_quota_source}")
                 else:
                     debug_logger.warning(f"IMG: generation failed or bad result: {result_data}")
             except Exception as e:
                 debug_logger.warning(f"IMG: timeout/error waiting for ComfyUI: {e}")
+            if not image_url:
+                await self._refund_image(telegram_id, image_quota_source)
 
         # 11. Сохраняем сообщения в PostgreSQL
         await self.save_message(dialog, "user", user_message)
         await self.save_message(dialog, "assistant", response,
                                 extra_data={"image_url": image_url} if image_url else None)
 
-        # 12. Сохраняем в Qdrant (fire-and-forget — не блокируем ответ юзеру)
-        async def _store_memories():
-            try:
-                await asyncio.gather(
-                    embedding_service.store_memory(
-                        user_id=telegram_id,
-                        dialog_id=dialog.id,
-                        persona_id=persona_id,
-                        text=user_message,
-                        role="user",
-                    ),
-                    embedding_service.store_memory(
-                        user_id=telegram_id,
-                        dialog_id=dialog.id,
-                        persona_id=persona_id,
-                        text=response,
-                        role="assistant",
-                    ),
-                )
-            except Exception as e:
-                logger.warning(f"Failed to store memories: {e}")
-
-        asyncio.ensure_future(_store_memories())
+        # 12. Сохраняем в Qdrant (очередь с батчевой записью — не блокируем ответ юзеру)
+        for role, text in (("user", user_message), ("assistant", response)):
+            embedding_service.enqueue_memory(
+                user_id=telegram_id,
+                dialog_id=dialog.id,
+                persona_id=persona_id,
+                text=text,
+                role=role,
+            )
 
         # 14. Коммитим изменения
         await self.db.commit()
@@ -756,29 +814,40 @@ class ChatFlow:
         Returns:
             ChatResult с приветствием
         """
-        user = await self.get_user(telegram_id)
-        if not user:
+        context = await load_dialog_context(
+            self.db,
+            telegram_id=telegram_id,
+            persona_id=persona_id,
+            story_id=story_id,
+            messages_limit=RECENT_MESSAGES_COUNT,
+        )
+        if not context:
             return ChatResult(success=False, error="User not found")
+        user = context.user
 
-        persona = await self.get_persona(persona_id)
+        persona = context.persona
         if not persona:
             return ChatResult(success=False, error="Persona not found")
 
         # Получаем или создаём диалог
-        dialog = await self.get_or_create_dialog(
-            user=user,
-            persona_id=persona_id,
-            story_id=story_id,
-            atmosphere=atmosphere,
-        )
+        dialog = context.dialog
+        if dialog:
+            if atmosphere and dialog.atmosphere != atmosphere:
+                dialog.atmosphere = atmosphere
+        else:
+            dialog = await self.create_dialog(
+                user=user,
+                persona_id=persona_id,
+                story_id=story_id,
+                atmosphere=atmosphere,
+            )
 
-        # Загружаем историю если это возврат
+        # История уже загружена вместе с контекстом — берём её если это возврат
         prompt_messages = []
         if is_return and dialog.message_count and dialog.message_count > 0:
-            recent_messages = await self.get_recent_messages(dialog.id)
             prompt_messages = [
                 PromptMessage(role=m.role, content=m.content)
-                for m in recent_messages[-4:]  # Берём только 4 последних для контекста
+                for m in context.recent_messages[-4:]  # Берём только 4 последних для контекста
             ]
 
         # Режим приветствия
@@ -828,6 +897,7 @@ class ChatFlow:
             messages=messages,
             temperature=0.9,
             max_tokens=600,
+            route="greeting",
         )
 
         if not response:
@@ -857,6 +927,7 @@ async def process_chat_message(
     mode: str = "default",
     story_id: Optional[str] = None,
     atmosphere: Optional[str] = None,
+    on_delta: Optional[DeltaCallback] = None,
 ) -> ChatResult:
     """
     Удобная функция для обработки сообщения.
@@ -869,6 +940,7 @@ async def process_chat_message(
         mode: Режим диалога
         story_id: ID истории
         atmosphere: Атмосфера
+        on_delta: Колбэк для стриминга ответа (опционально)
 
     Returns:
         ChatResult
@@ -881,6 +953,7 @@ async def process_chat_message(
         mode=mode,
         story_id=story_id,
         atmosphere=atmosphere,
+        on_delta=on_delta,
     )
 
 
@@ -919,6 +992,7 @@ async def generate_persona_greeting(
 __all__ = [
     "ChatResult",
     "ChatFlow",
+    "DeltaCallback",
     "process_chat_message",
     "generate_persona_greeting",
 ]
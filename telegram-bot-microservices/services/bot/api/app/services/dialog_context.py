@@ -0,0 +1,120 @@
+"""
+Dialog Context - загрузка контекста чата за один запрос к PostgreSQL
+
+Вместо цепочки последовательных запросов (пользователь → подписка →
+персонаж → диалог → история) собирает всё одним SELECT:
+
+    users
+      LEFT JOIN subscriptions
+      LEFT JOIN personas
+      LEFT JOIN LATERAL (активный диалог с персонажем, LIMIT 1)
+      LEFT JOIN LATERAL (последние N сообщений диалога)
+
+Результат — типизированный DialogContext. Если активного диалога нет,
+ChatFlow создаёт его отдельно (редкий путь — только первое сообщение).
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from shared.database.models import User, Subscription, Persona, Dialog, Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DialogContext:
+    """Всё, что нужно ChatFlow до вызова LLM."""
+    user: User
+    subscription: Optional[Subscription] = None
+    persona: Optional[Persona] = None
+    dialog: Optional[Dialog] = None
+    recent_messages: list[Message] = field(default_factory=list)  # Старые сначала
+
+
+async def load_dialog_context(
+    db: AsyncSession,
+    telegram_id: int,
+    persona_id: Optional[int] = None,
+    story_id: Optional[str] = None,
+    messages_limit: int = 12,
+) -> Optional[DialogContext]:
+    """
+    Загрузить пользователя, подписку, персонажа, активный диалог и историю
+    одним запросом.
+
+    Args:
+        db: AsyncSession
+        telegram_id: Telegram user ID
+        persona_id: ID персонажа (если не указан - активный персонаж пользователя)
+        story_id: ID истории (если указан - диалог ищется с этой историей)
+        messages_limit: Сколько последних сообщений загрузить
+
+    Returns:
+        DialogContext или None, если пользователь не найден
+    """
+    persona_ref = persona_id if persona_id else User.active_persona_id
+
+    # Активный диалог с персонажем (коррелирует с users/personas из внешнего FROM)
+    dialog_query = select(Dialog).where(
+        Dialog.user_id == User.id,
+        Dialog.persona_id == Persona.id,
+        Dialog.is_active == True,
+    )
+    if story_id:
+        dialog_query = dialog_query.where(Dialog.story_id == story_id)
+    dialog_lateral = (
+        dialog_query
+        .order_by(Dialog.id.desc())
+        .limit(1)
+        .lateral("active_dialog")
+    )
+    active_dialog = aliased(Dialog, dialog_lateral)
+
+    # Последние сообщения этого диалога
+    messages_lateral = (
+        select(Message)
+        .where(Message.dialog_id == active_dialog.id)
+        .order_by(Message.created_at.desc())
+        .limit(messages_limit)
+        .lateral("recent_messages")
+    )
+    recent_message = aliased(Message, messages_lateral)
+
+    stmt = (
+        select(User, Subscription, Persona, active_dialog, recent_message)
+        .outerjoin(Subscription, Subscription.user_id == User.id)
+        .outerjoin(Persona, Persona.id == persona_ref)
+        .outerjoin(dialog_lateral, true())
+        .outerjoin(messages_lateral, true())
+        .where(User.id == telegram_id)
+        .order_by(recent_message.created_at.desc())
+    )
+
+    result = await db.execute(stmt)
+    rows = result.all()
+    if not rows:
+        return None
+
+    user, subscription, persona, dialog, _ = rows[0]
+    messages = [row[4] for row in rows if row[4] is not None]
+    messages.reverse()  # Старые сначала
+
+    return DialogContext(
+        user=user,
+        subscription=subscription,
+        persona=persona,
+        dialog=dialog,
+        recent_messages=messages,
+    )
+
+
+__all__ = [
+    "DialogContext",
+    "load_dialog_context",
+]
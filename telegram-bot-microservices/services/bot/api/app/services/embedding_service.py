@@ -1,20 +1,93 @@
 """
 Embedding service for vector memory with Qdrant
 
-Uses OpenRouter API for text-embedding-3-small embeddings
+Uses OpenRouter API for text-embedding-3-small embeddings.
+
+Embeddings are cached by content hash (model + text) in two tiers:
+in-process LRU and Redis (float32, base64). Cache misses are
+micro-batched: create_embedding() calls arriving within a short window
+are sent as one multi-input /embeddings request.
+
+Memory writes go through a bounded queue (enqueue_memory): a background
+writer embeds and upserts them to Qdrant in batches, flushed on size or
+time. The collection is checked once at startup, not per write.
 """
 
+import asyncio
+import base64
 import hashlib
 import httpx
 import logging
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from typing import Optional
 from datetime import datetime
 
 from app.config import config
+from shared.utils import redis_client
 
 logger = logging.getLogger(__name__)
 
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1"
+EMBEDDING_CACHE_PREFIX = "emb:"
+
+# Queued by close(): the writer flushes its current batch and exits
+_STOP_WRITER = object()
+
+
+class _EmbeddingLRU:
+    """In-process LRU of embedding vectors (stored as float32 arrays)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, array]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[array]:
+        vector = self._data.get(key)
+        if vector is not None:
+            self._data.move_to_end(key)
+        return vector
+
+    def put(self, key: str, vector: array) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = vector
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+@dataclass
+class MemoryRecord:
+    """Memory waiting in the write queue."""
+    user_id: int
+    dialog_id: int
+    persona_id: int
+    text: str
+    role: str
+    metadata: Optional[dict] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+    def point_id(self) -> int:
+        """Stable uint64 point ID (Qdrant needs uint64)."""
+        raw = f"{self.user_id}_{self.dialog_id}_{self.role}_{self.created_at.timestamp()}_{self.text}"
+        return int(hashlib.sha256(raw.encode()).hexdigest()[:16], 16)
+
+    def payload(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "dialog_id": self.dialog_id,
+            "persona_id": self.persona_id,
+            "text": self.text,
+            "role": self.role,
+            "timestamp": self.created_at.isoformat(),
+            **(self.metadata or {}),
+        }
 
 
 class EmbeddingService:
@@ -27,6 +100,112 @@ class EmbeddingService:
         self.collection = config.qdrant_collection
         self.vector_size = 1536  # text-embedding-3-small dimension
 
+        # Embedding cache
+        self.cache_ttl = config.embedding_cache_ttl
+        self._lru = _EmbeddingLRU(config.embedding_cache_size)
+
+        # Micro-batching of cache misses
+        self.batch_size = config.embedding_batch_size
+        self.batch_window = config.embedding_batch_window_ms / 1000
+        self._pending: dict[str, asyncio.Future] = {}
+        self._pending_texts: dict[str, str] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_tasks: set[asyncio.Task] = set()  # Keep references to running flushes
+
+        # Memory write pipeline
+        self.write_batch_size = config.memory_write_batch_size
+        self.write_flush_interval = config.memory_write_flush_ms / 1000
+        self._write_queue: asyncio.Queue = asyncio.Queue(maxsize=config.memory_write_queue_size)
+        self._writer_task: Optional[asyncio.Task] = None
+        self._collection_ready = False
+        self._write_stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "batches": 0,
+            "points_written": 0,
+            "points_failed": 0,
+            "flush_ms_last": 0.0,
+            "flush_ms_max": 0.0,
+            "flush_ms_total": 0.0,
+        }
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stats = {
+            "lru_hits": 0,
+            "redis_hits": 0,
+            "api_texts": 0,
+            "api_requests": 0,
+            "api_errors": 0,
+            "coalesced": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared HTTP client for OpenRouter and Qdrant (keep-alive between calls)."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def start(self) -> None:
+        """Check Qdrant collection and start memory writer (app startup)."""
+        self._collection_ready = await self.ensure_collection()
+        if self._writer_task is None:
+            self._writer_task = asyncio.ensure_future(self._memory_writer())
+
+    async def close(self) -> None:
+        """Drain memory queue, flush pending embeddings, close HTTP client."""
+        if self._writer_task is not None:
+            # Not cancel(): records the writer already took off the queue
+            # would be lost mid-batch
+            await self._write_queue.put(_STOP_WRITER)
+            await self._writer_task
+            self._writer_task = None
+
+            # Write what is left in the queue
+            records = []
+            while not self._write_queue.empty():
+                records.append(self._write_queue.get_nowait())
+            for start in range(0, len(records), self.write_batch_size):
+                await self._write_batch(records[start:start + self.write_batch_size])
+
+        if self._pending:
+            await self._flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_stats(self) -> dict:
+        """Embedding cache / batching and memory write metrics."""
+        writes = dict(self._write_stats)
+        total_ms = writes.pop("flush_ms_total")
+        writes["flush_ms_avg"] = round(total_ms / writes["batches"], 1) if writes["batches"] else 0.0
+        writes["queue_depth"] = self._write_queue.qsize()
+        writes["queue_max"] = self._write_queue.maxsize
+        return {
+            **self._stats,
+            "lru_size": len(self._lru),
+            "pending": len(self._pending),
+            "memory_writes": writes,
+        }
+
+    # === Embeddings ===
+
+    def _cache_key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model}\0{text.strip()}".encode("utf-8")).hexdigest()
+        return f"{EMBEDDING_CACHE_PREFIX}{digest}"
+
+    @staticmethod
+    def _encode(vector: array) -> str:
+        return base64.b64encode(vector.tobytes()).decode("ascii")
+
+    @staticmethod
+    def _decode(value: str) -> array:
+        vector = array("f")
+        vector.frombytes(base64.b64decode(value))
+        return vector
+
     async def create_embedding(self, text: str) -> Optional[list[float]]:
         """
         Create embedding vector for text using OpenRouter.
@@ -37,10 +216,115 @@ class EmbeddingService:
         Returns:
             List of floats (embedding vector) or None if failed
         """
+        return (await self.create_embeddings([text]))[0]
+
+    async def create_embeddings(self, texts: list[str]) -> list[Optional[list[float]]]:
+        """
+        Create embedding vectors for several texts.
+
+        Served from LRU when possible; misses join the current batch
+        (identical texts share one slot) and are resolved by one
+        Redis MGET plus one multi-input API request.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Vectors in the same order (None for failed ones)
+        """
         if not self.api_key:
             logger.error("OPENROUTER_API_KEY not configured")
-            return None
+            return [None] * len(texts)
+
+        loop = asyncio.get_running_loop()
+        results: list[Optional[array]] = [None] * len(texts)
+        waiting: list[tuple[int, asyncio.Future]] = []
+
+        for i, text in enumerate(texts):
+            key = self._cache_key(text)
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._stats["lru_hits"] += 1
+                results[i] = vector
+                continue
+
+            future = self._pending.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._pending[key] = future
+                self._pending_texts[key] = text
+            else:
+                self._stats["coalesced"] += 1
+            waiting.append((i, future))
+
+        if waiting:
+            if len(self._pending) >= self.batch_size:
+                task = asyncio.ensure_future(self._flush())
+                self._flush_tasks.add(task)
+                task.add_done_callback(self._flush_tasks.discard)
+            elif self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.ensure_future(self._flush_later())
+
+            for i, future in waiting:
+                # shield: one caller cancelling must not cancel the shared slot
+                results[i] = await asyncio.shield(future)
+
+        return [list(vector) if vector is not None else None for vector in results]
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_window)
+        await self._flush()
+
+    async def _flush(self) -> None:
+        """Resolve all pending texts: Redis tier first, then one API batch."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        texts, self._pending_texts = self._pending_texts, {}
+        keys = list(pending)
 
+        try:
+            # Redis tier
+            missing = keys
+            try:
+                cached = await redis_client.get_many(keys)
+                missing = []
+                for key in keys:
+                    value = cached.get(key)
+                    if value:
+                        vector = self._decode(value)
+                        self._lru.put(key, vector)
+                        self._stats["redis_hits"] += 1
+                        pending[key].set_result(vector)
+                    else:
+                        missing.append(key)
+            except Exception as e:
+                logger.warning(f"Embedding cache read error: {e}")
+
+            # API for the rest
+            for start in range(0, len(missing), self.batch_size):
+                chunk = missing[start:start + self.batch_size]
+                vectors = await self._request_embeddings([texts[key] for key in chunk])
+
+                to_cache = {}
+                for key, vector in zip(chunk, vectors):
+                    if vector is not None:
+                        self._lru.put(key, vector)
+                        to_cache[key] = self._encode(vector)
+                    pending[key].set_result(vector)
+
+                if to_cache:
+                    try:
+                        await redis_client.set_many(to_cache, expire=self.cache_ttl)
+                    except Exception as e:
+                        logger.warning(f"Embedding cache write error: {e}")
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_result(None)
+
+    async def _request_embeddings(self, texts: list[str]) -> list[Optional[array]]:
+        """One multi-input /embeddings request; vectors in input order."""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -48,85 +332,136 @@ class EmbeddingService:
 
         payload = {
             "model": self.model,
-            "input": text,
+            "input": texts,
         }
 
+        self._stats["api_requests"] += 1
+        self._stats["api_texts"] += len(texts)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{OPENROUTER_API_URL}/embeddings",
-                    headers=headers,
-                    json=payload,
-                    timeout=30.0,
+            response = await self._get_client().post(
+                f"{OPENROUTER_API_URL}/embeddings",
+                headers=headers,
+                json=payload,
+            )
+
+            if response.status_code != 200:
+                self._stats["api_errors"] += 1
+                logger.error(
+                    f"OpenRouter embedding error: {response.status_code} - {response.text}"
                 )
+                return [None] * len(texts)
 
-                if response.status_code != 200:
-                    logger.error(
-                        f"OpenRouter embedding error: {response.status_code} - {response.text}"
-                    )
-                    return None
+            data = response.json()
+            embeddings = data.get("data", [])
 
-                data = response.json()
-                embeddings = data.get("data", [])
+            if not embeddings:
+                self._stats["api_errors"] += 1
+                logger.error("OpenRouter returned empty embeddings")
+                return [None] * len(texts)
 
-                if not embeddings:
-                    logger.error("OpenRouter returned empty embeddings")
-                    return None
-
-                return embeddings[0].get("embedding")
+            vectors: list[Optional[array]] = [None] * len(texts)
+            for position, item in enumerate(embeddings):
+                index = item.get("index", position)
+                embedding = item.get("embedding")
+                if embedding and 0 <= index < len(texts):
+                    vectors[index] = array("f", embedding)
+            return vectors
 
         except httpx.RequestError as e:
+            self._stats["api_errors"] += 1
             logger.error(f"OpenRouter request error: {e}")
-            return None
+            return [None] * len(texts)
         except Exception as e:
+            self._stats["api_errors"] += 1
             logger.error(f"Unexpected error creating embedding: {e}")
-            return None
+            return [None] * len(texts)
 
     async def ensure_collection(self) -> bool:
         """Ensure Qdrant collection exists."""
+        client = self._get_client()
         try:
-            async with httpx.AsyncClient() as client:
-                # Check if collection exists
-                response = await client.get(
-                    f"{self.qdrant_url}/collections/{self.collection}",
-                    timeout=10.0,
-                )
+            # Check if collection exists
+            response = await client.get(
+                f"{self.qdrant_url}/collections/{self.collection}",
+                timeout=10.0,
+            )
+
+            if response.status_code == 200:
+                return True
+
+            # Create collection
+            payload = {
+                "vectors": {
+                    "size": self.vector_size,
+                    "distance": "Cosine",
+                }
+            }
+
+            response = await client.put(
+                f"{self.qdrant_url}/collections/{self.collection}",
+                json=payload,
+                timeout=10.0,
+            )
+
+            if response.status_code in (200, 201):
+                logger.info(f"Created Qdrant collection: {self.collection}")
+                # Create payload indexes for fast filtering
+                for field_name in ["user_id", "persona_id"]:
+                    await client.put(
+                        f"{self.qdrant_url}/collections/{self.collection}/index",
+                        json={"field_name": field_name, "field_schema": "integer"},
+                        timeout=10.0,
+                    )
+                return True
 
-                if response.status_code == 200:
-                    return True
+            logger.error(f"Failed to create collection: {response.text}")
+            return False
 
-                # Create collection
-                payload = {
-                    "vectors": {
-                        "size": self.vector_size,
-                        "distance": "Cosine",
-                    }
-                }
+        except Exception as e:
+            logger.error(f"Error ensuring collection: {e}")
+            return False
 
-                response = await client.put(
-                    f"{self.qdrant_url}/collections/{self.collection}",
-                    json=payload,
-                    timeout=10.0,
-                )
+    # === Memory writes ===
 
-                if response.status_code in (200, 201):
-                    logger.info(f"Created Qdrant collection: {self.collection}")
-                    # Create payload indexes for fast filtering
-                    for field in ["user_id", "persona_id"]:
-                        await client.put(
-                            f"{self.qdrant_url}/collections/{self.collection}/index",
-                            json={"field_name": field, "field_schema": "integer"},
-                            timeout=10.0,
-                        )
-                    return True
+    def enqueue_memory(
+        self,
+        user_id: int,
+        dialog_id: int,
+        persona_id: int,
+        text: str,
+        role: str,
+        metadata: Optional[dict] = None,
+    ) -> bool:
+        """
+        Queue a memory for batched write to Qdrant (non-blocking).
 
-                logger.error(f"Failed to create collection: {response.text}")
-                return False
+        The queue is bounded: when Qdrant falls behind, new memories are
+        dropped (and counted) instead of piling up tasks.
 
-        except Exception as e:
-            logger.error(f"Error ensuring collection: {e}")
+        Returns:
+            True if queued, False if dropped
+        """
+        record = MemoryRecord(
+            user_id=user_id,
+            dialog_id=dialog_id,
+            persona_id=persona_id,
+            text=text,
+            role=role,
+            metadata=metadata,
+        )
+        try:
+            self._write_queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._write_stats["dropped"] += 1
+            logger.warning(f"Memory write queue full ({self._write_queue.maxsize}), dropping memory")
             return False
 
+        self._write_stats["enqueued"] += 1
+        if self._writer_task is None:
+            # Used outside the app lifespan (scripts) - start lazily
+            self._writer_task = asyncio.ensure_future(self._memory_writer())
+        return True
+
     async def store_memory(
         self,
         user_id: int,
@@ -137,7 +472,9 @@ class EmbeddingService:
         metadata: Optional[dict] = None,
     ) -> bool:
         """
-        Store a memory (message) in Qdrant.
+        Store a memory (message) in Qdrant immediately.
+
+        Prefer enqueue_memory() on the request path.
 
         Args:
             user_id: Telegram user ID
@@ -150,50 +487,101 @@ class EmbeddingService:
         Returns:
             True if stored successfully
         """
-        embedding = await self.create_embedding(text)
-        if not embedding:
-            return False
-
-        await self.ensure_collection()
-
-        point_id = f"{user_id}_{dialog_id}_{datetime.utcnow().timestamp()}"
-        stable_id = int(hashlib.sha256(point_id.encode()).hexdigest()[:16], 16)
+        record = MemoryRecord(
+            user_id=user_id,
+            dialog_id=dialog_id,
+            persona_id=persona_id,
+            text=text,
+            role=role,
+            metadata=metadata,
+        )
+        return await self._write_batch([record]) == 1
+
+    async def _memory_writer(self) -> None:
+        """Background writer: collect records into batches, flush on size or time."""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self._write_queue.get()
+            if record is _STOP_WRITER:
+                return
+            batch = [record]
+            deadline = loop.time() + self.write_flush_interval
+
+            while len(batch) < self.write_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._write_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is _STOP_WRITER:
+                    stopping = True
+                    break
+                batch.append(record)
+
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Memory writer error: {e}")
+
+    async def _write_batch(self, records: list[MemoryRecord]) -> int:
+        """
+        Embed records (one batched request) and upsert them in one Qdrant call.
 
-        payload = {
-            "user_id": user_id,
-            "dialog_id": dialog_id,
-            "persona_id": persona_id,
-            "text": text,
-            "role": role,
-            "timestamp": datetime.utcnow().isoformat(),
-            **(metadata or {}),
-        }
+        Returns:
+            Number of points written
+        """
+        if not records:
+            return 0
 
+        started = time.perf_counter()
+        written = 0
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.put(
-                    f"{self.qdrant_url}/collections/{self.collection}/points",
-                    json={
-                        "points": [
-                            {
-                                "id": stable_id,  # Qdrant needs uint64, sha256-based stable ID
-                                "vector": embedding,
-                                "payload": payload,
-                            }
-                        ]
-                    },
-                    timeout=10.0,
-                )
-
-                if response.status_code in (200, 201):
-                    return True
-
-                logger.error(f"Failed to store memory: {response.text}")
-                return False
+            vectors = await self.create_embeddings([record.text for record in records])
+            points = [
+                {
+                    "id": record.point_id(),
+                    "vector": vector,
+                    "payload": record.payload(),
+                }
+                for record, vector in zip(records, vectors)
+                if vector
+            ]
+            if not points:
+                return 0
+
+            if not self._collection_ready:
+                self._collection_ready = await self.ensure_collection()
+
+            response = await self._get_client().put(
+                f"{self.qdrant_url}/collections/{self.collection}/points",
+                json={"points": points},
+                timeout=10.0,
+            )
+
+            if response.status_code in (200, 201):
+                written = len(points)
+            else:
+                if response.status_code == 404:
+                    self._collection_ready = False  # Collection dropped - recreate on next batch
+                logger.error(f"Failed to store memories: {response.text}")
+
+            return written
 
         except Exception as e:
-            logger.error(f"Error storing memory: {e}")
-            return False
+            logger.error(f"Error storing memories: {e}")
+            return written
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats = self._write_stats
+            stats["batches"] += 1
+            stats["points_written"] += written
+            stats["points_failed"] += len(records) - written
+            stats["flush_ms_last"] = round(elapsed_ms, 1)
+            stats["flush_ms_max"] = round(max(stats["flush_ms_max"], elapsed_ms), 1)
+            stats["flush_ms_total"] += elapsed_ms
 
     async def search_memories(
         self,
@@ -221,41 +609,40 @@ class EmbeddingService:
             return []
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.qdrant_url}/collections/{self.collection}/points/search",
-                    json={
-                        "vector": embedding,
-                        "limit": limit,
-                        "score_threshold": min_score,
-                        "filter": {
-                            "must": [
-                                {"key": "user_id", "match": {"value": user_id}},
-                                {"key": "persona_id", "match": {"value": persona_id}},
-                            ]
-                        },
-                        "with_payload": True,
+            response = await self._get_client().post(
+                f"{self.qdrant_url}/collections/{self.collection}/points/search",
+                json={
+                    "vector": embedding,
+                    "limit": limit,
+                    "score_threshold": min_score,
+                    "filter": {
+                        "must": [
+                            {"key": "user_id", "match": {"value": user_id}},
+                            {"key": "persona_id", "match": {"value": persona_id}},
+                        ]
                     },
-                    timeout=10.0,
-                )
+                    "with_payload": True,
+                },
+                timeout=10.0,
+            )
 
-                if response.status_code != 200:
-                    logger.error(f"Search failed: {response.text}")
-                    return []
+            if response.status_code != 200:
+                logger.error(f"Search failed: {response.text}")
+                return []
 
-                data = response.json()
-                results = []
+            data = response.json()
+            results = []
 
-                for hit in data.get("result", []):
-                    payload = hit.get("payload", {})
-                    results.append({
-                        "text": payload.get("text", ""),
-                        "role": payload.get("role", ""),
-                        "score": hit.get("score", 0),
-                        "timestamp": payload.get("timestamp", ""),
-                    })
+            for hit in data.get("result", []):
+                payload = hit.get("payload", {})
+                results.append({
+                    "text": payload.get("text", ""),
+                    "role": payload.get("role", ""),
+                    "score": hit.get("score", 0),
+                    "timestamp": payload.get("timestamp", ""),
+                })
 
-                return results
+            return results
 
         except Exception as e:
             logger.error(f"Error searching memories: {e}")
@@ -273,21 +660,20 @@ class EmbeddingService:
             True if deleted successfully
         """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.qdrant_url}/collections/{self.collection}/points/delete",
-                    json={
-                        "filter": {
-                            "must": [
-                                {"key": "user_id", "match": {"value": user_id}},
-                                {"key": "dialog_id", "match": {"value": dialog_id}},
-                            ]
-                        }
-                    },
-                    timeout=10.0,
-                )
+            response = await self._get_client().post(
+                f"{self.qdrant_url}/collections/{self.collection}/points/delete",
+                json={
+                    "filter": {
+                        "must": [
+                            {"key": "user_id", "match": {"value": user_id}},
+                            {"key": "dialog_id", "match": {"value": dialog_id}},
+                        ]
+                    }
+                },
+                timeout=10.0,
+            )
 
-                return response.status_code in (200, 201)
+            return response.status_code in (200, 201)
 
         except Exception as e:
             logger.error(f"Error deleting memories: {e}")
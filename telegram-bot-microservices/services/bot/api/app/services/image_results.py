@@ -0,0 +1,169 @@
+"""
+Image result waiter
+
+Awaits image-generator Celery results without parking a thread per request
+(AsyncResult.get blocks the calling thread for the whole generation).
+
+The Redis result backend publishes every stored task state on a channel
+named after its key (celery-task-meta-<task_id>). One shared pub/sub
+connection subscribes to the channel of each pending task and resolves its
+future when a final state (SUCCESS / FAILURE / REVOKED) arrives. The result
+key is read right after subscribing, so a task that finished before the
+subscription is not missed.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+from celery import Celery, states
+
+from app.utils.celery_client import celery_app
+
+logger = logging.getLogger(__name__)
+
+# Keeps the pub/sub connection subscribed while no task is pending
+CONTROL_CHANNEL = "image_results:waiter"
+
+
+class ImageResultWaiter:
+    """Shared pub/sub listener resolving per-task futures"""
+
+    def __init__(self, app: Celery = celery_app):
+        self.backend = app.backend
+        self.redis_url = app.conf.result_backend
+
+        self._client: Optional[aioredis.Redis] = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+        self._waiters: dict[str, asyncio.Future] = {}
+
+        # Metrics
+        self._stats = {
+            "waits": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "already_done": 0,
+            "listener_errors": 0,
+        }
+
+    async def start(self) -> None:
+        """Open pub/sub connection and start listener (app startup, or lazily)."""
+        async with self._start_lock:
+            if self._listener is not None:
+                return
+            self._client = aioredis.from_url(
+                self.redis_url,
+                decode_responses=True,
+                socket_connect_timeout=5,
+            )
+            self._pubsub = self._client.pubsub()
+            await self._pubsub.subscribe(CONTROL_CHANNEL)
+            self._listener = asyncio.ensure_future(self._listen())
+            logger.info("Image result waiter started")
+
+    async def close(self) -> None:
+        """Stop listener, release pending waiters, close connections."""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+        for future in self._waiters.values():
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def get_stats(self) -> dict:
+        """Waiter metrics."""
+        return {**self._stats, "pending": len(self._waiters)}
+
+    def _key(self, task_id: str) -> str:
+        return self.backend.get_key_for_task(task_id).decode()
+
+    def _resolve(self, key: str, payload: str) -> None:
+        future = self._waiters.get(key)
+        if future is None or future.done():
+            return
+        try:
+            meta = self.backend.decode_result(payload)
+        except Exception as e:
+            logger.error(f"Undecodable result on {key}: {e}")
+            return
+        # STARTED / RETRY are published too - wait for a final state
+        if meta.get("status") in states.READY_STATES:
+            future.set_result(meta)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message["type"] == "message":
+                    self._resolve(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # redis-py reconnects and resubscribes on the next read
+                self._stats["listener_errors"] += 1
+                logger.error(f"Image result listener error: {e}")
+                await asyncio.sleep(1.0)
+
+    async def wait(self, task_id: str, timeout: float) -> Optional[dict]:
+        """
+        Wait for an image task result.
+
+        Args:
+            task_id: Celery task id
+            timeout: Max seconds to wait
+
+        Returns:
+            Task return value on success; None on failure, revoke or timeout
+        """
+        if self._listener is None:
+            await self.start()
+
+        self._stats["waits"] += 1
+        key = self._key(task_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key] = future
+        try:
+            await self._pubsub.subscribe(key)
+            stored = await self._client.get(key)
+            if stored is not None:
+                self._resolve(key, stored)
+                if future.done():
+                    self._stats["already_done"] += 1
+            meta = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            return None
+        finally:
+            self._waiters.pop(key, None)
+            try:
+                await self._pubsub.unsubscribe(key)
+            except Exception as e:
+                logger.warning(f"Failed to unsubscribe from {key}: {e}")
+
+        if meta.get("status") != states.SUCCESS:
+            self._stats["failed"] += 1
+            logger.warning(f"Image task {task_id} finished with {meta.get('status')}: {meta.get('result')}")
+            return None
+        self._stats["completed"] += 1
+        return meta.get("result")
+
+
+# Global waiter instance
+image_result_waiter = ImageResultWaiter()
@@ -1,12 +1,21 @@
 """
 LLM Client service for communicating with LLM Gateway
 
-Uses OpenAI-compatible API to send chat completions requests
+Uses OpenAI-compatible API to send chat completions requests.
+
+All calls share one pooled httpx.AsyncClient (keep-alive, HTTP/2 where the
+transport negotiates it, bounded connection limits). The FastAPI lifespan
+owns it via start()/close(); outside the app it is created lazily.
+A streaming chat holds its connection for the whole reply, so the pool is
+sized for streaming concurrency and waiting for a free connection has its
+own timeout (LLM_POOL_TIMEOUT), separate from the connect timeout.
 """
 
 import httpx
+import json
 import logging
-from typing import Optional
+from collections import Counter
+from typing import AsyncIterator, Optional
 
 from app.config import config
 
@@ -14,12 +23,96 @@ logger = logging.getLogger(__name__)
 debug_logger = logging.getLogger("uvicorn.error")
 
 
+class LLMStreamError(Exception):
+    """Streaming request to LLM Gateway failed"""
+
+
 class LLMClient:
     """Client for LLM Gateway API"""
 
     def __init__(self):
         self.base_url = config.llm_gateway_url.rstrip("/")
-        self.timeout = 90.0  # Must be > LLM_TIMEOUT (80s) in gateway
+        self.timeout = httpx.Timeout(
+            config.llm_read_timeout,
+            connect=config.llm_connect_timeout,
+            pool=config.llm_pool_timeout,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Connection reuse metrics
+        self._requests_total = 0
+        self._connections_opened = 0
+        self._pool_timeouts = 0
+        self._http_versions: Counter = Counter()
+
+    # === Connection pool lifecycle ===
+
+    async def start(self) -> None:
+        """Create the shared HTTP client (called from app lifespan)."""
+        if self._client is not None:
+            return
+
+        http2 = config.llm_http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("LLM_HTTP2 enabled but 'h2' package is missing, using HTTP/1.1")
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=config.llm_max_connections,
+                max_keepalive_connections=config.llm_max_keepalive_connections,
+                keepalive_expiry=config.llm_keepalive_expiry,
+            ),
+        )
+        logger.info(
+            f"LLM client pool started: http2={http2}, "
+            f"max_connections={config.llm_max_connections}, "
+            f"keepalive={config.llm_max_keepalive_connections}"
+        )
+
+    async def close(self) -> None:
+        """Close the shared HTTP client and its connections."""
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logger.info("LLM client pool closed")
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Shared client; created lazily when used outside the app lifespan."""
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        """httpcore trace hook: counts newly opened TCP connections."""
+        if event_name == "connection.connect_tcp.complete":
+            self._connections_opened += 1
+
+    def _record_response(self, response: httpx.Response) -> None:
+        self._requests_total += 1
+        self._http_versions[response.http_version] += 1
+
+    def get_stats(self) -> dict:
+        """Connection pool metrics."""
+        reused = max(self._requests_total - self._connections_opened, 0)
+        return {
+            "requests_total": self._requests_total,
+            "connections_opened": self._connections_opened,
+            "requests_on_reused_connection": reused,
+            "connection_reuse_ratio": (
+                round(reused / self._requests_total, 3) if self._requests_total else 0.0
+            ),
+            "pool_timeouts": self._pool_timeouts,
+            "http_versions": dict(self._http_versions),
+            "pool_started": self._client is not None,
+        }
 
     async def chat_completion(
         self,
@@ -27,9 +120,11 @@ class LLMClient:
         model: str = "deepseek/deepseek-v3.2",
         temperature: float = 0.8,
         max_tokens: int = 1024,
-        stream: bool = False,
         presence_penalty: Optional[float] = None,
         frequency_penalty: Optional[float] = None,
+        cache: Optional[bool] = None,
+        route: Optional[str] = None,
+        tenant: Optional[str] = None,
     ) -> Optional[str]:
         """
         Send chat completion request to LLM Gateway.
@@ -39,53 +134,57 @@ class LLMClient:
             model: Model to use (default: deepseek-v3.2)
             temperature: Sampling temperature (0.0 - 2.0)
             max_tokens: Maximum tokens in response
-            stream: Whether to stream response (not implemented yet)
             presence_penalty: Penalty for token presence (-2.0 to 2.0, positive = new topics)
             frequency_penalty: Penalty for frequent tokens (-2.0 to 2.0, positive = less repetition)
+            cache: Gateway response cache: True - use, False - bypass,
+                None - gateway decides (low temperature only)
+            route: Caller label for gateway cache metrics (X-LLM-Route)
+            tenant: Per-tenant rate limit bucket in gateway (X-LLM-Tenant)
 
         Returns:
             Assistant's response text or None if failed
         """
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": stream,
-        }
-
-        # Добавляем опциональные параметры против повторений (OpenAI-compatible)
-        if presence_penalty is not None:
-            payload["presence_penalty"] = presence_penalty
-        if frequency_penalty is not None:
-            payload["frequency_penalty"] = frequency_penalty
+        payload = self._build_payload(
+            messages, model, temperature, max_tokens,
+            presence_penalty, frequency_penalty, stream=False,
+        )
+        if cache is not None:
+            payload["cache"] = cache
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/v1/chat/completions",
-                    json=payload,
-                    timeout=self.timeout,
-                )
+            client = await self._get_client()
+            response = await client.post(
+                "/v1/chat/completions",
+                json=payload,
+                headers=self._headers(route, tenant),
+                extensions={"trace": self._trace},
+            )
+            self._record_response(response)
 
-                if response.status_code != 200:
-                    debug_logger.warning(
-                        f"LLM Gateway error: {response.status_code} - {response.text[:500]}"
-                    )
-                    return None
+            if response.status_code != 200:
+                debug_logger.warning(
+                    f"LLM Gateway error: {response.status_code} - {response.text[:500]}"
+                )
+                return None
 
-                data = response.json()
-                choices = data.get("choices", [])
+            data = response.json()
+            choices = data.get("choices", [])
 
-                if not choices:
-                    debug_logger.warning(f"LLM Gateway returned empty choices. Response: {data}")
-                    return None
+            if not choices:
+                debug_logger.warning(f"LLM Gateway returned empty choices. Response: {data}")
+                return None
 
-                content = choices[0].get("message", {}).get("content")
-                if not content:
-                    debug_logger.warning(f"LLM Gateway returned empty content. Choices: {choices}")
-                return content
+            content = choices[0].get("message", {}).get("content")
+            if not content:
+                debug_logger.warning(f"LLM Gateway returned empty content. Choices: {choices}")
+            return content
 
+        except httpx.PoolTimeout:
+            self._pool_timeouts += 1
+            debug_logger.warning(
+                f"LLM client pool exhausted ({config.llm_max_connections} connections busy)"
+            )
+            return None
         except httpx.TimeoutException:
             debug_logger.warning("LLM Gateway request timed out")
             return None
@@ -96,15 +195,127 @@ class LLMClient:
             debug_logger.warning(f"Unexpected error calling LLM Gateway: {e}")
             return None
 
+    async def chat_completion_stream(
+        self,
+        messages: list[dict],
+        model: str = "deepseek/deepseek-v3.2",
+        temperature: float = 0.8,
+        max_tokens: int = 1024,
+        presence_penalty: Optional[float] = None,
+        frequency_penalty: Optional[float] = None,
+        route: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream chat completion from LLM Gateway (SSE).
+
+        Args: same as chat_completion (streams are never cached)
+
+        Yields:
+            Text deltas as they arrive from the gateway
+
+        Raises:
+            LLMStreamError: gateway returned an error status or an error chunk
+        """
+        payload = self._build_payload(
+            messages, model, temperature, max_tokens,
+            presence_penalty, frequency_penalty, stream=True,
+        )
+
+        try:
+            client = await self._get_client()
+            async with client.stream(
+                "POST",
+                "/v1/chat/completions",
+                json=payload,
+                headers=self._headers(route, tenant),
+                extensions={"trace": self._trace},
+            ) as response:
+                self._record_response(response)
+
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise LLMStreamError(
+                        f"LLM Gateway error: {response.status_code} - {body[:500]!r}"
+                    )
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        return
+
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        debug_logger.warning(f"LLM Gateway sent malformed chunk: {data[:200]}")
+                        continue
+                    if "error" in chunk:
+                        raise LLMStreamError(
+                            f"LLM Gateway stream error: {chunk['error'].get('message')}"
+                        )
+
+                    choices = chunk.get("choices", [])
+                    if not choices:
+                        continue
+                    content = choices[0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+
+        except httpx.PoolTimeout as e:
+            self._pool_timeouts += 1
+            raise LLMStreamError(
+                f"LLM client pool exhausted ({config.llm_max_connections} connections busy)"
+            ) from e
+        except httpx.TimeoutException as e:
+            raise LLMStreamError("LLM Gateway stream timed out") from e
+        except httpx.RequestError as e:
+            raise LLMStreamError(f"LLM Gateway stream request error: {e}") from e
+
+    @staticmethod
+    def _headers(route: Optional[str], tenant: Optional[str]) -> dict:
+        """Caller label (metrics) and tenant (rate limiting) headers."""
+        headers = {}
+        if route:
+            headers["X-LLM-Route"] = route
+        if tenant:
+            headers["X-LLM-Tenant"] = tenant
+        return headers
+
+    @staticmethod
+    def _build_payload(
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        presence_penalty: Optional[float],
+        frequency_penalty: Optional[float],
+        stream: bool,
+    ) -> dict:
+        """Build OpenAI-compatible request payload."""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream,
+        }
+
+        # Добавляем опциональные параметры против повторений (OpenAI-compatible)
+        if presence_penalty is not None:
+            payload["presence_penalty"] = presence_penalty
+        if frequency_penalty is not None:
+            payload["frequency_penalty"] = frequency_penalty
+
+        return payload
+
     async def health_check(self) -> bool:
         """Check if LLM Gateway is healthy."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/v1/health",
-                    timeout=5.0,
-                )
-                return response.status_code == 200
+            client = await self._get_client()
+            response = await client.get("/v1/health", timeout=5.0)
+            return response.status_code == 200
         except Exception:
             return False
 
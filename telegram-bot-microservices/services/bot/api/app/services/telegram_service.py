@@ -9,6 +9,7 @@ import logging
 from typing import Optional, Dict, Any
 
 from app.config import config
+from shared.utils import telegram_file_cache
 
 logger = logging.getLogger(__name__)
 
@@ -164,10 +165,16 @@ async def send_photo_bytes(
     caption: Optional[str] = None,
     parse_mode: str = "HTML",
     filename: str = "photo.png",
-) -> bool:
-    """Send photo as bytes (multipart upload) to Telegram."""
+) -> Optional[str]:
+    """
+    Send photo as bytes (multipart upload) to Telegram.
+
+    Returns:
+        file_id of the sent photo (reuse it instead of uploading again),
+        None if sending failed
+    """
     if not config.bot_token:
-        return False
+        return None
 
     data = {
         "chat_id": str(chat_id),
@@ -189,13 +196,14 @@ async def send_photo_bytes(
             result = response.json()
             if result.get("ok"):
                 logger.info(f"Sent photo bytes to {chat_id}")
-                return True
+                sizes = result.get("result", {}).get("photo") or [{}]
+                return sizes[-1].get("file_id", "")
             else:
                 logger.error(f"Failed to send photo bytes: {result.get('description')}")
-                return False
+                return None
     except Exception as e:
         logger.error(f"Error sending photo bytes: {e}")
-        return False
+        return None
 
 
 async def send_greeting(
@@ -236,11 +244,24 @@ async def send_greeting(
         debug_logger.warning(f"GREETING: persona={persona_key}, story={story_key}, index={greeting_image_index}, url={minio_url}")
 
         if minio_url:
+            # Pool images are sent over and over - reuse Telegram file_id
+            cached_file_id = await telegram_file_cache.get(minio_url)
+            if cached_file_id:
+                photo_sent = await send_photo(chat_id, cached_file_id)
+                if photo_sent:
+                    debug_logger.warning("GREETING: photo sent by cached file_id")
+                else:
+                    await telegram_file_cache.forget(minio_url)
+
+        if minio_url and not photo_sent:
             try:
                 async with httpx.AsyncClient() as client:
                     img_resp = await client.get(minio_url, timeout=10.0)
                     if img_resp.status_code == 200:
-                        photo_sent = await send_photo_bytes(chat_id, img_resp.content)
+                        file_id = await send_photo_bytes(chat_id, img_resp.content)
+                        photo_sent = file_id is not None
+                        if file_id:
+                            await telegram_file_cache.set(minio_url, file_id)
                         debug_logger.warning(f"GREETING: photo sent OK, size={len(img_resp.content)}")
                     else:
                         debug_logger.warning(f"GREETING: download failed HTTP {img_resp.status_code} from {minio_url}")
@@ -7,7 +7,7 @@ from aiogram.enums import ParseMode
 
 from app.config import config
 from app.handlers import start_router, help_router, status_router, onboarding_router, menu_router, chat_router, subscription_router, shop_router, upgrades_router, settings_router, messages_router
-from app.middlewares import ThrottlingMiddleware, AntiFloodMiddleware, i18n_middleware
+from app.middlewares import ThrottlingMiddleware, i18n_middleware
 from shared.utils import get_logger
 
 logger = get_logger(__name__)
@@ -29,18 +29,15 @@ def create_dispatcher() -> Dispatcher:
     # 1. i18n - must be FIRST to provide translation context to all handlers
     i18n_middleware.setup(dispatcher=dp)
 
-    # 2. Anti-flood - strict protection (3 requests per 5 seconds)
-    dp.message.middleware(AntiFloodMiddleware(
-        limit=config.antiflood_limit,
-        window=config.antiflood_window
-    ))
-
-    # 3. Throttling - normal rate limiting
+    # 2. Throttling + anti-flood - normal rate limit and strict flood protection
+    #    (3 requests per 5 seconds), checked together in one Redis call
     dp.message.middleware(ThrottlingMiddleware(
         message_limit=config.rate_limit_messages,
         message_window=config.rate_limit_messages_window,
         callback_limit=config.rate_limit_callbacks,
-        callback_window=config.rate_limit_callbacks_window
+        callback_window=config.rate_limit_callbacks_window,
+        antiflood_limit=config.antiflood_limit,
+        antiflood_window=config.antiflood_window
     ))
 
     # Register callback query middlewares
@@ -41,6 +41,10 @@ class BotConfig(BaseSettings):
     # Start image URL (для existing users с диалогами)
     start_image_url: str = os.getenv("START_IMAGE_URL", "https://craveme.tech/storage/universal_pic.jpeg")
 
+    # Chat reply streaming (progressive message edits)
+    chat_streaming_enabled: bool = os.getenv("CHAT_STREAMING_ENABLED", "True").lower() == "true"
+    stream_edit_interval: float = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # seconds between edits (Telegram edit limits)
+
     # Rate Limiting
     rate_limit_messages: int = int(os.getenv("RATE_LIMIT_MESSAGES", "10"))  # per minute
     rate_limit_messages_window: int = int(os.getenv("RATE_LIMIT_MESSAGES_WINDOW", "60"))  # seconds
@@ -13,9 +13,10 @@ from sqlalchemy.orm import selectinload
 from datetime import datetime, timezone
 
 from app.config import config
+from app.services.photo_sender import prepare_photo, send_photo_cached
 from shared.utils import get_logger
-from shared.utils.redis import redis_client
-from shared.database import get_db, get_user_by_id, User
+from shared.utils.redis import redis_client, DAILY_MESSAGES_KEY
+from shared.database import get_db, get_user_by_id, User, get_daily_message_limit, FREE_DAILY_MESSAGES_LIMIT
 
 logger = get_logger(__name__)
 router = Router(name="menu")
@@ -123,6 +124,7 @@ async def get_user_status(user_id: int) -> dict:
     status = {
         "subscription": "Free",
         "messages_today": 0,
+        "messages_limit": FREE_DAILY_MESSAGES_LIMIT,
         "images_remaining": 0,
         "features": []
     }
@@ -152,10 +154,11 @@ async def get_user_status(user_id: int) -> dict:
                 subscription.expires_at > datetime.now(timezone.utc)
             )
             status["subscription"] = "Premium" if has_active_sub else "Free"
+            status["messages_limit"] = get_daily_message_limit(subscription)
 
             # Messages today - get from Redis
             try:
-                redis_key = f"user:{user_id}:messages:daily"
+                redis_key = DAILY_MESSAGES_KEY.format(user_id=user_id)
                 current_count = await redis_client.get(redis_key)
                 status["messages_today"] = int(current_count) if current_count else 0
             except Exception as e:
@@ -222,7 +225,7 @@ def build_status_block(status: dict, lang: str = "ru") -> str:
     else:
         # Free user - show full status with limits (вертикально)
         messages_today = status["messages_today"]
-        messages_limit = 20
+        messages_limit = status["messages_limit"] or FREE_DAILY_MESSAGES_LIMIT
         messages_str = f"💬 {messages_limit - messages_today}/{messages_limit}"
 
         if lang == "ru":
@@ -290,6 +293,7 @@ async def show_main_menu(target, lang: str = "ru", user_id: int = None, is_welco
     status = await get_user_status(user_id) if user_id else {
         "subscription": "Free",
         "messages_today": 0,
+        "messages_limit": FREE_DAILY_MESSAGES_LIMIT,
         "images_remaining": 0,
         "features": []
     }
@@ -316,15 +320,19 @@ async def show_main_menu(target, lang: str = "ru", user_id: int = None, is_welco
     # Send menu with photo
     if hasattr(target, 'message'):
         # CallbackQuery - send new message with photo
-        await target.message.answer_photo(
-            photo=menu_photo_url,
+        await send_photo_cached(
+            target.message.answer_photo,
+            menu_photo_url,
+            await prepare_photo(menu_photo_url, download=False),
             caption=text,
             reply_markup=keyboard
         )
     else:
         # Message object - send photo
-        await target.answer_photo(
-            photo=menu_photo_url,
+        await send_photo_cached(
+            target.answer_photo,
+            menu_photo_url,
+            await prepare_photo(menu_photo_url, download=False),
             caption=text,
             reply_markup=keyboard
         )
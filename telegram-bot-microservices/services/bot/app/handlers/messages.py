@@ -2,21 +2,25 @@
 Message handler - process user text messages
 
 Handles incoming text messages from users and sends them to the chat API.
-Shows typing indicator and "Печатает..." message while waiting for response.
+Shows "Печатает..." placeholder, then streams the reply into it with
+throttled edits (or waits for the full reply if streaming is disabled).
 """
 import asyncio
-from datetime import datetime, timedelta, timezone
+import html
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramRetryAfter
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
-from app.services.api_client import send_chat_message
+from app.config import config
+from app.services.api_client import ChatResult, send_chat_message, stream_chat_message
+from app.services.photo_sender import prepare_photo, send_photo_cached
 from shared.database import get_db, Dialog, User, Subscription
-from shared.database.services import get_user_by_id
+from shared.database.services import get_user_by_id, get_daily_message_limit, FREE_DAILY_MESSAGES_LIMIT
 from shared.utils import get_logger
-from shared.utils.redis import redis_client
+from shared.utils.redis import redis_client, DAILY_MESSAGES_KEY
 
 logger = get_logger(__name__)
 router = Router(name="messages")
@@ -138,37 +142,66 @@ async def keep_typing(bot: Bot, chat_id: int, interval: float = 4.0):
         pass
 
 
-async def animate_typing_dots(bot: Bot, chat_id: int, message_id: int, base_text: str):
+async def get_persona_reply(
+    bot: Bot,
+    chat_id: int,
+    message_id: int,
+    display_name: str,
+    **chat_kwargs,
+) -> ChatResult:
     """
-    Animate dots in typing placeholder: . → .. → ... → . → ..
-    Updates message text every 0.5s for realistic typing feel.
-    Also keeps Telegram typing indicator alive.
+    Get persona reply from chat API.
+
+    With streaming enabled, edits message_id with the partial reply as it
+    is generated, at most once per STREAM_EDIT_INTERVAL (Telegram edit
+    limits). Typing action is shown until the first fragment arrives.
+    Returns the final ChatResult; the caller renders the final message.
     """
-    dots_cycle = [".", "..", "..."]
-    i = 0
+    typing_task = asyncio.create_task(keep_typing(bot, chat_id))
+
     try:
-        while True:
-            dot = dots_cycle[i % 3]
+        if not config.chat_streaming_enabled:
+            return await send_chat_message(telegram_id=chat_id, **chat_kwargs)
+
+        loop = asyncio.get_running_loop()
+        text = ""
+        shown = ""
+        next_edit_at = 0.0
+        result = ChatResult(success=False, error="Stream ended without result")
+
+        async for event in stream_chat_message(telegram_id=chat_id, **chat_kwargs):
+            if isinstance(event, ChatResult):
+                result = event
+                break
+
+            text += event
+            if not typing_task.done():
+                typing_task.cancel()
+
+            now = loop.time()
+            if now < next_edit_at or text.strip() == shown:
+                continue
+            next_edit_at = now + config.stream_edit_interval
+            shown = text.strip()
             try:
                 await bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=message_id,
-                    text=f"{base_text}{dot}",
+                    text=f"<b>{display_name}</b>\n\n{html.escape(shown[:3900])}",
+                    parse_mode="HTML",
                 )
+            except TelegramRetryAfter as e:
+                next_edit_at = now + e.retry_after
             except Exception:
-                pass  # Ignore edit errors (message already deleted, etc.)
-
-            # Keep Telegram typing indicator alive every 3rd cycle (~4.5s)
-            if i % 3 == 0:
-                try:
-                    await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-                except Exception:
-                    pass
+                pass  # Ignore edit errors (message deleted, not modified, etc.)
 
-            i += 1
-            await asyncio.sleep(1.5)
-    except asyncio.CancelledError:
-        pass
+        return result
+    finally:
+        typing_task.cancel()
+        try:
+            await typing_task
+        except asyncio.CancelledError:
+            pass
 
 
 async def get_active_dialog(user_id: int) -> Dialog | None:
@@ -187,51 +220,29 @@ async def get_active_dialog(user_id: int) -> Dialog | None:
 
 async def check_message_limit(user_id: int, lang: str) -> tuple[bool, str | None]:
     """
-    Check if user can send a message (free users have 20 messages/day limit).
-    Uses Redis for fast counter with automatic daily reset.
+    Check if user can send a message (daily limit by subscription tier).
+
+    Read-only pre-check to show the limit screen before calling the API;
+    the API counts the message atomically (check + increment in one step).
     Returns (can_send, error_message)
     """
-    # Check subscription status from DB (cached by get_user_by_id)
+    # Subscription tier limit (None = unlimited)
+    daily_limit = FREE_DAILY_MESSAGES_LIMIT
     async for db in get_db():
         result = await db.execute(
             select(Subscription).where(Subscription.user_id == user_id)
         )
-        subscription = result.scalar_one_or_none()
-
-        # If subscription is active, no limit
-        if subscription and subscription.is_active:
-            now = datetime.now(timezone.utc)
-            if subscription.expires_at and subscription.expires_at > now:
-                return True, None
+        daily_limit = get_daily_message_limit(result.scalar_one_or_none())
         break
 
-    # Free user - check daily limit via Redis
-    redis_key = f"user:{user_id}:messages:daily"
+    if daily_limit is None:
+        return True, None
 
     try:
-        # Get current count from Redis
-        current_count = await redis_client.get(redis_key)
-
-        if current_count is None:
-            # First message today - set counter to 1 with TTL until midnight
-            now = datetime.now(timezone.utc)
-            # Calculate seconds until midnight UTC
-            midnight = datetime(now.year, now.month, now.day, 23, 59, 59)
-            seconds_until_midnight = int((midnight - now).total_seconds()) + 1
-
-            await redis_client.set(redis_key, "1", expire=seconds_until_midnight)
-            return True, None
-
-        count = int(current_count)
-
-        # Check if limit exceeded (20 messages/day)
-        if count >= 20:
+        current_count = await redis_client.get(DAILY_MESSAGES_KEY.format(user_id=user_id))
+        if current_count is not None and int(current_count) >= daily_limit:
             error_template = LIMIT_REACHED_RU if lang == "ru" else LIMIT_REACHED_EN
-            error = error_template.format(limit=20)
-            return False, error
-
-        # Increment counter atomically
-        await redis_client.increment(redis_key)
+            return False, error_template.format(limit=daily_limit)
         return True, None
 
     except Exception as e:
@@ -247,10 +258,9 @@ async def handle_text_message(message: Message):
 
     Flow:
     1. Check if user has an active dialog
-    2. Show typing indicator
-    3. Send "Печатает..." placeholder
-    4. Call chat API
-    5. Edit placeholder with response or send error
+    2. Send "Печатает..." placeholder
+    3. Call chat API, streaming the reply into the placeholder
+    4. Edit placeholder with final response or send error
     """
     user_id = message.from_user.id
     text = message.text.strip()
@@ -303,33 +313,23 @@ async def handle_text_message(message: Message):
         persona_name = "Персонаж" if lang == "ru" else "Character"
     display_name = get_persona_display_name(persona_name)
 
-    # Send placeholder message with animated dots
+    # Send placeholder message, the reply is streamed into it
     typing_text = TYPING_RU if lang == "ru" else TYPING_EN
     base_text = typing_text.format(name=display_name)
-    placeholder = await message.answer(f"{base_text}.")
-
-    # Start animated typing dots (replaces keep_typing)
-    typing_task = asyncio.create_task(
-        animate_typing_dots(message.bot, user_id, placeholder.message_id, base_text)
+    placeholder = await message.answer(f"{base_text}...")
+
+    # Call chat API
+    result = await get_persona_reply(
+        message.bot,
+        user_id,
+        placeholder.message_id,
+        display_name,
+        message=text,
+        persona_id=dialog.persona_id,
+        story_id=dialog.story_id,
+        atmosphere=dialog.atmosphere,
     )
 
-    try:
-        # Call chat API
-        result = await send_chat_message(
-            telegram_id=user_id,
-            message=text,
-            persona_id=dialog.persona_id,
-            story_id=dialog.story_id,
-            atmosphere=dialog.atmosphere,
-        )
-    finally:
-        # Stop typing indicator when API responds (success or error)
-        typing_task.cancel()
-        try:
-            await typing_task
-        except asyncio.CancelledError:
-            pass
-
     if result.success and result.response:
         # Create inline keyboard with refresh button
         refresh_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
@@ -349,23 +349,8 @@ async def handle_text_message(message: Message):
 
         # Check if image was generated
         if result.image_url:
-            import httpx
-            from aiogram.types import BufferedInputFile
-
-            # Download image from MinIO BEFORE deleting placeholder
-            photo_file = None
-            try:
-                internal_url = result.image_url.replace(
-                    "https://craveme.tech/storage/", "http://minio:9000/vitte-bot/"
-                )
-                async with httpx.AsyncClient() as http_client:
-                    img_resp = await http_client.get(internal_url, timeout=10.0)
-                    if img_resp.status_code == 200:
-                        photo_file = BufferedInputFile(img_resp.content, filename="photo.png")
-                    else:
-                        logger.error(f"Failed to download image: HTTP {img_resp.status_code} from {internal_url}")
-            except Exception as e:
-                logger.error(f"Failed to download photo: {e}")
+            # Resolve cached file_id, or download image from MinIO BEFORE deleting placeholder
+            photo_file = await prepare_photo(result.image_url)
 
             # Delete placeholder, then send photo + text back-to-back
             try:
@@ -375,7 +360,7 @@ async def handle_text_message(message: Message):
 
             if photo_file:
                 try:
-                    await message.answer_photo(photo=photo_file)
+                    await send_photo_cached(message.answer_photo, result.image_url, photo_file)
                 except Exception as e:
                     logger.error(f"Failed to send photo: {e}")
 
@@ -510,36 +495,26 @@ async def handle_refresh(callback: CallbackQuery):
         display_name = get_persona_display_name(persona_name)
         break
 
-    # Update message to show "regenerating..." state with animated dots
+    # Update message to show "regenerating..." state
     typing_text = TYPING_RU if lang == "ru" else TYPING_EN
     base_text = typing_text.format(name=display_name)
     try:
-        await callback.message.edit_text(f"{base_text}.")
+        await callback.message.edit_text(f"{base_text}...")
     except Exception as e:
         logger.warning(f"Failed to edit message during refresh: {e}")
 
-    # Start animated typing dots
-    typing_task = asyncio.create_task(
-        animate_typing_dots(callback.bot, user_id, callback.message.message_id, base_text)
+    # Call chat API with same user message (will generate NEW response)
+    result = await get_persona_reply(
+        callback.bot,
+        user_id,
+        callback.message.message_id,
+        display_name,
+        message=user_message,
+        persona_id=dialog.persona_id,
+        story_id=dialog.story_id,
+        atmosphere=dialog.atmosphere,
     )
 
-    try:
-        # Call chat API with same user message (will generate NEW response)
-        result = await send_chat_message(
-            telegram_id=user_id,
-            message=user_message,
-            persona_id=dialog.persona_id,
-            story_id=dialog.story_id,
-            atmosphere=dialog.atmosphere,
-        )
-    finally:
-        # Stop typing indicator
-        typing_task.cancel()
-        try:
-            await typing_task
-        except asyncio.CancelledError:
-            pass
-
     if result.success and result.response:
         # Create inline keyboard with refresh button (same format)
         refresh_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
@@ -548,14 +523,8 @@ async def handle_refresh(callback: CallbackQuery):
 
         # Send image if generated
         if result.image_url:
-            import httpx
-            from aiogram.types import BufferedInputFile
             try:
-                async with httpx.AsyncClient(timeout=30) as client:
-                    img_response = await client.get(result.image_url)
-                    if img_response.status_code == 200:
-                        photo_file = BufferedInputFile(img_response.content, filename="image.png")
-                        await callback.message.answer_photo(photo=photo_file)
+                await send_photo_cached(callback.message.answer_photo, result.image_url)
             except Exception as e:
                 logger.error(f"Failed to send photo on refresh: {e}")
 
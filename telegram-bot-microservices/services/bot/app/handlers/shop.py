@@ -18,6 +18,7 @@ from shared.utils import get_logger
 from shared.services import CryptoPayService
 from sqlalchemy import select
 from app.config import config
+from app.services.photo_sender import prepare_photo, send_photo_cached
 
 logger = get_logger(__name__)
 router = Router(name="shop")
@@ -255,8 +256,10 @@ async def _show_shop_hub(user_id: int, target):
     shop_photo_url = "https://craveme.tech/storage/menu-pics/craveme-cover-shop.jpg"
 
     # Send shop hub with photo
-    await target.answer_photo(
-        photo=shop_photo_url,
+    await send_photo_cached(
+        target.answer_photo,
+        shop_photo_url,
+        await prepare_photo(shop_photo_url, download=False),
         caption=text,
         reply_markup=keyboard,
         parse_mode="HTML"
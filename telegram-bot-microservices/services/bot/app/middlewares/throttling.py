@@ -1,7 +1,7 @@
 """
 Throttling middleware for rate limiting bot requests
 """
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, TelegramObject
 
@@ -10,11 +10,26 @@ from shared.utils import rate_limiter, get_logger
 logger = get_logger(__name__)
 
 
+async def _answer_flood(event: TelegramObject):
+    """Warn user that anti-flood protection kicked in"""
+    if isinstance(event, Message):
+        await event.answer(
+            "🚫 Обнаружен флуд! Вы заблокированы на несколько секунд.",
+            parse_mode="HTML"
+        )
+    elif isinstance(event, CallbackQuery):
+        await event.answer(
+            "🚫 Флуд обнаружен!",
+            show_alert=True
+        )
+
+
 class ThrottlingMiddleware(BaseMiddleware):
     """
     Middleware for rate limiting user requests
 
-    Applies different limits for different event types
+    Applies different limits for different event types; optionally also
+    enforces the anti-flood window in the same atomic check
     """
 
     def __init__(
@@ -22,7 +37,9 @@ class ThrottlingMiddleware(BaseMiddleware):
         message_limit: int = 10,
         message_window: int = 60,
         callback_limit: int = 20,
-        callback_window: int = 60
+        callback_window: int = 60,
+        antiflood_limit: Optional[int] = None,
+        antiflood_window: int = 5
     ):
         """
         Initialize throttling middleware
@@ -32,12 +49,17 @@ class ThrottlingMiddleware(BaseMiddleware):
             message_window: Time window for messages (seconds)
             callback_limit: Max callbacks per window
             callback_window: Time window for callbacks (seconds)
+            antiflood_limit: Max requests per anti-flood window (None = off);
+                checked in the same Redis call as the throttle window
+            antiflood_window: Anti-flood time window (seconds)
         """
         super().__init__()
         self.message_limit = message_limit
         self.message_window = message_window
         self.callback_limit = callback_limit
         self.callback_window = callback_window
+        self.antiflood_limit = antiflood_limit
+        self.antiflood_window = antiflood_window
 
     async def __call__(
         self,
@@ -76,22 +98,23 @@ class ThrottlingMiddleware(BaseMiddleware):
             # No user ID - allow (system events)
             return await handler(event, data)
 
-        # Check rate limit
-        allowed, retry_after = await rate_limiter.check_rate_limit(
-            user_id=user_id,
-            limit=limit,
-            window=window,
-            resource=resource
-        )
+        # Check anti-flood and throttle windows in one Redis call
+        windows = [(resource, limit, window)]
+        if self.antiflood_limit:
+            windows.insert(0, ("antiflood", self.antiflood_limit, self.antiflood_window))
+
+        allowed, retry_after, violated = await rate_limiter.check_limits(user_id, windows)
 
         if not allowed:
             # Rate limit exceeded - send warning
             logger.warning(
                 f"Rate limit exceeded: user_id={user_id}, "
-                f"resource={resource}, retry_after={retry_after}s"
+                f"resource={violated}, retry_after={retry_after}s"
             )
 
-            if isinstance(event, Message):
+            if violated == "antiflood":
+                await _answer_flood(event)
+            elif isinstance(event, Message):
                 await event.answer(
                     f"⚠️ Слишком много запросов!\n"
                     f"Подождите {retry_after} секунд перед следующим запросом.",
@@ -113,7 +136,9 @@ class AntiFloodMiddleware(BaseMiddleware):
     """
     Simple anti-flood middleware for aggressive spam protection
 
-    Uses stricter limits than ThrottlingMiddleware
+    Uses stricter limits than ThrottlingMiddleware. When both are used on the
+    same observer, prefer ThrottlingMiddleware(antiflood_limit=...) - it checks
+    both limits in a single Redis call.
     """
 
     def __init__(self, limit: int = 3, window: int = 5):
@@ -156,18 +181,7 @@ class AntiFloodMiddleware(BaseMiddleware):
                 f"Anti-flood triggered: user_id={user_id}, "
                 f"retry_after={retry_after}s"
             )
-
-            if isinstance(event, Message):
-                await event.answer(
-                    "🚫 Обнаружен флуд! Вы заблокированы на несколько секунд.",
-                    parse_mode="HTML"
-                )
-            elif isinstance(event, CallbackQuery):
-                await event.answer(
-                    "🚫 Флуд обнаружен!",
-                    show_alert=True
-                )
-
+            await _answer_flood(event)
             return None
 
         return await handler(event, data)
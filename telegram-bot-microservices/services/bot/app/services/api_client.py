@@ -1,12 +1,14 @@
 """
 API Client - call internal API service from bot
 
-Used for generating greetings when user returns to dialog.
+Used for generating greetings when user returns to dialog
+and for sending chat messages (regular and streaming).
 """
 
 import httpx
+import json
 import logging
-from typing import Optional
+from typing import AsyncIterator, Optional, Union
 from dataclasses import dataclass
 
 from app.config import config
@@ -34,6 +36,20 @@ class ChatResult:
     no_image_quota: bool = False  # True when image was due but user has no quota
 
 
+def _parse_chat_result(result: dict) -> ChatResult:
+    """Build ChatResult from API response payload"""
+    return ChatResult(
+        success=result.get("success", False),
+        response=result.get("response"),
+        error=result.get("error"),
+        dialog_id=result.get("dialog_id"),
+        is_safety_block=result.get("is_safety_block", False),
+        message_count=result.get("message_count", 0),
+        image_url=result.get("image_url"),
+        no_image_quota=result.get("no_image_quota", False),
+    )
+
+
 async def generate_greeting(
     telegram_id: int,
     persona_id: int,
@@ -139,17 +155,7 @@ async def send_chat_message(
             response = await client.post(url, json=data, timeout=120.0)
 
             if response.status_code == 200:
-                result = response.json()
-                return ChatResult(
-                    success=result.get("success", False),
-                    response=result.get("response"),
-                    error=result.get("error"),
-                    dialog_id=result.get("dialog_id"),
-                    is_safety_block=result.get("is_safety_block", False),
-                    message_count=result.get("message_count", 0),
-                    image_url=result.get("image_url"),  # Parse image URL from API
-                    no_image_quota=result.get("no_image_quota", False),
-                )
+                return _parse_chat_result(response.json())
             else:
                 logger.error(f"Chat API error {response.status_code}: {response.text}")
                 return ChatResult(
@@ -163,3 +169,64 @@ async def send_chat_message(
     except Exception as e:
         logger.error(f"Unexpected error calling chat API: {e}")
         return ChatResult(success=False, error=str(e))
+
+
+async def stream_chat_message(
+    telegram_id: int,
+    message: str,
+    persona_id: Optional[int] = None,
+    mode: str = "default",
+    story_id: Optional[str] = None,
+    atmosphere: Optional[str] = None,
+) -> AsyncIterator[Union[str, ChatResult]]:
+    """
+    Send chat message to API and stream persona response.
+
+    Args: same as send_chat_message
+
+    Yields:
+        str fragments of the response as they are generated,
+        then exactly one ChatResult (final, post-processed result)
+    """
+    url = f"{config.api_url}/api/chat/stream"
+
+    data = {
+        "telegram_id": telegram_id,
+        "message": message,
+        "mode": mode,
+    }
+
+    if persona_id:
+        data["persona_id"] = persona_id
+    if story_id:
+        data["story_id"] = story_id
+    if atmosphere:
+        data["atmosphere"] = atmosphere
+
+    try:
+        async with httpx.AsyncClient() as client:
+            async with client.stream("POST", url, json=data, timeout=120.0) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    logger.error(f"Chat stream API error {response.status_code}: {body[:500]!r}")
+                    yield ChatResult(success=False, error=f"API error: {response.status_code}")
+                    return
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if event.get("type") == "delta":
+                        yield event.get("content", "")
+                    elif event.get("type") == "result":
+                        yield _parse_chat_result(event)
+                        return
+
+        yield ChatResult(success=False, error="Stream ended without result")
+
+    except httpx.RequestError as e:
+        logger.error(f"HTTP error calling chat stream API: {e}")
+        yield ChatResult(success=False, error=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error calling chat stream API: {e}")
+        yield ChatResult(success=False, error=str(e))
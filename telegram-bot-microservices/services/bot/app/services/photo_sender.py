@@ -0,0 +1,102 @@
+"""
+Photo sender - send storage images via cached Telegram file_id
+
+First send of an image downloads it from MinIO (internal network) and
+uploads it; the file_id Telegram returns is cached in Redis, so every
+later send of the same URL (sex/greeting pool, menu covers, refresh) is
+a plain sendPhoto with the file_id.
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import httpx
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from shared.utils import telegram_file_cache
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_STORAGE_PREFIX = "https://craveme.tech/storage/"
+INTERNAL_STORAGE_PREFIX = "http://minio:9000/vitte-bot/"
+
+Photo = Union[str, BufferedInputFile]
+
+
+async def prepare_photo(url: str, download: bool = True) -> Optional[Photo]:
+    """
+    Resolve what to pass as `photo` for a storage URL.
+
+    Args:
+        url: Public image URL
+        download: On cache miss download bytes from MinIO; if False,
+            return the URL and let Telegram fetch it
+
+    Returns:
+        Cached file_id, downloaded file, URL - or None if download failed
+    """
+    file_id = await telegram_file_cache.get(url)
+    if file_id:
+        return file_id
+    if not download:
+        return url
+
+    internal_url = url.replace(PUBLIC_STORAGE_PREFIX, INTERNAL_STORAGE_PREFIX)
+    try:
+        async with httpx.AsyncClient() as http_client:
+            response = await http_client.get(internal_url, timeout=10.0)
+        if response.status_code == 200:
+            return BufferedInputFile(
+                response.content,
+                filename=url.rsplit("/", 1)[-1] or "photo.jpg"
+            )
+        logger.error(f"Failed to download image: HTTP {response.status_code} from {internal_url}")
+    except Exception as e:
+        logger.error(f"Failed to download photo: {e}")
+    return None
+
+
+async def send_photo_cached(
+    send: Callable[..., Awaitable[Message]],
+    url: str,
+    photo: Optional[Photo] = None,
+    **kwargs: Any,
+) -> Optional[Message]:
+    """
+    Send storage image and remember its file_id.
+
+    Args:
+        send: Bound send method, e.g. message.answer_photo
+        url: Public image URL (cache key)
+        photo: Result of prepare_photo (resolved here if None)
+        **kwargs: Passed to send (caption, reply_markup, ...)
+
+    Returns:
+        Sent message, None if the image could not be obtained
+
+    Raises:
+        TelegramAPIError: Sending failed (same as calling send directly)
+    """
+    if photo is None:
+        photo = await prepare_photo(url)
+        if photo is None:
+            return None
+
+    by_file_id = isinstance(photo, str) and photo != url
+    try:
+        sent = await send(photo=photo, **kwargs)
+    except TelegramBadRequest:
+        if not by_file_id:
+            raise
+        # file_id no longer accepted - upload again
+        await telegram_file_cache.forget(url)
+        photo = await prepare_photo(url)
+        if photo is None:
+            raise
+        by_file_id = False
+        sent = await send(photo=photo, **kwargs)
+
+    if not by_file_id and sent.photo:
+        await telegram_file_cache.set(url, sent.photo[-1].file_id)
+    return sent
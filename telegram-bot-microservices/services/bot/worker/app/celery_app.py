@@ -4,7 +4,8 @@ Celery application configuration
 from celery import Celery
 from celery.schedules import crontab
 from app.config import config
-from shared.utils import get_logger
+from shared.database import close_db
+from shared.utils import get_logger, redis_client, worker_runtime
 
 logger = get_logger(__name__, config.log_level)
 
@@ -99,12 +100,22 @@ celery_app.conf.update(
     # ETA/Countdown tasks support
     task_acks_late=True,
     task_reject_on_worker_lost=True,
+    # Redis broker redelivers unacked tasks after visibility_timeout (1h by
+    # default); with acks_late a broadcast running longer than that would
+    # be started again on another worker. Keep it above the broadcast limit.
+    broker_transport_options={"visibility_timeout": config.broadcast_time_limit + 600},
     # Beat schedule
     beat_schedule=beat_schedule,
     # RedBeat scheduler - хранит schedule в Redis вместо файла
     redbeat_redis_url=config.celery_broker_url,
 )
 
+# One event loop per worker process: tasks run coroutines via run_async(),
+# DB engine pool and Redis pool are reused between tasks
+worker_runtime.install()
+worker_runtime.on_shutdown(close_db)
+worker_runtime.on_shutdown(redis_client.disconnect)
+
 # Auto-discover tasks
 celery_app.autodiscover_tasks(["app.tasks"])
 
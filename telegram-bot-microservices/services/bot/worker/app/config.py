@@ -20,6 +20,15 @@ class WorkerConfig(BaseSettings):
     celery_worker_concurrency: int = int(os.getenv("CELERY_WORKER_CONCURRENCY", 4))
     celery_task_time_limit: int = int(os.getenv("CELERY_TASK_TIME_LIMIT", 600))
     celery_task_soft_time_limit: int = int(os.getenv("CELERY_TASK_SOFT_TIME_LIMIT", 300))
+
+    # Broadcasts
+    broadcast_rate_limit: float = float(os.getenv("BROADCAST_RATE_LIMIT", 25))  # messages/sec (Telegram: ~30/sec per bot)
+    broadcast_concurrency: int = int(os.getenv("BROADCAST_CONCURRENCY", 20))  # parallel sendMessage requests
+    broadcast_max_retries: int = int(os.getenv("BROADCAST_MAX_RETRIES", 3))  # network errors / 5xx
+    broadcast_batch_size: int = int(os.getenv("BROADCAST_BATCH_SIZE", 200))  # recipients per progress commit
+    broadcast_time_limit: int = int(os.getenv("BROADCAST_TIME_LIMIT", 6 * 3600))  # seconds (100k users at 25/sec ~ 67 min)
+    broadcast_lease_seconds: int = int(os.getenv("BROADCAST_LEASE_SECONDS", 600))  # heartbeat age before another worker takes over
+    broadcast_cancel_db_check_batches: int = int(os.getenv("BROADCAST_CANCEL_DB_CHECK_BATCHES", 5))  # re-read status from DB every N batches
     
     # Environment
     environment: str = os.getenv("ENVIRONMENT", "production")
@@ -2,13 +2,15 @@
 Broadcast tasks for sending mass notifications
 """
 import asyncio
-import os
+import uuid
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, insert, update, and_, or_, func
 
 from app.celery_app import celery_app
+from app.config import config
+from app.utils.telegram_sender import telegram_sender
 from shared.database import (
     AsyncSessionLocal,
     User,
@@ -16,16 +18,13 @@ from shared.database import (
     BroadcastLog,
     BroadcastType,
     BroadcastStatus,
-    ImageBalance,
+    credit_broadcast_gift_images,
 )
-from shared.utils import get_logger
+from shared.utils import get_logger, redis_client, run_async, BROADCAST_CANCEL_KEY
 from shared.notifications.telegram import send_telegram_notification
 
 logger = get_logger(__name__)
 
-# Telegram Bot Token
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-
 
 async def send_broadcast_message(
     user_id: int,
@@ -36,238 +35,241 @@ async def send_broadcast_message(
 ) -> tuple[bool, Optional[str]]:
     """
     Отправить сообщение рассылки пользователю
+    (общий темп, повторы при 429 - см. app.utils.telegram_sender)
 
     Returns:
         (success, error_message)
     """
-    import httpx
-
-    if not BOT_TOKEN:
-        return False, "BOT_TOKEN not configured"
-
-    telegram_api_url = f"https://api.telegram.org/bot{BOT_TOKEN}"
-
-    # Подготовка reply_markup если есть кнопки
-    reply_markup = None
-    if buttons:
-        inline_keyboard = []
-        for btn in buttons:
-            inline_keyboard.append([{
-                "text": btn.get("text", ""),
-                "callback_data": btn.get("callback_data", "")
-            }])
-        reply_markup = {"inline_keyboard": inline_keyboard}
-
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Отправка в зависимости от типа медиа
-            if media_url and media_type == "photo":
-                data = {
-                    "chat_id": user_id,
-                    "photo": media_url,
-                    "caption": text,
-                    "parse_mode": "HTML",
-                }
-                if reply_markup:
-                    data["reply_markup"] = reply_markup
-
-                response = await client.post(
-                    f"{telegram_api_url}/sendPhoto",
-                    json=data
-                )
-
-            elif media_url and media_type == "video":
-                data = {
-                    "chat_id": user_id,
-                    "video": media_url,
-                    "caption": text,
-                    "parse_mode": "HTML",
-                }
-                if reply_markup:
-                    data["reply_markup"] = reply_markup
-
-                response = await client.post(
-                    f"{telegram_api_url}/sendVideo",
-                    json=data
-                )
+    return await telegram_sender.send_broadcast_message(
+        user_id=user_id,
+        text=text,
+        media_url=media_url,
+        media_type=media_type,
+        buttons=buttons,
+    )
 
-            else:
-                # Обычное текстовое сообщение
-                data = {
-                    "chat_id": user_id,
-                    "text": text,
-                    "parse_mode": "HTML",
-                }
-                if reply_markup:
-                    data["reply_markup"] = reply_markup
-
-                response = await client.post(
-                    f"{telegram_api_url}/sendMessage",
-                    json=data
-                )
-
-            result = response.json()
-
-            if result.get("ok"):
-                return True, None
-            else:
-                error = result.get("description", "Unknown error")
-                return False, error
 
-    except httpx.RequestError as e:
-        return False, f"HTTP error: {str(e)}"
-    except Exception as e:
-        return False, f"Unexpected error: {str(e)}"
-
-
-async def add_gift_images_to_user(user_id: int, amount: int) -> bool:
-    """Начислить бонусные изображения пользователю"""
+async def _broadcast_cancelled(db, broadcast: Broadcast, check_db: bool = False) -> bool:
+    """
+    Отменена ли рассылка админом.
+    Проверяет флаг в Redis; статус в БД - если Redis недоступен или check_db
+    (флаг мог не выставиться, если Redis был недоступен админке).
+    """
     try:
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                select(ImageBalance).where(ImageBalance.user_id == user_id)
-            )
-            balance = result.scalar_one_or_none()
-
-            if balance:
-                balance.total_purchased_images += amount
-                balance.remaining_purchased_images += amount
-            else:
-                balance = ImageBalance(
-                    user_id=user_id,
-                    total_purchased_images=amount,
-                    remaining_purchased_images=amount,
-                    daily_subscription_quota=0,
-                    daily_subscription_used=0
-                )
-                db.add(balance)
-
-            await db.commit()
-            logger.info(f"Added {amount} gift images to user {user_id}")
+        if await redis_client.exists(BROADCAST_CANCEL_KEY.format(broadcast_id=broadcast.id)):
             return True
-
     except Exception as e:
-        logger.error(f"Failed to add gift images to user {user_id}: {e}")
-        return False
+        logger.warning(f"Cancel flag check failed for broadcast {broadcast.id}, checking DB: {e}")
+        check_db = True
+
+    if check_db:
+        await db.refresh(broadcast, ["status"])
+        return broadcast.status == BroadcastStatus.CANCELLED
+    return False
 
 
 async def _execute_scheduled_broadcast_async(broadcast_id: int) -> Dict[str, Any]:
     """
     Выполнить запланированную рассылку всем активным пользователям
+
+    Получатели идут пачками по возрастанию user id. После каждой пачки одним
+    коммитом пишутся логи (bulk insert), счётчики и чекпоинт last_user_id.
+    Если воркер упал посреди рассылки, повторный запуск задачи продолжает
+    с чекпоинта - повторно уходит не больше одной пачки.
+
+    Запуск захватывает рассылку (runner_id + heartbeat_at под блокировкой
+    строки). Пока heartbeat владельца свежий, второй запуск (повторная
+    доставка задачи) рассылку не трогает и возвращает "locked". Чекпоинт
+    пишется только пока runner_id наш: если рассылку забрал другой воркер,
+    этот останавливается.
     """
     logger.info(f"Starting scheduled broadcast {broadcast_id}")
+    runner_id = uuid.uuid4().hex
 
     try:
         async with AsyncSessionLocal() as db:
-            # Получить рассылку
+            # Получить рассылку (строка заблокирована до коммита захвата)
+            heartbeat_stale = or_(
+                Broadcast.heartbeat_at.is_(None),
+                Broadcast.heartbeat_at < func.now() - timedelta(seconds=config.broadcast_lease_seconds),
+            )
             result = await db.execute(
-                select(Broadcast).where(Broadcast.id == broadcast_id)
+                select(Broadcast, heartbeat_stale.label("lease_expired"))
+                .where(Broadcast.id == broadcast_id)
+                .with_for_update(of=Broadcast)
             )
-            broadcast = result.scalar_one_or_none()
+            row = result.one_or_none()
 
-            if not broadcast:
+            if not row:
                 logger.error(f"Broadcast {broadcast_id} not found")
                 return {"status": "error", "message": "Broadcast not found"}
+            broadcast, lease_expired = row
 
             if broadcast.status == BroadcastStatus.CANCELLED:
                 logger.info(f"Broadcast {broadcast_id} was cancelled, skipping")
                 return {"status": "cancelled"}
 
-            # Обновить статус на running
-            broadcast.status = BroadcastStatus.RUNNING
-            broadcast.started_at = datetime.utcnow()
-            await db.commit()
+            if broadcast.status == BroadcastStatus.COMPLETED:
+                logger.info(f"Broadcast {broadcast_id} already completed, skipping")
+                return {"status": "completed", "broadcast_id": broadcast_id}
 
-            # Получить всех активных пользователей
-            users_result = await db.execute(
-                select(User.id).where(
-                    and_(User.is_active == True, User.is_blocked == False)
-                )
-            )
-            user_ids = [row[0] for row in users_result.fetchall()]
+            if broadcast.status == BroadcastStatus.RUNNING and not lease_expired:
+                logger.info(f"Broadcast {broadcast_id} is running on another worker, skipping")
+                return {"status": "locked", "broadcast_id": broadcast_id}
 
-            broadcast.total_recipients = len(user_ids)
-            await db.commit()
-
-            logger.info(f"Broadcast {broadcast_id}: sending to {len(user_ids)} users")
+            recipients_filter = and_(User.is_active == True, User.is_blocked == False)
+            resumed = broadcast.status in (BroadcastStatus.RUNNING, BroadcastStatus.FAILED) \
+                and broadcast.last_user_id is not None
 
-            sent_count = 0
-            failed_count = 0
+            if resumed:
+                logger.info(
+                    f"Broadcast {broadcast_id}: resuming after user {broadcast.last_user_id} "
+                    f"(sent={broadcast.sent_count}, failed={broadcast.failed_count})"
+                )
+            else:
+                # Новый запуск
+                broadcast.started_at = datetime.utcnow()
+                broadcast.last_user_id = None
+                broadcast.sent_count = 0
+                broadcast.failed_count = 0
+                broadcast.total_recipients = await db.scalar(
+                    select(func.count(User.id)).where(recipients_filter)
+                ) or 0
+            broadcast.status = BroadcastStatus.RUNNING
+            broadcast.runner_id = runner_id
+            broadcast.heartbeat_at = func.now()
+            await db.commit()
 
-            # Отправка сообщений
-            for user_id in user_ids:
-                # Проверить отмену
-                await db.refresh(broadcast)
-                if broadcast.status == BroadcastStatus.CANCELLED:
+            total_recipients = broadcast.total_recipients
+            logger.info(f"Broadcast {broadcast_id}: sending to {total_recipients} users")
+
+            sent_count = broadcast.sent_count
+            failed_count = broadcast.failed_count
+            last_user_id = broadcast.last_user_id
+            batch_size = config.broadcast_batch_size
+            cancelled = False
+            lost = False
+            batches = 0
+
+            # Отправка пачками: внутри пачки параллельно (темп и 429 - в telegram_sender),
+            # после пачки - логи, подарки, счётчики и чекпоинт одним коммитом
+            while True:
+                # Проверить отмену: флаг в Redis, статус в БД - раз в несколько пачек
+                check_db = batches % config.broadcast_cancel_db_check_batches == 0
+                batches += 1
+                if await _broadcast_cancelled(db, broadcast, check_db):
                     logger.info(f"Broadcast {broadcast_id} cancelled during execution")
+                    cancelled = True
                     break
 
-                # Отправить сообщение
-                success, error = await send_broadcast_message(
-                    user_id=user_id,
-                    text=broadcast.text,
-                    media_url=broadcast.media_url,
-                    media_type=broadcast.media_type,
-                    buttons=broadcast.buttons,
-                )
+                batch_query = select(User.id).where(recipients_filter).order_by(User.id).limit(batch_size)
+                if last_user_id is not None:
+                    batch_query = batch_query.where(User.id > last_user_id)
+                batch = (await db.execute(batch_query)).scalars().all()
+                if not batch:
+                    break
 
-                # Записать лог
-                log = BroadcastLog(
-                    broadcast_id=broadcast_id,
-                    user_id=user_id,
-                    success=success,
-                    error_message=error
+                results = await asyncio.gather(*(
+                    send_broadcast_message(
+                        user_id=user_id,
+                        text=broadcast.text,
+                        media_url=broadcast.media_url,
+                        media_type=broadcast.media_type,
+                        buttons=broadcast.buttons,
+                    )
+                    for user_id in batch
+                ))
+
+                # Записать логи одним INSERT
+                await db.execute(insert(BroadcastLog), [
+                    {
+                        "broadcast_id": broadcast_id,
+                        "user_id": user_id,
+                        "success": success,
+                        "error_message": error,
+                    }
+                    for user_id, (success, error) in zip(batch, results)
+                ])
+
+                delivered = [user_id for user_id, (success, _) in zip(batch, results) if success]
+                sent_count += len(delivered)
+                failed_count += len(batch) - len(delivered)
+
+                # Начислить изображения если есть - одним запросом на пачку,
+                # в той же транзакции, что логи и чекпоинт
+                if broadcast.gift_images > 0:
+                    await credit_broadcast_gift_images(db, broadcast_id, delivered, broadcast.gift_images)
+
+                # Чекпоинт и heartbeat: пачка обработана (только пока рассылка наша)
+                last_user_id = batch[-1]
+                checkpoint = await db.execute(
+                    update(Broadcast)
+                    .where(Broadcast.id == broadcast_id, Broadcast.runner_id == runner_id)
+                    .values(
+                        sent_count=sent_count,
+                        failed_count=failed_count,
+                        last_user_id=last_user_id,
+                        heartbeat_at=func.now(),
+                    )
+                    .execution_options(synchronize_session=False)
                 )
-                db.add(log)
-
-                if success:
-                    sent_count += 1
-
-                    # Начислить изображения если есть
-                    if broadcast.gift_images > 0:
-                        await add_gift_images_to_user(user_id, broadcast.gift_images)
-                else:
-                    failed_count += 1
-
-                # Обновить счетчики каждые 10 сообщений
-                if (sent_count + failed_count) % 10 == 0:
-                    broadcast.sent_count = sent_count
-                    broadcast.failed_count = failed_count
-                    await db.commit()
-
-                # Небольшая задержка чтобы не превысить rate limit
-                await asyncio.sleep(0.05)
-
-            # Финальное обновление
-            broadcast.sent_count = sent_count
-            broadcast.failed_count = failed_count
-            broadcast.status = BroadcastStatus.COMPLETED
-            broadcast.completed_at = datetime.utcnow()
-            await db.commit()
-
-            logger.info(f"Broadcast {broadcast_id} completed: sent={sent_count}, failed={failed_count}")
+                if checkpoint.rowcount == 0:
+                    # Рассылку забрал другой воркер - он продолжит с его чекпоинта
+                    await db.rollback()
+                    lost = True
+                    break
+                await db.commit()
+
+            # Финальное обновление (не перетирая отмену, пришедшую после последней пачки)
+            if not cancelled and not lost:
+                completed = await db.execute(
+                    update(Broadcast)
+                    .where(
+                        Broadcast.id == broadcast_id,
+                        Broadcast.status == BroadcastStatus.RUNNING,
+                        Broadcast.runner_id == runner_id,
+                    )
+                    .values(status=BroadcastStatus.COMPLETED, completed_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if completed.rowcount == 0:
+                    await db.refresh(broadcast, ["status"])
+                    cancelled = broadcast.status == BroadcastStatus.CANCELLED
+                    lost = not cancelled
+
+            if lost:
+                logger.warning(f"Broadcast {broadcast_id} was taken over by another worker, stopping")
+                status = "lost"
+            else:
+                status = "cancelled" if cancelled else "completed"
+            logger.info(f"Broadcast {broadcast_id} {status}: sent={sent_count}, failed={failed_count}")
 
             return {
-                "status": "completed",
+                "status": status,
                 "broadcast_id": broadcast_id,
                 "sent_count": sent_count,
                 "failed_count": failed_count,
-                "total_recipients": len(user_ids)
+                "total_recipients": total_recipients,
+                "resumed": resumed,
             }
 
     except Exception as e:
         logger.error(f"Broadcast {broadcast_id} failed: {e}", exc_info=True)
 
-        # Обновить статус на failed
+        # Обновить статус на failed (если рассылка всё ещё наша)
         try:
             async with AsyncSessionLocal() as db:
-                result = await db.execute(
-                    select(Broadcast).where(Broadcast.id == broadcast_id)
+                await db.execute(
+                    update(Broadcast)
+                    .where(
+                        Broadcast.id == broadcast_id,
+                        Broadcast.status == BroadcastStatus.RUNNING,
+                        Broadcast.runner_id == runner_id,
+                    )
+                    .values(status=BroadcastStatus.FAILED)
                 )
-                broadcast = result.scalar_one_or_none()
-                if broadcast:
-                    broadcast.status = BroadcastStatus.FAILED
-                    await db.commit()
+                await db.commit()
         except:
             pass
 
@@ -323,15 +325,16 @@ async def _send_new_user_broadcast_async(user_id: int, broadcast_id: int) -> Dic
                 error_message=error
             )
             db.add(log)
+            await db.flush()
 
             # Обновить счетчики
             broadcast.total_recipients += 1
             if success:
                 broadcast.sent_count += 1
 
-                # Начислить изображения если есть
+                # Начислить изображения если есть (вместе с логом - одним коммитом)
                 if broadcast.gift_images > 0:
-                    await add_gift_images_to_user(user_id, broadcast.gift_images)
+                    await credit_broadcast_gift_images(db, broadcast_id, [user_id], broadcast.gift_images)
             else:
                 broadcast.failed_count += 1
 
@@ -405,8 +408,6 @@ async def _check_new_user_broadcasts_async() -> Dict[str, Any]:
                     if result.get("status") == "completed":
                         sent_count += 1
 
-                    await asyncio.sleep(0.05)
-
             return {
                 "status": "ok",
                 "broadcasts_checked": len(broadcasts),
@@ -420,39 +421,31 @@ async def _check_new_user_broadcasts_async() -> Dict[str, Any]:
 
 # ==================== CELERY TASKS ====================
 
-def _run_async(coro):
-    """
-    Безопасно запустить async coroutine в Celery worker
-    Создает новый event loop если текущий закрыт или отсутствует
-    """
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_closed():
-            raise RuntimeError("Event loop is closed")
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        # Не закрываем loop, т.к. он может переиспользоваться
-        pass
-
-
-@celery_app.task(name="broadcast.execute_scheduled_broadcast", bind=True, max_retries=3)
+@celery_app.task(
+    name="broadcast.execute_scheduled_broadcast",
+    bind=True,
+    max_retries=3,
+    # Большая рассылка идёт дольше общего лимита задач
+    time_limit=config.broadcast_time_limit + 60,
+    soft_time_limit=config.broadcast_time_limit,
+)
 def execute_scheduled_broadcast(self, broadcast_id: int):
     """
     Выполнить запланированную рассылку (Celery task wrapper)
     """
     try:
         logger.info(f"Executing scheduled broadcast task for broadcast {broadcast_id}")
-        result = _run_async(_execute_scheduled_broadcast_async(broadcast_id))
-        return result
+        result = run_async(_execute_scheduled_broadcast_async(broadcast_id))
     except Exception as e:
         logger.error(f"Scheduled broadcast task failed: {e}", exc_info=True)
         raise self.retry(exc=e, countdown=60 * (2 ** self.request.retries))
 
+    if result.get("status") == "locked":
+        # Владелец жив - он и закончит; если он упал, после истечения
+        # heartbeat этот запуск заберёт рассылку и продолжит с чекпоинта
+        raise self.retry(countdown=config.broadcast_lease_seconds)
+    return result
+
 
 @celery_app.task(name="broadcast.send_new_user_broadcast", bind=True, max_retries=3)
 def send_new_user_broadcast(self, user_id: int, broadcast_id: int):
@@ -461,7 +454,7 @@ def send_new_user_broadcast(self, user_id: int, broadcast_id: int):
     """
     try:
         logger.info(f"Sending new user broadcast {broadcast_id} to user {user_id}")
-        result = _run_async(_send_new_user_broadcast_async(user_id, broadcast_id))
+        result = run_async(_send_new_user_broadcast_async(user_id, broadcast_id))
         return result
     except Exception as e:
         logger.error(f"New user broadcast task failed: {e}", exc_info=True)
@@ -476,7 +469,7 @@ def check_new_user_broadcasts(self):
     """
     try:
         logger.info("Running check new user broadcasts task")
-        result = _run_async(_check_new_user_broadcasts_async())
+        result = run_async(_check_new_user_broadcasts_async())
         return result
     except Exception as e:
         logger.error(f"Check new user broadcasts task failed: {e}", exc_info=True)
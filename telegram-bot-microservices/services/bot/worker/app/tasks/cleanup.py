@@ -1,7 +1,6 @@
 """
 Cleanup tasks for database maintenance
 """
-import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any
 from sqlalchemy import select, delete, func, and_
@@ -10,7 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.celery_app import celery_app
 from shared.database import AsyncSessionLocal, Dialog, Message
 from shared.database.services import delete_old_messages
-from shared.utils import get_logger
+from shared.utils import get_logger, run_async
 
 logger = get_logger(__name__)
 
@@ -130,7 +129,7 @@ def cleanup_old_messages(self, keep_last: int = 50, days_threshold: int = 30):
     """
     try:
         logger.info(f"Starting cleanup: keep_last={keep_last}, days_threshold={days_threshold}")
-        result = asyncio.run(_cleanup_old_messages_async(keep_last, days_threshold))
+        result = run_async(_cleanup_old_messages_async(keep_last, days_threshold))
         return result
     except Exception as e:
         logger.error(f"Cleanup task failed: {e}", exc_info=True)
@@ -151,7 +150,7 @@ def cleanup_inactive_dialogs(self, days_inactive: int = 30):
     """
     try:
         logger.info(f"Starting dialog cleanup: days_inactive={days_inactive}")
-        result = asyncio.run(_cleanup_inactive_dialogs_async(days_inactive))
+        result = run_async(_cleanup_inactive_dialogs_async(days_inactive))
         return result
     except Exception as e:
         logger.error(f"Dialog cleanup task failed: {e}", exc_info=True)
@@ -1,7 +1,6 @@
 """
 Notification tasks for user and admin alerts
 """
-import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 from sqlalchemy import select, and_
@@ -10,7 +9,7 @@ import os
 
 from app.celery_app import celery_app
 from shared.database import AsyncSessionLocal, User, Subscription
-from shared.utils import get_logger
+from shared.utils import get_logger, run_async
 
 # Add parent directories to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../../api"))
@@ -170,7 +169,7 @@ def send_subscription_expiry_reminder(self, days_before: int = 3):
     """
     try:
         logger.info(f"Starting expiry reminder task: days_before={days_before}")
-        result = asyncio.run(_send_subscription_expiry_reminder_async(days_before))
+        result = run_async(_send_subscription_expiry_reminder_async(days_before))
         return result
     except Exception as e:
         logger.error(f"Expiry reminder task failed: {e}", exc_info=True)
@@ -199,7 +198,7 @@ def send_admin_alert(
     """
     try:
         logger.info(f"Sending admin alert: type={alert_type}, severity={severity}")
-        result = asyncio.run(_send_admin_alert_async(alert_type, message, severity, extra_data))
+        result = run_async(_send_admin_alert_async(alert_type, message, severity, extra_data))
         return result
     except Exception as e:
         logger.error(f"Admin alert task failed: {e}", exc_info=True)
@@ -259,7 +258,7 @@ def check_inactive_dialogs(self):
     """
     try:
         logger.info("Starting inactive dialogs check task")
-        result = asyncio.run(_send_dialog_notifications_async())
+        result = run_async(_send_dialog_notifications_async())
         return result
     except Exception as e:
         logger.error(f"Inactive dialogs check failed: {e}", exc_info=True)
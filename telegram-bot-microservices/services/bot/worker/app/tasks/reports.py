@@ -1,14 +1,13 @@
 """
 Report generation tasks for admin dashboard
 """
-import asyncio
 from datetime import datetime
 from typing import Dict, Any
 from sqlalchemy import select, func, and_
 
 from app.celery_app import celery_app
 from shared.database import AsyncSessionLocal, User, Subscription, Dialog, Message
-from shared.utils import get_logger
+from shared.utils import get_logger, run_async
 
 logger = get_logger(__name__)
 
@@ -209,7 +208,7 @@ def generate_user_stats(self):
     """
     try:
         logger.info("Generating user stats report")
-        result = asyncio.run(_generate_user_stats_async())
+        result = run_async(_generate_user_stats_async())
         return result
     except Exception as e:
         logger.error(f"User stats task failed: {e}", exc_info=True)
@@ -226,7 +225,7 @@ def generate_subscription_report(self):
     """
     try:
         logger.info("Generating subscription report")
-        result = asyncio.run(_generate_subscription_report_async())
+        result = run_async(_generate_subscription_report_async())
         return result
     except Exception as e:
         logger.error(f"Subscription report task failed: {e}", exc_info=True)
@@ -0,0 +1,279 @@
+"""
+Telegram sender для рассылок
+
+Один HTTP пул на процесс воркера, глобальный темп отправки и ограниченное
+число одновременных запросов:
+- темп (BROADCAST_RATE_LIMIT сообщений/сек) держится ниже лимита Telegram
+  на бота (~30 сообщений/сек в разные чаты); лимит на чат (1 сообщение/сек)
+  рассылке не мешает - каждому получателю уходит одно сообщение;
+- темп и пауза общие для всех процессов воркера через Redis
+  (shared.utils.telegram_pacer), а не на процесс;
+- 429 Too Many Requests: отправка ставится на паузу для ВСЕХ запросов на
+  retry_after секунд, получатель отправляется повторно (а не считается
+  неудачным);
+- сетевые ошибки и 5xx повторяются с backoff, остальные ошибки
+  (бот заблокирован, чат не найден) возвращаются сразу.
+
+Медиа рассылки загружается в Telegram один раз: первая отправка идёт по
+URL, возвращённый file_id кэшируется (в процессе и в Redis через
+telegram_file_cache) и используется для всех остальных получателей и
+повторных запусков. Пока идёт первая загрузка, остальные отправки этого
+медиа её ждут.
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.config import config
+from shared.utils import get_logger, telegram_file_cache, telegram_pacer, worker_runtime
+
+logger = get_logger(__name__)
+
+# Telegram Bot Token
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Сколько раз подряд ждать retry_after для одного сообщения
+MAX_RATE_LIMIT_RETRIES = 10
+
+# media_type -> (метод Bot API, поле с файлом)
+MEDIA_METHODS = {
+    "photo": ("sendPhoto", "photo"),
+    "video": ("sendVideo", "video"),
+}
+
+
+def _extract_file_id(result: Dict[str, Any], field: str) -> Optional[str]:
+    """file_id отправленного медиа из ответа sendPhoto / sendVideo"""
+    media = result.get(field)
+    if isinstance(media, list):  # photo: размеры по возрастанию
+        media = media[-1] if media else None
+    return media.get("file_id") if media else None
+
+
+class TelegramSender:
+    """Rate-aware отправка сообщений Bot API"""
+
+    def __init__(
+        self,
+        rate_limit: float = config.broadcast_rate_limit,
+        concurrency: int = config.broadcast_concurrency,
+        max_retries: int = config.broadcast_max_retries,
+    ):
+        """
+        Args:
+            rate_limit: Сообщений в секунду на бота (все процессы воркера)
+            concurrency: Максимум одновременных запросов
+            max_retries: Повторов при сетевых ошибках / 5xx (429 не считается)
+        """
+        self.interval = 1.0 / rate_limit
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # media_url -> file_id (Redis-кэш общий для процессов и перезапусков)
+        self._file_ids: Dict[str, str] = {}
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        self._upload_lock_users: Dict[str, int] = {}  # держат или ждут замок
+
+        # Metrics
+        self._stats = {
+            "sent": 0,
+            "failed": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "paused_seconds": 0.0,
+            "media_uploads": 0,
+            "media_by_file_id": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Общий HTTP клиент (живёт на event loop воркера)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def close(self):
+        """Закрыть HTTP клиент (при остановке процесса воркера)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики отправки"""
+        return {**self._stats, "paused_seconds": round(self._stats["paused_seconds"], 1)}
+
+    async def _wait_turn(self):
+        """Дождаться своего слота в общем темпе бота (и конца паузы после 429)"""
+        await telegram_pacer.acquire(self.interval)
+
+    async def _pause(self, retry_after: float):
+        """Притормозить все отправки бота (во всех процессах) после 429"""
+        self._stats["paused_seconds"] += await telegram_pacer.pause(retry_after)
+
+    async def call(self, method: str, data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Вызвать метод Bot API с учётом темпа и повторов.
+
+        Args:
+            method: Метод Bot API (sendMessage, sendPhoto, ...)
+            data: JSON параметры
+
+        Returns:
+            (result, None) при успехе, (None, error_message) при ошибке
+        """
+        if not BOT_TOKEN:
+            return None, "BOT_TOKEN not configured"
+
+        client = self._get_client()
+        url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
+        attempt = 0
+        rate_limited = 0
+
+        async with self._semaphore:
+            while True:
+                await self._wait_turn()
+
+                try:
+                    response = await client.post(url, json=data)
+                    payload = response.json()
+                except httpx.RequestError as e:
+                    payload, error = None, f"HTTP error: {str(e)}"
+                except Exception as e:
+                    payload, error = None, f"Unexpected error: {str(e)}"
+                else:
+                    if payload.get("ok"):
+                        self._stats["sent"] += 1
+                        return payload.get("result"), None
+                    error = payload.get("description", "Unknown error")
+
+                if payload is not None and response.status_code == 429:
+                    # Не ошибка получателя - ждём сколько сказал Telegram и повторяем
+                    self._stats["rate_limited"] += 1
+                    rate_limited += 1
+                    if rate_limited > MAX_RATE_LIMIT_RETRIES:
+                        break
+                    retry_after = (payload.get("parameters") or {}).get("retry_after", 1)
+                    await self._pause(float(retry_after))
+                    continue
+
+                if (payload is None or response.status_code >= 500) and attempt < self.max_retries:
+                    attempt += 1
+                    self._stats["retries"] += 1
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                break
+
+        self._stats["failed"] += 1
+        return None, error
+
+    async def send_broadcast_message(
+        self,
+        user_id: int,
+        text: str,
+        media_url: Optional[str] = None,
+        media_type: Optional[str] = None,
+        buttons: Optional[List[dict]] = None,
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Отправить сообщение рассылки пользователю
+
+        Returns:
+            (success, error_message)
+        """
+        # Подготовка reply_markup если есть кнопки
+        reply_markup = None
+        if buttons:
+            inline_keyboard = []
+            for btn in buttons:
+                inline_keyboard.append([{
+                    "text": btn.get("text", ""),
+                    "callback_data": btn.get("callback_data", "")
+                }])
+            reply_markup = {"inline_keyboard": inline_keyboard}
+
+        # Отправка в зависимости от типа медиа
+        if media_url and media_type in MEDIA_METHODS:
+            data = {"chat_id": user_id, "caption": text, "parse_mode": "HTML"}
+        else:
+            # Обычное текстовое сообщение
+            data = {"chat_id": user_id, "text": text, "parse_mode": "HTML"}
+        if reply_markup:
+            data["reply_markup"] = reply_markup
+
+        if "caption" in data:
+            result, error = await self._send_media(media_type, media_url, data)
+        else:
+            result, error = await self.call("sendMessage", data)
+        return result is not None, error
+
+    async def _cached_file_id(self, media_url: str) -> Optional[str]:
+        file_id = self._file_ids.get(media_url)
+        if file_id is None:
+            file_id = await telegram_file_cache.get(media_url)
+            if file_id:
+                self._file_ids[media_url] = file_id
+        return file_id
+
+    async def _send_media(
+        self,
+        media_type: str,
+        media_url: str,
+        data: Dict[str, Any],
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Отправить медиа по file_id; по URL - только если file_id ещё нет"""
+        method, field = MEDIA_METHODS[media_type]
+
+        file_id = await self._cached_file_id(media_url)
+        if file_id:
+            result, error = await self.call(method, {**data, field: file_id})
+            if result is not None or "file identifier" not in (error or ""):
+                self._stats["media_by_file_id"] += 1
+                return result, error
+            # file_id больше не принимается - загрузим заново
+            if self._file_ids.get(media_url) == file_id:
+                del self._file_ids[media_url]
+                await telegram_file_cache.forget(media_url)
+
+        lock = self._upload_locks.setdefault(media_url, asyncio.Lock())
+        self._upload_lock_users[media_url] = self._upload_lock_users.get(media_url, 0) + 1
+        try:
+            async with lock:
+                # Пока ждали, медиа мог загрузить другой получатель
+                file_id = self._file_ids.get(media_url)
+                if not file_id:
+                    # Под замком только сама загрузка
+                    result, error = await self.call(method, {**data, field: media_url})
+                    if result is not None:
+                        self._stats["media_uploads"] += 1
+                        file_id = _extract_file_id(result, field)
+                        if file_id:
+                            self._file_ids[media_url] = file_id
+                            await telegram_file_cache.set(media_url, file_id)
+                    return result, error
+        finally:
+            # Замок нужен только на время первой загрузки: удаляем, когда его
+            # никто не держит и не ждёт (locked() ложно и при ждущих)
+            self._upload_lock_users[media_url] -= 1
+            if not self._upload_lock_users[media_url]:
+                del self._upload_lock_users[media_url]
+                del self._upload_locks[media_url]
+
+        # Загрузка уже прошла - отправка по file_id вне замка, параллельно
+        self._stats["media_by_file_id"] += 1
+        return await self.call(method, {**data, field: file_id})
+
+# Global sender instance (one per worker process)
+telegram_sender = TelegramSender()
+worker_runtime.on_shutdown(telegram_sender.close)
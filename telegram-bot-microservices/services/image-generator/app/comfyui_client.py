@@ -1,15 +1,22 @@
 """
 ComfyUI REST API Client
 Handles communication with ComfyUI server on GPU
+
+Completion is tracked via ComfyUI websocket execution events for this
+client's client_id (completion, progress and errors arrive as they happen).
+If the socket cannot be opened or drops mid-job, the client falls back to
+polling /history.
 """
 import asyncio
 import json
-import random
+import uuid
 from pathlib import Path
 from typing import Dict, Optional, Any
 import aiohttp
 
 from app.config import config
+from app.http_session import get_http_session
+from app.workflow_templates import WorkflowTemplate, workflow_registry
 from shared.utils import get_logger
 
 logger = get_logger(__name__)
@@ -27,10 +34,12 @@ class ComfyUIClient:
         """
         self.base_url = base_url or config.COMFYUI_BASE_URL
         self.timeout = aiohttp.ClientTimeout(total=config.GENERATION_TIMEOUT)
+        # ComfyUI routes execution events for our prompts to this client_id
+        self.client_id = uuid.uuid4().hex
 
     async def load_workflow(self, workflow_path: Path) -> Dict[str, Any]:
         """
-        Load workflow JSON from file.
+        Load workflow JSON from file (read in a thread, not on the event loop).
 
         Args:
             workflow_path: Path to workflow JSON file
@@ -39,8 +48,9 @@ class ComfyUIClient:
             Workflow dict
         """
         try:
-            with open(workflow_path, 'r') as f:
-                workflow = json.load(f)
+            workflow = await asyncio.to_thread(
+                lambda: json.loads(workflow_path.read_text())
+            )
             logger.info(f"Loaded workflow from {workflow_path}")
             return workflow
         except Exception as e:
@@ -58,6 +68,9 @@ class ComfyUIClient:
         Modify workflow with custom prompt, seed, and per-persona LoRA params.
         Also injects CacheDiT Accelerator node for faster generation.
 
+        For workflow files prefer workflow_registry: it parses and injects
+        once per process instead of on every call.
+
         Args:
             workflow: Base workflow dict
             prompt: Positive prompt text
@@ -67,101 +80,7 @@ class ComfyUIClient:
         Returns:
             Modified workflow dict
         """
-        # Generate random seed if not provided
-        if seed is None:
-            seed = random.randint(0, 2**32 - 1)
-
-        # Find and modify prompt nodes
-        # Universal workflow: node "14" = positive, node "15" = negative
-        # Positive prompt is the first CLIPTextEncode encountered
-        first_clip_seen = False
-        for node_id, node_data in workflow.items():
-            if node_data.get("class_type") == "CLIPTextEncode":
-                if not first_clip_seen:
-                    # First CLIPTextEncode = positive prompt
-                    workflow[node_id]["inputs"]["text"] = prompt
-                    logger.debug(f"Updated positive prompt in node {node_id}")
-                    first_clip_seen = True
-                # Leave negative prompt as-is (empty string in universal flow)
-
-        # Find and modify KSampler seed and sampler_name
-        for node_id, node_data in workflow.items():
-            if node_data.get("class_type") == "KSampler":
-                workflow[node_id]["inputs"]["seed"] = seed
-                logger.debug(f"Updated seed to {seed} in node {node_id}")
-                if lora_params and "sampler_name" in lora_params:
-                    workflow[node_id]["inputs"]["sampler_name"] = lora_params["sampler_name"]
-                    logger.debug(f"Updated sampler_name to {lora_params['sampler_name']} in node {node_id}")
-
-        # Find and modify LoraLoader with persona-specific params
-        if lora_params:
-            for node_id, node_data in workflow.items():
-                if node_data.get("class_type") == "LoraLoader":
-                    workflow[node_id]["inputs"]["lora_name"] = lora_params["lora_name"]
-                    workflow[node_id]["inputs"]["strength_model"] = lora_params["strength_model"]
-                    workflow[node_id]["inputs"]["strength_clip"] = lora_params["strength_clip"]
-                    logger.debug(f"Updated LoRA in node {node_id}: {lora_params['lora_name']}")
-
-            # Set model switch: 1 = ZIT, 2 = Moody
-            model_index = lora_params.get("model_index", 1)
-            for node_id, node_data in workflow.items():
-                if node_data.get("class_type") == "CR Model Input Switch":
-                    workflow[node_id]["inputs"]["Input"] = model_index
-                    logger.debug(f"Set model switch to {model_index} in node {node_id}")
-
-        # Inject CacheDiT Accelerator between model source and KSampler
-        workflow = self._inject_cachedit(workflow)
-
-        return workflow
-
-    def _inject_cachedit(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Inject CacheDiT_Model_Optimizer node between the model source and KSampler.
-        This gives ~1.5x speedup for Z-Image Turbo.
-        """
-        # Find KSampler node
-        ksampler_id = None
-        for node_id, node_data in workflow.items():
-            if node_data.get("class_type") == "KSampler":
-                ksampler_id = node_id
-                break
-
-        if not ksampler_id:
-            logger.warning("CacheDiT: KSampler not found, skipping injection")
-            return workflow
-
-        # Get model source from KSampler (e.g. ["13", 0] = LoraLoader output)
-        model_source = workflow[ksampler_id]["inputs"].get("model")
-        if not model_source:
-            logger.warning("CacheDiT: KSampler has no model input, skipping")
-            return workflow
-
-        # Pick a unique node ID that doesn't conflict
-        existing_ids = set(int(k) for k in workflow.keys() if k.isdigit())
-        cachedit_id = str(max(existing_ids) + 1) if existing_ids else "100"
-
-        # Add CacheDiT node
-        workflow[cachedit_id] = {
-            "inputs": {
-                "model": model_source,  # Takes model from where KSampler was getting it
-                "enable": True,
-                "model_type": "Auto",
-                "warmup_steps": 0,
-                "skip_interval": 0,
-                "print_summary": True,
-            },
-            "class_type": "CacheDiT_Model_Optimizer",
-            "_meta": {
-                "title": "⚡ CacheDiT Accelerator"
-            }
-        }
-
-        # Redirect KSampler model input to CacheDiT output
-        workflow[ksampler_id]["inputs"]["model"] = [cachedit_id, 0]
-
-        logger.info(f"CacheDiT: injected node {cachedit_id} between {model_source[0]} and KSampler {ksampler_id}")
-
-        return workflow
+        return WorkflowTemplate.from_graph(workflow).render(prompt, seed, lora_params)
 
     async def queue_prompt(self, workflow: Dict[str, Any]) -> Optional[str]:
         """
@@ -174,20 +93,19 @@ class ComfyUIClient:
             Prompt ID if successful, None otherwise
         """
         url = f"{self.base_url}/prompt"
-        payload = {"prompt": workflow}
+        payload = {"prompt": workflow, "client_id": self.client_id}
 
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        prompt_id = result.get("prompt_id")
-                        logger.info(f"Queued prompt with ID: {prompt_id}")
-                        return prompt_id
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Failed to queue prompt: {response.status} - {error_text}")
-                        return None
+            async with get_http_session().post(url, json=payload, timeout=self.timeout) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    prompt_id = result.get("prompt_id")
+                    logger.info(f"Queued prompt with ID: {prompt_id}")
+                    return prompt_id
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Failed to queue prompt: {response.status} - {error_text}")
+                    return None
         except Exception as e:
             logger.error(f"Error queuing prompt: {e}")
             return None
@@ -205,36 +123,132 @@ class ComfyUIClient:
         url = f"{self.base_url}/history/{prompt_id}"
 
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        history = await response.json()
-                        return history.get(prompt_id)
-                    else:
-                        logger.error(f"Failed to get history: {response.status}")
-                        return None
+            async with get_http_session().get(url, timeout=self.timeout) as response:
+                if response.status == 200:
+                    history = await response.json()
+                    return history.get(prompt_id)
+                else:
+                    logger.error(f"Failed to get history: {response.status}")
+                    return None
         except Exception as e:
             logger.error(f"Error getting history: {e}")
             return None
 
+    async def connect_events(
+        self,
+        session: aiohttp.ClientSession
+    ) -> Optional[aiohttp.ClientWebSocketResponse]:
+        """
+        Open ComfyUI websocket for this client's execution events.
+
+        Must be opened before queue_prompt so no event is missed.
+
+        Args:
+            session: Session that owns the websocket
+
+        Returns:
+            Websocket or None (disabled / unavailable - use polling)
+        """
+        if not config.COMFYUI_WEBSOCKET_ENABLED:
+            return None
+
+        ws_url = self.base_url.replace("http", "ws", 1) + f"/ws?clientId={self.client_id}"
+        try:
+            return await asyncio.wait_for(
+                session.ws_connect(ws_url, heartbeat=config.COMFYUI_WS_HEARTBEAT),
+                timeout=config.COMFYUI_WS_CONNECT_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"ComfyUI websocket unavailable on {self.base_url}, will poll history: {e}")
+            return None
+
+    async def _wait_for_events(
+        self,
+        ws: aiohttp.ClientWebSocketResponse,
+        prompt_id: str,
+        max_wait: float
+    ) -> Optional[bool]:
+        """
+        Wait for completion using websocket execution events.
+
+        Returns:
+            True if completed, False on error/interrupt/timeout,
+            None if the socket dropped (caller falls back to polling)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.error(f"Generation {prompt_id} timed out after {max_wait}s")
+                return False
+
+            try:
+                msg = await ws.receive(timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.error(f"Generation {prompt_id} timed out after {max_wait}s")
+                return False
+
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                continue  # Latent previews
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                # CLOSE / CLOSED / ERROR
+                return None
+
+            try:
+                event = json.loads(msg.data)
+            except ValueError:
+                continue
+            event_type = event.get("type")
+            data = event.get("data") or {}
+            if data.get("prompt_id") != prompt_id:
+                continue
+
+            if event_type == "progress":
+                logger.debug(f"Generation {prompt_id}: step {data.get('value')}/{data.get('max')} (node {data.get('node')})")
+            elif event_type == "execution_success" or (event_type == "executing" and data.get("node") is None):
+                logger.info(f"Generation {prompt_id} completed")
+                return True
+            elif event_type == "execution_error":
+                logger.error(
+                    f"Generation {prompt_id} failed in node {data.get('node_id')} "
+                    f"({data.get('node_type')}): {data.get('exception_message')}"
+                )
+                return False
+            elif event_type == "execution_interrupted":
+                logger.error(f"Generation {prompt_id} interrupted")
+                return False
+
     async def wait_for_completion(
         self,
         prompt_id: str,
         poll_interval: float = 2.0,
-        max_wait: int = 120
+        max_wait: int = 120,
+        ws: Optional[aiohttp.ClientWebSocketResponse] = None
     ) -> bool:
         """
         Wait for image generation to complete.
 
         Args:
             prompt_id: Prompt ID to wait for
-            poll_interval: Seconds between status checks
+            poll_interval: Seconds between status checks (polling fallback)
             max_wait: Maximum seconds to wait
+            ws: Websocket from connect_events (None = poll history)
 
         Returns:
             True if completed successfully, False otherwise
         """
-        elapsed = 0
+        elapsed = 0.0
+        if ws is not None:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await self._wait_for_events(ws, prompt_id, max_wait)
+            if result is not None:
+                return result
+            elapsed = loop.time() - started
+            logger.warning(f"ComfyUI websocket dropped on {self.base_url}, polling history for {prompt_id}")
+
         while elapsed < max_wait:
             history = await self.get_history(prompt_id)
 
@@ -246,8 +260,8 @@ class ComfyUIClient:
                     return True
 
                 # Check for errors
-                if "error" in history:
-                    logger.error(f"Generation {prompt_id} failed: {history['error']}")
+                if "error" in history or status.get("status_str") == "error":
+                    logger.error(f"Generation {prompt_id} failed: {history.get('error', status)}")
                     return False
 
             await asyncio.sleep(poll_interval)
@@ -299,15 +313,14 @@ class ComfyUIClient:
         }
 
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        logger.info(f"Downloaded image: {filename} ({len(image_data)} bytes)")
-                        return image_data
-                    else:
-                        logger.error(f"Failed to download image: {response.status}")
-                        return None
+            async with get_http_session().get(url, params=params, timeout=self.timeout) as response:
+                if response.status == 200:
+                    image_data = await response.read()
+                    logger.info(f"Downloaded image: {filename} ({len(image_data)} bytes)")
+                    return image_data
+                else:
+                    logger.error(f"Failed to download image: {response.status}")
+                    return None
         except Exception as e:
             logger.error(f"Error downloading image: {e}")
             return None
@@ -317,7 +330,9 @@ class ComfyUIClient:
         workflow_path: Path,
         prompt: str,
         seed: Optional[int] = None,
-        lora_params: Optional[Dict[str, Any]] = None
+        lora_params: Optional[Dict[str, Any]] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None
     ) -> Optional[bytes]:
         """
         Complete image generation pipeline.
@@ -327,6 +342,8 @@ class ComfyUIClient:
             prompt: Positive prompt text
             seed: Random seed (optional)
             lora_params: Per-persona LoRA params (lora_name, strength_model, strength_clip, sampler_name)
+            width: Image width (workflow default if None)
+            height: Image height (workflow default if None)
 
         Returns:
             Image bytes or None
@@ -334,17 +351,23 @@ class ComfyUIClient:
         try:
             logger.info(f"Starting generation on {self.base_url}")
 
-            # Load and modify workflow
-            workflow = await self.load_workflow(workflow_path)
-            workflow = self.modify_workflow(workflow, prompt, seed, lora_params)
-
-            # Queue prompt
-            prompt_id = await self.queue_prompt(workflow)
-            if not prompt_id:
-                return None
-
-            # Wait for completion
-            success = await self.wait_for_completion(prompt_id)
+            # Cached template (CacheDiT pre-injected) with job fields patched
+            template = await workflow_registry.get(workflow_path)
+            workflow = template.render(prompt, seed, lora_params, width, height)
+
+            # Subscribe to execution events before queueing, then wait
+            ws = await self.connect_events(get_http_session())
+            try:
+                # Queue prompt
+                prompt_id = await self.queue_prompt(workflow)
+                if not prompt_id:
+                    return None
+
+                # Wait for completion
+                success = await self.wait_for_completion(prompt_id, ws=ws)
+            finally:
+                if ws is not None:
+                    await ws.close()
             if not success:
                 return None
 
@@ -1,86 +1,177 @@
 """
 ComfyUI Pool Manager
-Manages multiple ComfyUI instances for parallel processing
+Load- and health-aware scheduling across ComfyUI instances
+
+Each job goes to the candidate backend with the lowest expected completion
+time: (queue depth + 1) * recent job duration. Queue depth comes from the
+backend's own /queue endpoint, so it reflects jobs from every worker; it is
+re-read at most every COMFYUI_QUEUE_PROBE_TTL seconds, and jobs this process
+dispatched since the last reading are added on top. Job duration is an EWMA
+of this process's completed jobs.
+
+A backend is ejected when a probe fails or after COMFYUI_MAX_FAILURES
+consecutive failed jobs, and re-admitted once a probe succeeds after
+COMFYUI_EJECT_SECONDS. If every candidate is ejected, the least recently
+ejected one is used anyway rather than failing the job.
 """
-import os
-import threading
-from typing import Optional, List
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import aiohttp
 
 from app.config import config
+from app.http_session import get_http_session
 from shared.utils import get_logger
 
 logger = get_logger(__name__)
 
+EWMA_ALPHA = 0.3  # Weight of the newest job duration
+
+
+@dataclass
+class ComfyUIBackend:
+    """Live state of one ComfyUI instance (as seen by this process)"""
+    url: str
+    avg_duration: float = config.COMFYUI_EXPECTED_JOB_SECONDS
+    queue_depth: int = 0
+    dispatched_since_probe: int = 0
+    probed_at: float = 0.0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+
+    # Metrics
+    jobs: int = 0
+    failures: int = 0
+    ejections: int = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until == 0.0
+
+    def expected_completion(self) -> float:
+        """Seconds until a job dispatched now would finish"""
+        return (self.queue_depth + self.dispatched_since_probe + 1) * self.avg_duration
+
+    def to_dict(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "queue_depth": self.queue_depth + self.dispatched_since_probe,
+            "avg_duration": round(self.avg_duration, 2),
+            "expected_completion": round(self.expected_completion(), 2),
+            "consecutive_failures": self.consecutive_failures,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
 
 class ComfyUIPoolManager:
     """
     Manages pool of ComfyUI servers for parallel generation.
-    Each Celery worker gets assigned to a specific ComfyUI instance.
+    Dispatches each job to the backend expected to finish it soonest.
     """
 
     def __init__(self):
         self.comfyui_urls: List[str] = config.COMFYUI_URLS
-        self.worker_assignments = {}  # {worker_id: comfyui_url}
-        self.lock = threading.Lock()
+        self.backends: Dict[str, ComfyUIBackend] = {}
 
         logger.info(f"Initialized ComfyUI pool with {len(self.comfyui_urls)} instances: {self.comfyui_urls}")
 
-    def get_worker_id(self) -> int:
-        """
-        Get current Celery worker ID based on hostname.
-        Format: image-generator@hostname -> extract index
-
-        Returns:
-            Worker ID (0-based index)
-        """
-        hostname = os.environ.get("HOSTNAME", "")
-        # For local testing without Celery
-        if not hostname:
-            import threading
-            return threading.current_thread().ident % len(self.comfyui_urls)
-
-        # Extract worker index from Celery pool
-        # Celery uses ForkPoolWorker-1, ForkPoolWorker-2, etc in process name
+    def _backend(self, url: str) -> ComfyUIBackend:
+        backend = self.backends.get(url)
+        if backend is None:
+            backend = self.backends[url] = ComfyUIBackend(url=url)
+        return backend
+
+    def _eject(self, backend: ComfyUIBackend, reason: str):
+        if backend.healthy:
+            backend.ejections += 1
+            logger.warning(f"ComfyUI {backend.url} ejected: {reason}")
+        backend.ejected_until = time.monotonic() + config.COMFYUI_EJECT_SECONDS
+
+    async def _probe(self, backend: ComfyUIBackend):
+        """Refresh queue depth from /queue (also serves as health check)"""
+        timeout = aiohttp.ClientTimeout(total=config.COMFYUI_PROBE_TIMEOUT)
         try:
-            import multiprocessing
-            process_name = multiprocessing.current_process().name
-            if "ForkPoolWorker" in process_name or "Worker" in process_name:
-                # Extract number from "ForkPoolWorker-1" -> 1
-                parts = process_name.split("-")
-                if len(parts) > 1 and parts[-1].isdigit():
-                    worker_num = int(parts[-1])
-                    # Convert to 0-based index
-                    return (worker_num - 1) % len(self.comfyui_urls)
+            async with get_http_session().get(f"{backend.url}/queue", timeout=timeout) as response:
+                response.raise_for_status()
+                queue = await response.json()
         except Exception as e:
-            logger.warning(f"Could not extract worker ID from process name: {e}")
-
-        # Fallback: use thread ID modulo
-        return threading.current_thread().ident % len(self.comfyui_urls)
-
-    def get_comfyui_url(self) -> str:
+            self._eject(backend, f"probe failed: {e}")
+            return
+
+        backend.queue_depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        backend.dispatched_since_probe = 0
+        backend.probed_at = time.monotonic()
+        if not backend.healthy:
+            backend.ejected_until = 0.0
+            backend.consecutive_failures = 0
+            logger.info(f"ComfyUI {backend.url} re-admitted (queue={backend.queue_depth})")
+
+    async def select_backend(self, urls: Optional[List[str]] = None) -> str:
         """
-        Get ComfyUI URL for current worker.
-        Each worker is assigned to a specific ComfyUI instance for worker affinity.
+        Pick the backend for a job and count the dispatch.
+
+        Args:
+            urls: Candidate backends (e.g. the pool serving the job's model);
+                whole pool if None
 
         Returns:
             ComfyUI base URL
         """
-        worker_id = self.get_worker_id()
+        candidates = [self._backend(url) for url in (urls or self.comfyui_urls)]
+        if len(candidates) == 1:
+            backend = candidates[0]
+            backend.dispatched_since_probe += 1
+            return backend.url
+
+        now = time.monotonic()
+        stale = [
+            b for b in candidates
+            if (b.healthy and now - b.probed_at >= config.COMFYUI_QUEUE_PROBE_TTL)
+            or (not b.healthy and now >= b.ejected_until)
+        ]
+        if stale:
+            await asyncio.gather(*(self._probe(b) for b in stale))
+
+        healthy = [b for b in candidates if b.healthy]
+        if healthy:
+            best = min(b.expected_completion() for b in healthy)
+            backend = random.choice([b for b in healthy if b.expected_completion() == best])
+        else:
+            backend = min(candidates, key=lambda b: b.ejected_until)
+            logger.warning(f"All ComfyUI candidates unhealthy, trying {backend.url}")
+
+        backend.dispatched_since_probe += 1
+        logger.debug(f"Scheduled job on {backend.url} (expected {backend.expected_completion():.1f}s)")
+        return backend.url
+
+    def record_job(self, url: str, duration: float, success: bool):
+        """
+        Feed back a finished job: duration estimate and health.
 
-        with self.lock:
-            # Check if already assigned
-            if worker_id in self.worker_assignments:
-                url = self.worker_assignments[worker_id]
-                logger.debug(f"Worker {worker_id} using assigned ComfyUI: {url}")
-                return url
+        Args:
+            url: Backend that ran the job
+            duration: Wall time of the job (seconds)
+            success: Whether an image was produced
+        """
+        backend = self._backend(url)
+        backend.jobs += 1
+        if backend.dispatched_since_probe > 0:
+            backend.dispatched_since_probe -= 1
 
-            # Assign worker to ComfyUI instance (round-robin)
-            comfyui_index = worker_id % len(self.comfyui_urls)
-            assigned_url = self.comfyui_urls[comfyui_index]
-            self.worker_assignments[worker_id] = assigned_url
+        if success:
+            backend.consecutive_failures = 0
+            backend.avg_duration += EWMA_ALPHA * (duration - backend.avg_duration)
+            return
 
-            logger.info(f"Assigned Worker {worker_id} -> ComfyUI {assigned_url}")
-            return assigned_url
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= config.COMFYUI_MAX_FAILURES:
+            self._eject(backend, f"{backend.consecutive_failures} consecutive failed jobs")
 
     def get_all_urls(self) -> List[str]:
         """
@@ -91,6 +182,10 @@ class ComfyUIPoolManager:
         """
         return self.comfyui_urls.copy()
 
+    def get_stats(self) -> dict:
+        """Scheduler state per backend"""
+        return {url: backend.to_dict() for url, backend in self.backends.items()}
+
 
 # Global pool manager instance
 comfyui_pool = ComfyUIPoolManager()
@@ -24,9 +24,27 @@ class Config:
     # Backwards compatibility - primary host
     COMFYUI_BASE_URL = COMFYUI_URLS[0] if COMFYUI_URLS else "http://87.228.124.214:8188"
 
+    # Per-model backend pools (same "host:port,..." format). Defaults keep the
+    # original layout: first host = Z-Image Turbo, second host = Moody
+    _zit_hosts = os.getenv("COMFYUI_ZIT_HOSTS", "")
+    _moody_hosts = os.getenv("COMFYUI_MOODY_HOSTS", "")
+    COMFYUI_ZIT_URLS = [f"http://{h.strip()}" for h in _zit_hosts.split(",") if h.strip()] or [COMFYUI_BASE_URL]
+    COMFYUI_MOODY_URLS = (
+        [f"http://{h.strip()}" for h in _moody_hosts.split(",") if h.strip()]
+        or [COMFYUI_URLS[1] if len(COMFYUI_URLS) > 1 else COMFYUI_BASE_URL]
+    )
+
+    # Scheduler: pick the backend with the lowest expected completion time
+    COMFYUI_QUEUE_PROBE_TTL = float(os.getenv("COMFYUI_QUEUE_PROBE_TTL", "1.0"))  # seconds a /queue reading is reused
+    COMFYUI_PROBE_TIMEOUT = float(os.getenv("COMFYUI_PROBE_TIMEOUT", "2.0"))  # seconds
+    COMFYUI_EXPECTED_JOB_SECONDS = float(os.getenv("COMFYUI_EXPECTED_JOB_SECONDS", "10"))  # initial duration estimate
+    COMFYUI_MAX_FAILURES = int(os.getenv("COMFYUI_MAX_FAILURES", "3"))  # consecutive job failures before ejecting
+    COMFYUI_EJECT_SECONDS = float(os.getenv("COMFYUI_EJECT_SECONDS", "30"))  # cooldown before re-probing ejected backend
+
     # Workflows directory
     BASE_DIR = Path(__file__).parent.parent
     WORKFLOWS_DIR = BASE_DIR / "workflows"
+    WORKFLOW_RELOAD_INTERVAL = float(os.getenv("WORKFLOW_RELOAD_INTERVAL", "5"))  # seconds between mtime checks
 
     # Redis/Celery
     REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -58,5 +76,14 @@ class Config:
     MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "2"))  # Parallel generations
     GENERATION_TIMEOUT = int(os.getenv("GENERATION_TIMEOUT", "120"))  # seconds
 
+    # Completion tracking: ComfyUI websocket events (polling /history only as fallback)
+    COMFYUI_WEBSOCKET_ENABLED = os.getenv("COMFYUI_WEBSOCKET_ENABLED", "true").lower() == "true"
+    COMFYUI_WS_CONNECT_TIMEOUT = float(os.getenv("COMFYUI_WS_CONNECT_TIMEOUT", "5"))  # seconds
+    COMFYUI_WS_HEARTBEAT = float(os.getenv("COMFYUI_WS_HEARTBEAT", "20"))  # seconds
+
+    # Shared HTTP session per worker process (ComfyUI, Telegram)
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))  # max open connections
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))  # seconds an idle connection is kept
+
 
 config = Config()
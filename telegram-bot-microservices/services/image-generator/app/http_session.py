@@ -0,0 +1,37 @@
+"""
+Shared aiohttp session for the image-generator worker process
+
+Created lazily on the worker event loop (see shared.utils.async_runtime) and
+reused by every job: ComfyUI REST calls and websockets, queue probes, Telegram
+uploads keep their connections alive between jobs. Per-request timeouts are
+passed by the callers; the session itself has none so websockets are not cut.
+"""
+from typing import Optional
+
+import aiohttp
+
+from app.config import config
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Get the process-wide session (call from the worker loop)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None),
+            connector=aiohttp.TCPConnector(
+                limit=config.HTTP_POOL_SIZE,
+                keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT,
+            ),
+        )
+    return _session
+
+
+async def close_http_session():
+    """Close the session (worker process shutdown)."""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
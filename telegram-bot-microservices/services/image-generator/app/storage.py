@@ -1,14 +1,27 @@
 """
 Storage module for uploading generated images to MinIO
+
+One MinIO client per process (its urllib3 pool is reused across uploads),
+bucket existence checked once. Each generated image is stored as:
+- original PNG (archive / re-processing)
+- compressed delivery variant (JPEG or WebP) - what the bot sends
+- small thumbnail (WebApp galleries, previews)
+
+Encoding and uploads are blocking minio/Pillow calls and run in threads,
+never on the event loop.
 """
+import asyncio
 import hashlib
 import os
+import threading
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 from io import BytesIO
 
 from minio import Minio
 from minio.error import S3Error
+from PIL import Image
 from shared.utils import get_logger
 
 logger = get_logger(__name__)
@@ -23,56 +36,146 @@ MINIO_SECURE = os.getenv("S3_SECURE", "False").lower() == "true"
 # Public URL base (через nginx)
 PUBLIC_URL_BASE = os.getenv("PUBLIC_STORAGE_URL", "https://craveme.tech/storage")
 
+# Delivery variant: "jpeg" (safe for Telegram sendPhoto) or "webp"
+DELIVERY_FORMAT = os.getenv("IMAGE_DELIVERY_FORMAT", "jpeg").lower()
+DELIVERY_QUALITY = int(os.getenv("IMAGE_DELIVERY_QUALITY", "88"))
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "320"))  # longest side, px
+THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", "75"))
+
+_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+}
+
+_client: Optional[Minio] = None
+_client_lock = threading.Lock()
+_bucket_ready = False
+
+
+@dataclass
+class StoredImage:
+    """Public URLs of an uploaded image and its variants"""
+    url: str  # Delivery variant - send this to users
+    original_url: str
+    thumbnail_url: Optional[str] = None
+    size_bytes: int = 0  # Delivery variant size
+    original_size_bytes: int = 0
+
 
 def get_minio_client() -> Minio:
-    """Get MinIO client instance."""
-    return Minio(
-        MINIO_ENDPOINT,
-        access_key=MINIO_ACCESS_KEY,
-        secret_key=MINIO_SECRET_KEY,
-        secure=MINIO_SECURE
+    """Get the process-wide MinIO client (bucket checked on first use)."""
+    global _client, _bucket_ready
+    if _client is not None and _bucket_ready:
+        return _client
+
+    with _client_lock:
+        if _client is None:
+            _client = Minio(
+                MINIO_ENDPOINT,
+                access_key=MINIO_ACCESS_KEY,
+                secret_key=MINIO_SECRET_KEY,
+                secure=MINIO_SECURE
+            )
+        if not _bucket_ready:
+            # Ensure bucket exists
+            if not _client.bucket_exists(MINIO_BUCKET):
+                logger.warning(f"Bucket {MINIO_BUCKET} does not exist, creating...")
+                _client.make_bucket(MINIO_BUCKET)
+            _bucket_ready = True
+    return _client
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if image_format == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def encode_variants(image_data: bytes) -> Tuple[bytes, Optional[bytes]]:
+    """
+    Encode delivery variant and thumbnail (blocking - run in a thread).
+
+    Returns:
+        (delivery bytes, thumbnail bytes or None if THUMBNAIL_SIZE is 0)
+    """
+    image_format = _FORMATS.get(DELIVERY_FORMAT, _FORMATS["jpeg"])[0]
+    with Image.open(BytesIO(image_data)) as image:
+        image.load()
+        delivery = _encode(image, image_format, DELIVERY_QUALITY)
+        thumbnail = None
+        if THUMBNAIL_SIZE > 0:
+            small = image.copy()
+            small.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+            thumbnail = _encode(small, image_format, THUMBNAIL_QUALITY)
+    return delivery, thumbnail
+
+
+def _put(object_name: str, data: bytes, content_type: str):
+    get_minio_client().put_object(
+        MINIO_BUCKET,
+        object_name,
+        BytesIO(data),
+        length=len(data),
+        content_type=content_type
     )
 
 
-async def upload_generated_image(persona_key: str, image_data: bytes) -> Optional[str]:
+async def store_generated_image(persona_key: str, image_data: bytes) -> Optional[StoredImage]:
     """
-    Upload generated image to MinIO and return public URL.
+    Upload generated image with its delivery variant and thumbnail.
 
     Args:
         persona_key: Persona identifier (lina, julie, etc.)
         image_data: Raw image bytes (PNG)
 
     Returns:
-        Public URL if successful, None otherwise
+        StoredImage with public URLs, None on failure
     """
     try:
         # Generate unique filename
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         content_hash = hashlib.md5(image_data).hexdigest()[:8]
-        filename = f"generated/{persona_key}/{timestamp}_{content_hash}.png"
-
-        # Upload to MinIO
-        client = get_minio_client()
-
-        # Ensure bucket exists
-        if not client.bucket_exists(MINIO_BUCKET):
-            logger.warning(f"Bucket {MINIO_BUCKET} does not exist, creating...")
-            client.make_bucket(MINIO_BUCKET)
-
-        # Upload file
-        client.put_object(
-            MINIO_BUCKET,
-            filename,
-            BytesIO(image_data),
-            length=len(image_data),
-            content_type="image/png"
+        base_name = f"generated/{persona_key}/{timestamp}_{content_hash}"
+        _, extension, content_type = _FORMATS.get(DELIVERY_FORMAT, _FORMATS["jpeg"])
+
+        try:
+            delivery, thumbnail = await asyncio.to_thread(encode_variants, image_data)
+        except Exception as e:
+            # Undecodable output - still keep the original
+            logger.error(f"Failed to encode image variants, storing original only: {e}")
+            delivery, thumbnail = None, None
+
+        uploads = {f"{base_name}.png": (image_data, "image/png")}
+        if delivery is not None:
+            uploads[f"{base_name}.{extension}"] = (delivery, content_type)
+        if thumbnail is not None:
+            uploads[f"{base_name}_thumb.{extension}"] = (thumbnail, content_type)
+
+        await asyncio.gather(*(
+            asyncio.to_thread(_put, name, data, mime)
+            for name, (data, mime) in uploads.items()
+        ))
+
+        original_url = f"{PUBLIC_URL_BASE}/{base_name}.png"
+        stored = StoredImage(
+            url=f"{PUBLIC_URL_BASE}/{base_name}.{extension}" if delivery is not None else original_url,
+            original_url=original_url,
+            thumbnail_url=f"{PUBLIC_URL_BASE}/{base_name}_thumb.{extension}" if thumbnail is not None else None,
+            size_bytes=len(delivery) if delivery is not None else len(image_data),
+            original_size_bytes=len(image_data),
         )
 
-        # Generate public URL
-        public_url = f"{PUBLIC_URL_BASE}/{filename}"
-
-        logger.info(f"Uploaded image to MinIO: {filename}, size={len(image_data)} bytes")
-        return public_url
+        logger.info(
+            f"Uploaded image to MinIO: {base_name}, original={len(image_data)} bytes, "
+            f"delivery={stored.size_bytes} bytes ({extension}), "
+            f"thumbnail={len(thumbnail) if thumbnail else 0} bytes"
+        )
+        return stored
 
     except S3Error as e:
         logger.error(f"MinIO S3 error: {e}", exc_info=True)
@@ -80,3 +183,18 @@ async def upload_generated_image(persona_key: str, image_data: bytes) -> Optiona
     except Exception as e:
         logger.error(f"Failed to upload image to MinIO: {e}", exc_info=True)
         return None
+
+
+async def upload_generated_image(persona_key: str, image_data: bytes) -> Optional[str]:
+    """
+    Upload generated image to MinIO and return public URL.
+
+    Args:
+        persona_key: Persona identifier (lina, julie, etc.)
+        image_data: Raw image bytes (PNG)
+
+    Returns:
+        Public URL of the delivery variant if successful, None otherwise
+    """
+    stored = await store_generated_image(persona_key, image_data)
+    return stored.url if stored else None
@@ -1,16 +1,19 @@
 """
 Celery tasks for image generation
 """
-import asyncio
+import time
 from typing import Optional
 
 from celery import Celery
+from celery.signals import worker_process_init
 from app.config import config
 from app.comfyui_client import ComfyUIClient
+from app.workflow_templates import workflow_registry
 from app.comfyui_pool import comfyui_pool
-from app.workflow_mapping import get_workflow_path, get_workflow_path_for_model, get_comfyui_url_for_model, get_lora_params, is_persona_supported
+from app.http_session import close_http_session
+from app.workflow_mapping import get_workflow_path, get_workflow_path_for_model, get_comfyui_urls_for_model, get_lora_params, is_persona_supported
 from app.telegram_sender import send_photo_to_telegram
-from shared.utils import get_logger
+from shared.utils import get_logger, run_async, worker_runtime
 
 logger = get_logger(__name__)
 
@@ -37,6 +40,17 @@ celery_app.conf.update(
 )
 
 
+# One event loop per worker process; the shared HTTP session lives on it
+worker_runtime.install()
+worker_runtime.on_shutdown(close_http_session)
+
+
+@worker_process_init.connect
+def preload_workflows(**kwargs):
+    """Parse workflow templates once per worker process, before the first job"""
+    workflow_registry.preload()
+
+
 @celery_app.task(name="image_generator.generate_and_send")
 def generate_and_send_image(
     persona_key: str,
@@ -77,35 +91,29 @@ def generate_and_send_image(
         # Get per-persona LoRA params for universal workflow
         lora_params = get_lora_params(persona_key)
 
-        # Get ComfyUI URL from pool (worker affinity)
-        comfyui_url = comfyui_pool.get_comfyui_url()
+        # Generate image on the worker process event loop
+        # Pick ComfyUI instance with the lowest expected completion time
+        comfyui_url = run_async(comfyui_pool.select_backend())
         logger.info(f"Using ComfyUI instance: {comfyui_url}")
-
-        # Create client for this worker's assigned ComfyUI instance
         client = ComfyUIClient(base_url=comfyui_url)
 
-        # Generate image (async)
-        # Create new event loop for Celery worker (get_event_loop doesn't work in threads)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            image_data = loop.run_until_complete(
-                client.generate_image(workflow_path, prompt, seed, lora_params)
-            )
-
-            if not image_data:
-                error_msg = "Image generation failed"
-                logger.error(error_msg)
-                return {"success": False, "error": error_msg}
-
-            logger.info(f"Image generated successfully, size: {len(image_data)} bytes")
-
-            # Send to Telegram
-            success = loop.run_until_complete(
-                send_photo_to_telegram(chat_id, image_data)
-            )
-        finally:
-            loop.close()
+        started = time.monotonic()
+        image_data = run_async(
+            client.generate_image(workflow_path, prompt, seed, lora_params)
+        )
+        comfyui_pool.record_job(comfyui_url, time.monotonic() - started, success=bool(image_data))
+
+        if not image_data:
+            error_msg = "Image generation failed"
+            logger.error(error_msg)
+            return {"success": False, "error": error_msg}
+
+        logger.info(f"Image generated successfully, size: {len(image_data)} bytes")
+
+        # Send to Telegram
+        success = run_async(
+            send_photo_to_telegram(chat_id, image_data)
+        )
 
         if not success:
             error_msg = "Failed to send image to Telegram"
@@ -167,46 +175,48 @@ def generate_image(
             error_msg = f"Workflow not found for persona '{persona_key}', moody={use_moody}"
             logger.error(error_msg)
             return {"success": False, "error": error_msg}
-        comfyui_url = get_comfyui_url_for_model(use_moody=use_moody)
-        logger.info(f"Using ComfyUI instance: {comfyui_url}, workflow: {workflow_path.name}, moody={use_moody}")
 
-        # Create client for this worker's assigned ComfyUI instance
+        # Generate image on the worker process event loop
+        # Pick the least-loaded healthy instance serving this model
+        comfyui_url = run_async(
+            comfyui_pool.select_backend(get_comfyui_urls_for_model(use_moody=use_moody))
+        )
+        logger.info(f"Using ComfyUI instance: {comfyui_url}, workflow: {workflow_path.name}, moody={use_moody}")
         client = ComfyUIClient(base_url=comfyui_url)
 
-        # Generate image (async)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            image_data = loop.run_until_complete(
-                client.generate_image(workflow_path, prompt, seed, lora_params)
-            )
-
-            if not image_data:
-                error_msg = "Image generation failed"
-                logger.error(error_msg)
-                return {"success": False, "error": error_msg}
-
-            logger.info(f"Image generated successfully, size: {len(image_data)} bytes")
-
-            # Upload to MinIO and get public URL
-            from app.storage import upload_generated_image
-            image_url = loop.run_until_complete(
-                upload_generated_image(persona_key, image_data)
-            )
-        finally:
-            loop.close()
-
-        if not image_url:
+        started = time.monotonic()
+        image_data = run_async(
+            client.generate_image(workflow_path, prompt, seed, lora_params)
+        )
+        comfyui_pool.record_job(comfyui_url, time.monotonic() - started, success=bool(image_data))
+
+        if not image_data:
+            error_msg = "Image generation failed"
+            logger.error(error_msg)
+            return {"success": False, "error": error_msg}
+
+        logger.info(f"Image generated successfully, size: {len(image_data)} bytes")
+
+        # Upload original + compressed delivery variant + thumbnail to MinIO
+        from app.storage import store_generated_image
+        stored = run_async(
+            store_generated_image(persona_key, image_data)
+        )
+
+        if not stored:
             error_msg = "Failed to upload image to storage"
             logger.error(error_msg)
             return {"success": False, "error": error_msg}
 
-        logger.info(f"Image uploaded successfully: {image_url}")
+        logger.info(f"Image uploaded successfully: {stored.url}")
         return {
             "success": True,
-            "image_url": image_url,
+            "image_url": stored.url,
+            "original_url": stored.original_url,
+            "thumbnail_url": stored.thumbnail_url,
             "persona": persona_key,
-            "size_bytes": len(image_data)
+            "size_bytes": stored.size_bytes,
+            "original_size_bytes": stored.original_size_bytes
         }
 
     except Exception as e:
@@ -222,5 +232,7 @@ def health_check() -> dict:
         "status": "healthy",
         "service": "image-generator",
         "comfyui_urls": config.COMFYUI_URLS,
-        "pool_size": len(config.COMFYUI_URLS)
+        "pool_size": len(config.COMFYUI_URLS),
+        "scheduler": comfyui_pool.get_stats(),
+        "event_loop": worker_runtime.get_stats()
     }
@@ -5,6 +5,7 @@ import aiohttp
 from io import BytesIO
 
 from app.config import config
+from app.http_session import get_http_session
 from shared.utils import get_logger
 
 logger = get_logger(__name__)
@@ -35,20 +36,19 @@ async def send_photo_to_telegram(chat_id: int, image_data: bytes) -> bool:
 
     try:
         timeout = aiohttp.ClientTimeout(total=30)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, data=form_data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    if result.get("ok"):
-                        logger.info(f"Photo sent successfully to chat {chat_id}")
-                        return True
-                    else:
-                        logger.error(f"Telegram API error: {result}")
-                        return False
+        async with get_http_session().post(url, data=form_data, timeout=timeout) as response:
+            if response.status == 200:
+                result = await response.json()
+                if result.get("ok"):
+                    logger.info(f"Photo sent successfully to chat {chat_id}")
+                    return True
                 else:
-                    error_text = await response.text()
-                    logger.error(f"Failed to send photo: {response.status} - {error_text}")
+                    logger.error(f"Telegram API error: {result}")
                     return False
+            else:
+                error_text = await response.text()
+                logger.error(f"Failed to send photo: {response.status} - {error_text}")
+                return False
 
     except Exception as e:
         logger.error(f"Error sending photo to Telegram: {e}")
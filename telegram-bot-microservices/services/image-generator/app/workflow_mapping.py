@@ -2,7 +2,7 @@
 Mapping between personas and their ComfyUI workflows
 """
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from app.config import config
 
@@ -13,8 +13,8 @@ ZIT_WORKFLOW = "universal_flow_zit.json"        # Z-Image Turbo — general cont
 MOODY_WORKFLOW = "universal_flow_moody.json"    # MoodyPornMix — nude/undressing contexts
 
 # ComfyUI instance URLs by model type
-COMFYUI_ZIT_URL = config.COMFYUI_URLS[0] if len(config.COMFYUI_URLS) > 0 else config.COMFYUI_BASE_URL
-COMFYUI_MOODY_URL = config.COMFYUI_URLS[1] if len(config.COMFYUI_URLS) > 1 else config.COMFYUI_BASE_URL
+COMFYUI_ZIT_URL = config.COMFYUI_ZIT_URLS[0]
+COMFYUI_MOODY_URL = config.COMFYUI_MOODY_URLS[0]
 
 # Persona key → Workflow filename mapping (legacy, kept for reference)
 PERSONA_WORKFLOW_MAP: Dict[str, str] = {
@@ -230,6 +230,15 @@ def get_comfyui_url_for_model(use_moody: bool = False) -> str:
     return COMFYUI_MOODY_URL if use_moody else COMFYUI_ZIT_URL
 
 
+def get_comfyui_urls_for_model(use_moody: bool = False) -> List[str]:
+    """
+    Get all ComfyUI instances serving a model type (scheduler candidates).
+    use_moody=True → COMFYUI_MOODY_HOSTS pool
+    use_moody=False → COMFYUI_ZIT_HOSTS pool
+    """
+    return list(config.COMFYUI_MOODY_URLS if use_moody else config.COMFYUI_ZIT_URLS)
+
+
 __all__ = [
     "UNIVERSAL_WORKFLOW",
     "ZIT_WORKFLOW",
@@ -242,6 +251,7 @@ __all__ = [
     "get_workflow_path",
     "get_workflow_path_for_model",
     "get_comfyui_url_for_model",
+    "get_comfyui_urls_for_model",
     "get_lora_params",
     "get_trigger_word",
     "is_persona_supported",
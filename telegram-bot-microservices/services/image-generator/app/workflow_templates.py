@@ -0,0 +1,273 @@
+"""
+Workflow template registry
+
+Each workflow JSON is read and parsed once per worker process, the CacheDiT
+node is injected once, and the node ids of the variable fields (prompt,
+seed/sampler, LoRA, model switch, latent size) are indexed. A job gets a
+cheap copy where only those nodes are copied and patched; all other nodes
+are shared with the template and must be treated as read-only.
+
+Files are re-read in a thread (never on the event loop) when their mtime
+changes; the mtime is checked at most every WORKFLOW_RELOAD_INTERVAL seconds.
+"""
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import config
+from shared.utils import get_logger
+
+logger = get_logger(__name__)
+
+LATENT_NODE_TYPES = ("EmptyLatentImage", "EmptySD3LatentImage")
+
+
+def inject_cachedit(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Inject CacheDiT_Model_Optimizer node between the model source and KSampler.
+    This gives ~1.5x speedup for Z-Image Turbo.
+    """
+    # Find KSampler node
+    ksampler_id = None
+    for node_id, node_data in workflow.items():
+        if node_data.get("class_type") == "KSampler":
+            ksampler_id = node_id
+            break
+
+    if not ksampler_id:
+        logger.warning("CacheDiT: KSampler not found, skipping injection")
+        return workflow
+
+    # Get model source from KSampler (e.g. ["13", 0] = LoraLoader output)
+    model_source = workflow[ksampler_id]["inputs"].get("model")
+    if not model_source:
+        logger.warning("CacheDiT: KSampler has no model input, skipping")
+        return workflow
+
+    # Pick a unique node ID that doesn't conflict
+    existing_ids = set(int(k) for k in workflow.keys() if k.isdigit())
+    cachedit_id = str(max(existing_ids) + 1) if existing_ids else "100"
+
+    # Add CacheDiT node
+    workflow[cachedit_id] = {
+        "inputs": {
+            "model": model_source,  # Takes model from where KSampler was getting it
+            "enable": True,
+            "model_type": "Auto",
+            "warmup_steps": 0,
+            "skip_interval": 0,
+            "print_summary": True,
+        },
+        "class_type": "CacheDiT_Model_Optimizer",
+        "_meta": {
+            "title": "⚡ CacheDiT Accelerator"
+        }
+    }
+
+    # Redirect KSampler model input to CacheDiT output
+    workflow[ksampler_id]["inputs"]["model"] = [cachedit_id, 0]
+
+    logger.info(f"CacheDiT: injected node {cachedit_id} between {model_source[0]} and KSampler {ksampler_id}")
+
+    return workflow
+
+
+@dataclass
+class WorkflowTemplate:
+    """Parsed workflow with CacheDiT injected and variable nodes indexed"""
+    graph: Dict[str, Any]
+    positive_node: Optional[str] = None  # First CLIPTextEncode = positive prompt
+    ksampler_nodes: List[str] = field(default_factory=list)
+    lora_nodes: List[str] = field(default_factory=list)
+    switch_nodes: List[str] = field(default_factory=list)
+    latent_nodes: List[str] = field(default_factory=list)
+    path: Optional[Path] = None
+    mtime_ns: int = 0
+
+    @classmethod
+    def from_graph(
+        cls,
+        graph: Dict[str, Any],
+        path: Optional[Path] = None,
+        mtime_ns: int = 0
+    ) -> "WorkflowTemplate":
+        """Build template from a parsed workflow (the dict is taken over)"""
+        graph = inject_cachedit(graph)
+        template = cls(graph=graph, path=path, mtime_ns=mtime_ns)
+        for node_id, node_data in graph.items():
+            class_type = node_data.get("class_type")
+            if class_type == "CLIPTextEncode" and template.positive_node is None:
+                template.positive_node = node_id
+            elif class_type == "KSampler":
+                template.ksampler_nodes.append(node_id)
+            elif class_type == "LoraLoader":
+                template.lora_nodes.append(node_id)
+            elif class_type == "CR Model Input Switch":
+                template.switch_nodes.append(node_id)
+            elif class_type in LATENT_NODE_TYPES:
+                template.latent_nodes.append(node_id)
+        return template
+
+    def render(
+        self,
+        prompt: str,
+        seed: Optional[int] = None,
+        lora_params: Optional[Dict[str, Any]] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Workflow for one job: template with the variable fields patched.
+
+        Args:
+            prompt: Positive prompt text
+            seed: Random seed (generated if not provided)
+            lora_params: Dict with lora_name, strength_model, strength_clip,
+                sampler_name, model_index
+            width: Latent width (template value if None)
+            height: Latent height (template value if None)
+
+        Returns:
+            Workflow dict (only patched nodes are copies)
+        """
+        # Generate random seed if not provided
+        if seed is None:
+            seed = random.randint(0, 2**32 - 1)
+
+        workflow = dict(self.graph)
+
+        def patch(node_id: str) -> Dict[str, Any]:
+            node = dict(workflow[node_id])
+            node["inputs"] = dict(node["inputs"])
+            workflow[node_id] = node
+            return node["inputs"]
+
+        if self.positive_node is not None:
+            patch(self.positive_node)["text"] = prompt
+
+        for node_id in self.ksampler_nodes:
+            inputs = patch(node_id)
+            inputs["seed"] = seed
+            if lora_params and "sampler_name" in lora_params:
+                inputs["sampler_name"] = lora_params["sampler_name"]
+
+        if lora_params:
+            for node_id in self.lora_nodes:
+                inputs = patch(node_id)
+                inputs["lora_name"] = lora_params["lora_name"]
+                inputs["strength_model"] = lora_params["strength_model"]
+                inputs["strength_clip"] = lora_params["strength_clip"]
+
+            # Set model switch: 1 = ZIT, 2 = Moody
+            model_index = lora_params.get("model_index", 1)
+            for node_id in self.switch_nodes:
+                patch(node_id)["Input"] = model_index
+
+        if width or height:
+            for node_id in self.latent_nodes:
+                inputs = patch(node_id)
+                if width:
+                    inputs["width"] = width
+                if height:
+                    inputs["height"] = height
+
+        logger.debug(f"Rendered workflow: seed={seed}, lora={lora_params.get('lora_name') if lora_params else None}")
+        return workflow
+
+
+def _read_template(path: Path) -> WorkflowTemplate:
+    """Read and parse workflow file (blocking - run in a thread)"""
+    mtime_ns = path.stat().st_mtime_ns
+    with open(path, 'r') as f:
+        graph = json.load(f)
+    return WorkflowTemplate.from_graph(graph, path=path, mtime_ns=mtime_ns)
+
+
+class WorkflowRegistry:
+    """Per-process cache of workflow templates with mtime-based hot reload"""
+
+    def __init__(self, reload_interval: float = config.WORKFLOW_RELOAD_INTERVAL):
+        """
+        Args:
+            reload_interval: Min seconds between mtime checks of a file
+                (0 = check on every get)
+        """
+        self.reload_interval = reload_interval
+        self._templates: Dict[Path, WorkflowTemplate] = {}
+        self._checked_at: Dict[Path, float] = {}
+
+        # Metrics
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+
+    def preload(self, directory: Path = config.WORKFLOWS_DIR):
+        """Load every workflow in directory (call at worker start, not on the loop)"""
+        for path in sorted(directory.glob("*.json")):
+            try:
+                self._store(_read_template(path))
+                self.loads += 1
+            except Exception as e:
+                logger.error(f"Failed to preload workflow {path}: {e}")
+        logger.info(f"Preloaded {len(self._templates)} workflow templates from {directory}")
+
+    def _store(self, template: WorkflowTemplate):
+        self._templates[template.path] = template
+        self._checked_at[template.path] = time.monotonic()
+
+    def _is_stale(self, path: Path, template: WorkflowTemplate) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at.get(path, 0.0) < self.reload_interval:
+            return False
+        self._checked_at[path] = now
+        try:
+            return path.stat().st_mtime_ns != template.mtime_ns
+        except OSError:
+            return False  # File vanished - keep serving the last good version
+
+    async def get(self, path: Path) -> WorkflowTemplate:
+        """
+        Get template for a workflow file (loaded or reloaded in a thread).
+
+        Raises:
+            OSError / ValueError: File missing or not valid JSON (first load)
+        """
+        template = self._templates.get(path)
+        if template is not None and not self._is_stale(path, template):
+            self.hits += 1
+            return template
+
+        try:
+            fresh = await asyncio.to_thread(_read_template, path)
+        except Exception as e:
+            if template is not None:
+                logger.error(f"Failed to reload workflow {path}, keeping cached version: {e}")
+                return template
+            logger.error(f"Failed to load workflow from {path}: {e}")
+            raise
+
+        if template is None:
+            self.loads += 1
+            logger.info(f"Loaded workflow template {path}")
+        else:
+            self.reloads += 1
+            logger.info(f"Reloaded changed workflow template {path}")
+        self._store(fresh)
+        return fresh
+
+    def get_stats(self) -> dict:
+        """Registry metrics"""
+        return {
+            "templates": len(self._templates),
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+        }
+
+
+# Global registry instance (one per worker process)
+workflow_registry = WorkflowRegistry()
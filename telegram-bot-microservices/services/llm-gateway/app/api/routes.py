@@ -3,7 +3,8 @@ LLM Gateway API routes
 """
 import time
 import logging
-from fastapi import APIRouter, HTTPException, status
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, Header, HTTPException, status
 from fastapi.responses import StreamingResponse
 from openai import APIError, APITimeoutError
 
@@ -13,9 +14,10 @@ from app.schemas.chat import (
     HealthResponse
 )
 from app.services.llm_client import llm_client
-from app.services.cache import llm_cache
+from app.services.cache import llm_cache, request_fingerprint
 from app.services.circuit_breaker import circuit_breaker
-from app.services.rate_limiter import rate_limiter
+from app.services.rate_limiter import rate_limiter, RateLimitExceeded
+from app.services.singleflight import singleflight, SingleflightError
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -24,100 +26,195 @@ router = APIRouter()
 
 
 @router.post("/chat/completions", response_model=ChatCompletionResponse)
-async def create_chat_completion(request: ChatCompletionRequest):
+async def create_chat_completion(
+    request: ChatCompletionRequest,
+    x_llm_route: Optional[str] = Header(default=None),
+    x_llm_tenant: Optional[str] = Header(default=None)
+):
     """
     Create chat completion (OpenAI-compatible)
 
     Supports:
     - Request-response mode (stream=false)
     - Streaming mode (stream=true) via SSE
-    - Redis caching
+    - Redis caching (see LLMCache.should_cache)
     - Circuit breaker protection
     - Rate limiting
-    """
-
-    # Check circuit breaker
-    if settings.circuit_breaker_enabled and circuit_breaker.is_open():
-        logger.error("Circuit breaker is OPEN - rejecting request")
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="LLM service is temporarily unavailable"
-        )
-
-    # Rate limiting
-    if settings.rate_limit_enabled:
-        try:
-            await rate_limiter.acquire()
-        except Exception as e:
-            logger.error(f"Rate limiter error: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Too many requests, please slow down"
-            )
+    - Coalescing of identical in-flight requests (singleflight)
 
+    X-LLM-Route header labels the caller (chat, scene_detect, ...) in cache metrics.
+    X-LLM-Tenant header selects the per-tenant rate limit bucket.
+    """
     model = request.model or settings.vitte_llm_model
+    route = llm_cache.normalize_route(x_llm_route)
+    flight_key = request_fingerprint(request, model)
 
-    # Streaming mode
+    # Streaming mode (never cached)
     if request.stream and settings.streaming_enabled:
+        llm_cache.record_bypass(route)
+        # Every request pays its own token, also when it joins a flight
+        await acquire_rate_limit(model, x_llm_tenant)
         return StreamingResponse(
-            stream_completion(request, model),
+            stream_completion(request, model, flight_key),
             media_type="text/event-stream"
         )
 
     # Non-streaming mode with cache
     try:
         # Check cache
-        if settings.cache_enabled:
-            cached_response = await llm_cache.get(
-                request.messages,
-                model,
-                request.temperature
-            )
+        use_cache = llm_cache.should_cache(request)
+        if use_cache:
+            cached_response = await llm_cache.get(request, model, route)
             if cached_response:
-                circuit_breaker.record_success()
                 return build_response(cached_response, model, from_cache=True)
+        else:
+            llm_cache.record_bypass(route)
 
-        # Call LLM
-        response_text = await llm_client.complete(
-            messages=request.messages,
-            model=model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            presence_penalty=request.presence_penalty,
-            frequency_penalty=request.frequency_penalty
-        )
-
-        # Cache response
-        if settings.cache_enabled:
-            await llm_cache.set(
-                request.messages,
-                model,
-                request.temperature,
-                response_text
-            )
+        # Every request pays its own token, also when it joins a flight
+        await acquire_rate_limit(model, x_llm_tenant)
 
-        # Record success
-        circuit_breaker.record_success()
+        # Call LLM (identical in-flight requests share one upstream call)
+        response_text = await singleflight.do(
+            flight_key,
+            lambda: upstream_complete(request, model, route, use_cache)
+        )
 
         return build_response(response_text, model, from_cache=False)
 
+    except HTTPException:
+        raise
+    except SingleflightError as e:
+        # Leader's error on another replica: keep its status (429, 503, ...)
+        logger.error(f"Coalesced request failed: {e}")
+        if e.status_code is not None:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"LLM service error: {str(e)}"
+        )
     except (APITimeoutError, APIError) as e:
         logger.error(f"LLM API error: {e}")
-        circuit_breaker.record_failure()
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail=f"LLM service error: {str(e)}"
         )
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        circuit_breaker.record_failure()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
 
 
-async def stream_completion(request: ChatCompletionRequest, model: str):
+async def acquire_rate_limit(model: str, tenant: Optional[str]):
+    """Take a rate limiter token (every request, before joining a flight)"""
+    if not settings.rate_limit_enabled:
+        return
+    try:
+        await rate_limiter.acquire(model=model, tenant=tenant)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    except Exception as e:
+        logger.error(f"Rate limiter error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down"
+        )
+
+
+async def check_circuit():
+    """
+    Reject if the circuit is open (called right before the upstream call)
+
+    A half-open check admits this request as the probe, so it must end in
+    record_success / record_failure, or release_probe if it is cancelled.
+    Cache hits, coalesced followers and rate-limited requests never get here.
+    """
+    if settings.circuit_breaker_enabled and await circuit_breaker.is_open():
+        logger.error("Circuit breaker is OPEN - rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="LLM service is temporarily unavailable"
+        )
+
+
+async def upstream_complete(
+    request: ChatCompletionRequest,
+    model: str,
+    route: str,
+    use_cache: bool
+) -> AsyncIterator[str]:
+    """
+    Upstream call for non-streaming requests (singleflight producer)
+
+    Circuit breaker accounting and cache write happen here, once per
+    upstream call rather than once per coalesced request.
+    """
+    await check_circuit()
+    try:
+        response_text = await llm_client.complete(
+            messages=request.messages,
+            model=model,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            presence_penalty=request.presence_penalty,
+            frequency_penalty=request.frequency_penalty,
+            top_p=request.top_p,
+            stop=request.stop
+        )
+    except Exception:
+        await circuit_breaker.record_failure()
+        raise
+    except BaseException:
+        await circuit_breaker.release_probe()
+        raise
+
+    await circuit_breaker.record_success()
+
+    # Cache response
+    if use_cache:
+        await llm_cache.set(request, model, response_text, route)
+
+    yield response_text
+
+
+async def upstream_stream(
+    request: ChatCompletionRequest,
+    model: str
+) -> AsyncIterator[str]:
+    """Upstream call for streaming requests (singleflight producer)"""
+    await check_circuit()
+    try:
+        async for chunk_text in llm_client.complete_stream(
+            messages=request.messages,
+            model=model,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            presence_penalty=request.presence_penalty,
+            frequency_penalty=request.frequency_penalty,
+            top_p=request.top_p,
+            stop=request.stop
+        ):
+            yield chunk_text
+    except Exception:
+        await circuit_breaker.record_failure()
+        raise
+    except BaseException:
+        await circuit_breaker.release_probe()
+        raise
+
+    await circuit_breaker.record_success()
+
+
+async def stream_completion(
+    request: ChatCompletionRequest,
+    model: str,
+    flight_key: str
+):
     """
     Stream chat completion chunks via Server-Sent Events
 
@@ -131,11 +228,9 @@ async def stream_completion(request: ChatCompletionRequest, model: str):
     created = int(time.time())
 
     try:
-        async for chunk_text in llm_client.complete_stream(
-            messages=request.messages,
-            model=model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
+        async for chunk_text in singleflight.stream(
+            flight_key,
+            lambda: upstream_stream(request, model)
         ):
             # Format as SSE chunk
             chunk_data = {
@@ -170,11 +265,24 @@ async def stream_completion(request: ChatCompletionRequest, model: str):
         yield f"data: {json.dumps(final_chunk)}\n\n"
         yield "data: [DONE]\n\n"
 
-        circuit_breaker.record_success()
-
+    except (HTTPException, SingleflightError) as e:
+        status_code = e.status_code
+        if status_code is None:
+            # Upstream failure on the leader's replica
+            logger.error(f"Stream error: {e}")
+            error_type = "api_error"
+        else:
+            logger.error(f"Stream rejected: {e}")
+            error_type = "rate_limit_error" if status_code == 429 else "api_error"
+        error_chunk = {
+            "error": {
+                "message": getattr(e, "detail", None) or str(e),
+                "type": error_type
+            }
+        }
+        yield f"data: {json.dumps(error_chunk)}\n\n"
     except (APITimeoutError, APIError) as e:
         logger.error(f"Stream error: {e}")
-        circuit_breaker.record_failure()
         error_chunk = {
             "error": {
                 "message": str(e),
@@ -182,6 +290,15 @@ async def stream_completion(request: ChatCompletionRequest, model: str):
             }
         }
         yield f"data: {json.dumps(error_chunk)}\n\n"
+    except Exception as e:
+        logger.error(f"Unexpected stream error: {e}")
+        error_chunk = {
+            "error": {
+                "message": "Internal server error",
+                "type": "internal_error"
+            }
+        }
+        yield f"data: {json.dumps(error_chunk)}\n\n"
 
 
 def build_response(
@@ -228,8 +345,9 @@ async def health_check():
 async def get_metrics():
     """Get service metrics"""
     return {
-        "circuit_breaker": circuit_breaker.get_state(),
+        "circuit_breaker": await circuit_breaker.get_state(),
         "rate_limiter": rate_limiter.get_state(),
-        "cache_enabled": settings.cache_enabled,
+        "cache": llm_cache.get_stats(),
+        "singleflight": singleflight.get_stats(),
         "streaming_enabled": settings.streaming_enabled
     }
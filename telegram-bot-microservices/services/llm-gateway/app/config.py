@@ -1,6 +1,8 @@
 """
 LLM Gateway Configuration
 """
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -22,25 +24,49 @@ class Settings(BaseSettings):
     llm_timeout: int = 60  # seconds
     llm_max_retries: int = 3
     llm_backoff_factor: float = 2.0
+    llm_backoff_min: float = 2.0  # seconds between retries (exponential, clamped)
+    llm_backoff_max: float = 10.0
 
     # Redis cache
     redis_url: str = "redis://redis:6379/1"
     cache_ttl: int = 3600  # 1 hour for identical prompts
-    cache_enabled: bool = False  # DISABLED: cache doesn't account for repetition_penalty/frequency_penalty
+    cache_enabled: bool = True  # Key covers all generation params (see cache.request_fingerprint)
+    cache_max_temperature: float = 0.3  # Auto-cache only near-deterministic requests (request.cache overrides)
 
     # Rate limiting
     rate_limit_requests_per_minute: int = 100
     rate_limit_enabled: bool = True
+    rate_limit_backend: str = "redis"  # "redis" (shared by replicas) or "local"
+    rate_limit_model_rpm: Dict[str, int] = {}  # JSON, e.g. {"deepseek/deepseek-v3.2": 60}
+    rate_limit_tenant_rpm: int = 0  # Per X-LLM-Tenant limit, 0 = disabled
+    rate_limit_max_wait: float = 30.0  # seconds; longer waits are rejected with 429
 
     # Circuit breaker
     circuit_breaker_failure_threshold: int = 5
     circuit_breaker_timeout: int = 60  # seconds
     circuit_breaker_enabled: bool = True
+    circuit_breaker_backend: str = "redis"  # "redis" (shared by replicas) or "local"
+
+    # Singleflight (coalescing of identical in-flight requests)
+    singleflight_enabled: bool = True
+    singleflight_redis_enabled: bool = True  # Coalesce across replicas
+    singleflight_lock_ttl: int = 60  # seconds, refreshed by the leader while it produces
+    singleflight_result_ttl: int = 30  # seconds to keep finished stream for late followers
+    singleflight_wait_timeout: int = 240  # seconds a follower waits, must exceed llm_call_max_seconds
 
     # Streaming
     streaming_chunk_size: int = 50  # tokens per chunk
     streaming_enabled: bool = True
 
+    @property
+    def llm_call_max_seconds(self) -> float:
+        """Worst-case non-streaming upstream call: every attempt times out, plus backoff"""
+        backoff = sum(
+            min(self.llm_backoff_max, max(self.llm_backoff_min, self.llm_backoff_factor * 2 ** attempt))
+            for attempt in range(self.llm_max_retries - 1)
+        )
+        return self.llm_timeout * self.llm_max_retries + backoff
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -10,6 +10,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.api.routes import router
 from app.services.cache import llm_cache
+from app.services.singleflight import singleflight
+from app.services.circuit_breaker import circuit_breaker
+from app.services.rate_limiter import rate_limiter
 
 # Configure logging
 logging.basicConfig(
@@ -27,17 +30,25 @@ async def lifespan(app: FastAPI):
     logger.info(f"LLM Model: {settings.vitte_llm_model}")
     logger.info(f"Cache enabled: {settings.cache_enabled}")
     logger.info(f"Streaming enabled: {settings.streaming_enabled}")
-    logger.info(f"Circuit breaker enabled: {settings.circuit_breaker_enabled}")
-    logger.info(f"Rate limiting enabled: {settings.rate_limit_enabled}")
+    logger.info(f"Circuit breaker enabled: {settings.circuit_breaker_enabled} ({settings.circuit_breaker_backend})")
+    logger.info(f"Rate limiting enabled: {settings.rate_limit_enabled} ({settings.rate_limit_backend})")
 
     # Connect to Redis
     await llm_cache.connect()
+    await singleflight.connect()
+    if settings.circuit_breaker_enabled:
+        await circuit_breaker.connect()
+    if settings.rate_limit_enabled:
+        await rate_limiter.connect()
 
     yield
 
     # Shutdown
     logger.info(f"Shutting down {settings.service_name}...")
     await llm_cache.disconnect()
+    await singleflight.disconnect()
+    await circuit_breaker.disconnect()
+    await rate_limiter.disconnect()
 
 
 # Create FastAPI app
@@ -1,7 +1,7 @@
 """
 Chat completion schemas (OpenAI-compatible)
 """
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Union
 from pydantic import BaseModel, Field
 
 
@@ -20,6 +20,11 @@ class ChatCompletionRequest(BaseModel):
     stream: bool = False
     presence_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
     frequency_penalty: Optional[float] = Field(default=None, ge=-2.0, le=2.0)
+    top_p: Optional[float] = Field(default=None, gt=0.0, le=1.0)
+    stop: Optional[Union[str, List[str]]] = None
+    # Gateway extension: True - cache, False - bypass, None - cache only
+    # low-temperature (deterministic) requests
+    cache: Optional[bool] = None
 
 
 class ChatCompletionChunk(BaseModel):
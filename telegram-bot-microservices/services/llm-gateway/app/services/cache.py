@@ -1,17 +1,88 @@
 """
 Redis cache for LLM responses
+
+Cache key is a canonical fingerprint of every generation-affecting
+parameter (model, messages, temperature, max_tokens, penalties, top_p,
+stop), so requests that differ in any of them never share an entry.
+
+Per-route counters (hits / misses / bypass / errors / bytes) are kept
+in-process and exposed via /v1/metrics.
 """
 import hashlib
 import json
 import logging
-from typing import Optional, List
+import re
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict
 import redis.asyncio as aioredis
 
 from app.config import settings
-from app.schemas.chat import Message
+from app.schemas.chat import ChatCompletionRequest
 
 logger = logging.getLogger(__name__)
 
+# Bump when the fingerprint layout changes - old entries simply expire
+CACHE_KEY_VERSION = 2
+CACHE_KEY_PREFIX = f"llm:completion:v{CACHE_KEY_VERSION}:"
+
+DEFAULT_ROUTE = "default"
+MAX_ROUTES = 32  # Bound metric cardinality for caller-supplied route labels
+_ROUTE_RE = re.compile(r"^[a-z0-9_\-]{1,32}$")
+
+
+@dataclass
+class RouteCacheStats:
+    """Cache counters for one caller route"""
+    hits: int = 0
+    misses: int = 0
+    bypass: int = 0
+    errors: int = 0
+    bytes_served: int = 0
+    bytes_stored: int = 0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        lookups = self.hits + self.misses
+        data["hit_ratio"] = round(self.hits / lookups, 3) if lookups else 0.0
+        return data
+
+
+def request_fingerprint(request: ChatCompletionRequest, model: str) -> str:
+    """
+    Canonical fingerprint of a completion request
+
+    Every parameter that affects generation goes in; transport-only fields
+    (stream, cache) do not. Numbers are normalized to float and stop is
+    normalized to a list, so equivalent requests map to the same key.
+
+    Returns:
+        str: sha256 hex digest
+    """
+    def _num(value):
+        return None if value is None else float(value)
+
+    stop = request.stop
+    if isinstance(stop, str):
+        stop = [stop]
+
+    canonical = {
+        "model": model,
+        "messages": [[m.role, m.content] for m in request.messages],
+        "temperature": _num(request.temperature),
+        "max_tokens": request.max_tokens,
+        "presence_penalty": _num(request.presence_penalty),
+        "frequency_penalty": _num(request.frequency_penalty),
+        "top_p": _num(request.top_p),
+        "stop": stop,
+    }
+    payload = json.dumps(
+        canonical,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
 class LLMCache:
     """Redis-based cache for LLM responses"""
@@ -20,6 +91,8 @@ class LLMCache:
         self.redis: Optional[aioredis.Redis] = None
         self.enabled = settings.cache_enabled
         self.ttl = settings.cache_ttl
+        self.max_temperature = settings.cache_max_temperature
+        self._stats: Dict[str, RouteCacheStats] = {}
 
     async def connect(self):
         """Connect to Redis"""
@@ -45,40 +118,74 @@ class LLMCache:
             await self.redis.close()
             logger.info("Disconnected from Redis")
 
-    def _generate_cache_key(
-        self,
-        messages: List[Message],
-        model: str,
-        temperature: float
-    ) -> str:
-        """
-        Generate cache key from request parameters
+    # === Policy ===
 
-        Args:
-            messages: Chat messages
-            model: Model name
-            temperature: Temperature parameter
+    def should_cache(self, request: ChatCompletionRequest) -> bool:
+        """
+        Decide whether a request may be served from / stored in cache
 
-        Returns:
-            str: Cache key (hash)
+        Explicit request.cache wins; otherwise only low-temperature
+        (effectively deterministic) requests are cached.
         """
-        # Serialize messages to JSON
-        messages_json = json.dumps(
-            [m.model_dump() for m in messages],
-            sort_keys=True
-        )
+        if not self.enabled or not self.redis:
+            return False
+        if request.cache is not None:
+            return request.cache
+        return request.temperature <= self.max_temperature
 
-        # Create hash from messages + model + temperature
-        hash_input = f"{messages_json}:{model}:{temperature}"
-        cache_key = hashlib.sha256(hash_input.encode()).hexdigest()
+    def _generate_cache_key(self, request: ChatCompletionRequest, model: str) -> str:
+        """Generate cache key from request fingerprint"""
+        return f"{CACHE_KEY_PREFIX}{request_fingerprint(request, model)}"
 
-        return f"llm:completion:{cache_key}"
+    # === Stats ===
+
+    def normalize_route(self, route: Optional[str]) -> str:
+        """Validate caller route label, fall back to default"""
+        if not route:
+            return DEFAULT_ROUTE
+        route = route.strip().lower()
+        if not _ROUTE_RE.match(route):
+            return DEFAULT_ROUTE
+        if route not in self._stats and len(self._stats) >= MAX_ROUTES:
+            return DEFAULT_ROUTE
+        return route
+
+    def _route_stats(self, route: str) -> RouteCacheStats:
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = RouteCacheStats()
+        return stats
+
+    def record_bypass(self, route: str = DEFAULT_ROUTE):
+        """Count a request that skipped the cache"""
+        self._route_stats(route).bypass += 1
+
+    def get_stats(self) -> dict:
+        """Cache metrics: totals and per-route counters"""
+        routes = {name: stats.to_dict() for name, stats in self._stats.items()}
+        total = RouteCacheStats()
+        for stats in self._stats.values():
+            total.hits += stats.hits
+            total.misses += stats.misses
+            total.bypass += stats.bypass
+            total.errors += stats.errors
+            total.bytes_served += stats.bytes_served
+            total.bytes_stored += stats.bytes_stored
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "max_temperature": self.max_temperature,
+            "total": total.to_dict(),
+            "routes": routes,
+        }
+
+    # === Cache operations ===
 
     async def get(
         self,
-        messages: List[Message],
+        request: ChatCompletionRequest,
         model: str,
-        temperature: float
+        route: str = DEFAULT_ROUTE
     ) -> Optional[str]:
         """
         Get cached response
@@ -89,50 +196,58 @@ class LLMCache:
         if not self.enabled or not self.redis:
             return None
 
+        stats = self._route_stats(route)
         try:
-            cache_key = self._generate_cache_key(messages, model, temperature)
+            cache_key = self._generate_cache_key(request, model)
             cached = await self.redis.get(cache_key)
 
             if cached:
-                logger.info(f"Cache HIT: {cache_key[:16]}...")
+                stats.hits += 1
+                stats.bytes_served += len(cached.encode("utf-8"))
+                logger.info(f"Cache HIT [{route}]: {cache_key[-16:]}...")
                 return cached
             else:
-                logger.debug(f"Cache MISS: {cache_key[:16]}...")
+                stats.misses += 1
+                logger.debug(f"Cache MISS [{route}]: {cache_key[-16:]}...")
                 return None
 
         except Exception as e:
+            stats.errors += 1
             logger.error(f"Cache get error: {e}")
             return None
 
     async def set(
         self,
-        messages: List[Message],
+        request: ChatCompletionRequest,
         model: str,
-        temperature: float,
-        response: str
+        response: str,
+        route: str = DEFAULT_ROUTE
     ):
         """
         Cache response
 
         Args:
-            messages: Chat messages
-            model: Model name
-            temperature: Temperature
+            request: Original completion request
+            model: Resolved model name
             response: LLM response to cache
+            route: Caller route label (for stats)
         """
-        if not self.enabled or not self.redis:
+        if not self.enabled or not self.redis or not response:
             return
 
+        stats = self._route_stats(route)
         try:
-            cache_key = self._generate_cache_key(messages, model, temperature)
+            cache_key = self._generate_cache_key(request, model)
             await self.redis.setex(
                 cache_key,
                 self.ttl,
                 response
             )
-            logger.info(f"Cached response: {cache_key[:16]}... (TTL={self.ttl}s)")
+            stats.bytes_stored += len(response.encode("utf-8"))
+            logger.info(f"Cached response [{route}]: {cache_key[-16:]}... (TTL={self.ttl}s)")
 
         except Exception as e:
+            stats.errors += 1
             logger.error(f"Cache set error: {e}")
 
     async def invalidate_pattern(self, pattern: str = "llm:completion:*"):
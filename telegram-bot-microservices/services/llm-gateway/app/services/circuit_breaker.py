@@ -1,10 +1,20 @@
 """
 Circuit Breaker for LLM service
+
+Two backends (settings.circuit_breaker_backend):
+- "local": state in process memory, each replica learns about outages alone
+- "redis": state shared by all replicas in a Redis hash, transitions are
+  atomic Lua scripts and half-open probing is coordinated so only one
+  request cluster-wide tests the upstream. Falls back to local state if
+  Redis is unavailable.
 """
 import time
+import uuid
 import logging
+from collections import Counter
 from enum import Enum
-from typing import Callable, Any
+from typing import Optional
+import redis.asyncio as aioredis
 
 from app.config import settings
 
@@ -28,6 +38,8 @@ class CircuitBreaker:
     - HALF_OPEN: Allow one test request to check if service recovered
     """
 
+    backend = "local"
+
     def __init__(
         self,
         failure_threshold: int = 5,
@@ -44,29 +56,48 @@ class CircuitBreaker:
         self.last_failure_time: float = 0
         self.state = CircuitState.CLOSED
 
-    def is_open(self) -> bool:
+        # Metrics
+        self.transitions: Counter = Counter()
+        self.rejected = 0
+
+    async def connect(self):
+        """No external state for local backend"""
+
+    async def disconnect(self):
+        """No external state for local backend"""
+
+    def _record_transition(self, transition: str):
+        """Count and log a state transition ("closed->open", ...)"""
+        self.transitions[transition] += 1
+        if transition.endswith("->open"):
+            logger.error(f"Circuit breaker: {transition} ({self.backend})")
+        else:
+            logger.info(f"Circuit breaker: {transition} ({self.backend})")
+
+    async def is_open(self) -> bool:
         """Check if circuit is open (rejecting requests)"""
         if self.state == CircuitState.OPEN:
             # Check if timeout expired -> transition to HALF_OPEN
             if time.time() - self.last_failure_time >= self.timeout:
                 self.state = CircuitState.HALF_OPEN
-                logger.info("Circuit breaker: OPEN -> HALF_OPEN (testing)")
+                self._record_transition("open->half_open")
                 return False
+            self.rejected += 1
             return True
         return False
 
-    def record_success(self):
+    async def record_success(self):
         """Record successful request"""
         if self.state == CircuitState.HALF_OPEN:
             # Successful test request -> close circuit
             self.state = CircuitState.CLOSED
             self.failure_count = 0
-            logger.info("Circuit breaker: HALF_OPEN -> CLOSED (service recovered)")
+            self._record_transition("half_open->closed")
         elif self.state == CircuitState.CLOSED:
             # Reset failure count on success
             self.failure_count = max(0, self.failure_count - 1)
 
-    def record_failure(self):
+    async def record_failure(self):
         """Record failed request"""
         self.failure_count += 1
         self.last_failure_time = time.time()
@@ -74,30 +105,243 @@ class CircuitBreaker:
         if self.state == CircuitState.HALF_OPEN:
             # Test request failed -> back to OPEN
             self.state = CircuitState.OPEN
-            logger.warning("Circuit breaker: HALF_OPEN -> OPEN (service still down)")
+            self._record_transition("half_open->open")
 
         elif self.state == CircuitState.CLOSED:
             if self.failure_count >= self.failure_threshold:
                 # Too many failures -> open circuit
                 self.state = CircuitState.OPEN
-                logger.error(
-                    f"Circuit breaker: CLOSED -> OPEN "
-                    f"({self.failure_count} failures, threshold={self.failure_threshold})"
-                )
+                self._record_transition("closed->open")
 
-    def get_state(self) -> dict:
+    async def release_probe(self):
+        """Probe ended without an upstream result (local half-open admits everyone)"""
+
+    async def get_state(self) -> dict:
         """Get circuit breaker state for monitoring"""
         return {
+            "backend": self.backend,
             "state": self.state.value,
             "failure_count": self.failure_count,
             "failure_threshold": self.failure_threshold,
             "timeout": self.timeout,
-            "last_failure_time": self.last_failure_time
+            "last_failure_time": self.last_failure_time,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions)
+        }
+
+
+# KEYS[1] = state hash, KEYS[2] = probe lock
+# ARGV[1] = timeout (s), ARGV[2] = probe ttl (ms), ARGV[3] = replica id
+# Returns: {allowed (0/1), transition or ""}
+_ALLOW_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'closed' then
+    return {1, ''}
+end
+if state == 'open' then
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local last = tonumber(redis.call('HGET', KEYS[1], 'last_failure') or '0')
+    if now - last < tonumber(ARGV[1]) then
+        return {0, ''}
+    end
+    if redis.call('SET', KEYS[2], ARGV[3], 'NX', 'PX', ARGV[2]) then
+        redis.call('HSET', KEYS[1], 'state', 'half_open')
+        return {1, 'open->half_open'}
+    end
+    return {0, ''}
+end
+-- half_open: one probe cluster-wide; a new one only if the prober vanished
+if redis.call('SET', KEYS[2], ARGV[3], 'NX', 'PX', ARGV[2]) then
+    return {1, ''}
+end
+return {0, ''}
+"""
+
+# KEYS[1] = state hash, KEYS[2] = probe lock
+_SUCCESS_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'half_open' then
+    redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0)
+    redis.call('DEL', KEYS[2])
+    return 'half_open->closed'
+end
+if state == 'closed' then
+    local failures = tonumber(redis.call('HGET', KEYS[1], 'failures') or '0')
+    if failures > 0 then
+        redis.call('HSET', KEYS[1], 'failures', failures - 1)
+    end
+end
+return ''
+"""
+
+# KEYS[1] = state hash, KEYS[2] = probe lock, ARGV[1] = failure threshold
+_FAILURE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+redis.call('HSET', KEYS[1], 'last_failure', tostring(now))
+if state == 'half_open' then
+    redis.call('HSET', KEYS[1], 'state', 'open')
+    redis.call('DEL', KEYS[2])
+    return 'half_open->open'
+end
+if state == 'closed' and failures >= tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'state', 'open')
+    return 'closed->open'
+end
+return ''
+"""
+
+
+# KEYS[1] = probe lock, ARGV[1] = replica id
+# Drops the lock only if this replica holds it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisCircuitBreaker(CircuitBreaker):
+    """
+    Circuit breaker with state shared across gateway replicas
+
+    One replica opening the circuit sheds load on all of them; after the
+    timeout exactly one request cluster-wide is let through as the probe.
+    Transition counters are per replica (each counts what it caused).
+    """
+
+    backend = "redis"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        timeout: int = 60,
+        name: str = "llm"
+    ):
+        super().__init__(failure_threshold, timeout)
+        self.state_key = f"llm:cb:{name}"
+        self.probe_key = f"llm:cb:{name}:probe"
+        # Probe lock outlives a full upstream call (all retries included),
+        # then another probe may go
+        self.probe_ttl_ms = round((settings.llm_call_max_seconds + 10) * 1000)
+        self.replica_id = uuid.uuid4().hex[:12]
+        self.redis: Optional[aioredis.Redis] = None
+        self._allow = None
+        self._success = None
+        self._failure = None
+        self._release = None
+
+    async def connect(self):
+        """Connect to Redis and register scripts"""
+        try:
+            self.redis = await aioredis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            await self.redis.ping()
+            self._allow = self.redis.register_script(_ALLOW_SCRIPT)
+            self._success = self.redis.register_script(_SUCCESS_SCRIPT)
+            self._failure = self.redis.register_script(_FAILURE_SCRIPT)
+            self._release = self.redis.register_script(_RELEASE_SCRIPT)
+            logger.info("Circuit breaker: shared state in Redis")
+        except Exception as e:
+            logger.error(f"Circuit breaker: Redis unavailable, using local state: {e}")
+            self.redis = None
+
+    async def disconnect(self):
+        """Disconnect from Redis"""
+        if self.redis:
+            await self.redis.close()
+
+    async def is_open(self) -> bool:
+        """Check shared state; may admit this request as the half-open probe"""
+        if self.redis is None:
+            return await super().is_open()
+        try:
+            allowed, transition = await self._allow(
+                keys=[self.state_key, self.probe_key],
+                args=[self.timeout, self.probe_ttl_ms, self.replica_id]
+            )
+        except Exception as e:
+            logger.error(f"Circuit breaker Redis error, using local state: {e}")
+            return await super().is_open()
+
+        if transition:
+            self._record_transition(transition)
+        if not allowed:
+            self.rejected += 1
+        return not allowed
+
+    async def record_success(self):
+        """Record successful request in shared state"""
+        if self.redis is None:
+            return await super().record_success()
+        try:
+            transition = await self._success(keys=[self.state_key, self.probe_key])
+        except Exception as e:
+            logger.error(f"Circuit breaker Redis error, using local state: {e}")
+            return await super().record_success()
+        if transition:
+            self._record_transition(transition)
+
+    async def record_failure(self):
+        """Record failed request in shared state"""
+        if self.redis is None:
+            return await super().record_failure()
+        try:
+            transition = await self._failure(
+                keys=[self.state_key, self.probe_key],
+                args=[self.failure_threshold]
+            )
+        except Exception as e:
+            logger.error(f"Circuit breaker Redis error, using local state: {e}")
+            return await super().record_failure()
+        if transition:
+            self._record_transition(transition)
+
+    async def release_probe(self):
+        """Let another request probe now instead of after the lock TTL"""
+        if self.redis is None:
+            return await super().release_probe()
+        try:
+            await self._release(keys=[self.probe_key], args=[self.replica_id])
+        except Exception as e:
+            logger.error(f"Circuit breaker Redis error: {e}")
+
+    async def get_state(self) -> dict:
+        """Get shared circuit breaker state for monitoring"""
+        if self.redis is None:
+            return await super().get_state()
+        try:
+            shared = await self.redis.hgetall(self.state_key)
+        except Exception as e:
+            logger.error(f"Circuit breaker Redis error: {e}")
+            return await super().get_state()
+        return {
+            "backend": self.backend,
+            "state": shared.get("state", CircuitState.CLOSED.value),
+            "failure_count": int(shared.get("failures", 0)),
+            "failure_threshold": self.failure_threshold,
+            "timeout": self.timeout,
+            "last_failure_time": float(shared.get("last_failure", 0)),
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions)
         }
 
 
+def create_circuit_breaker() -> CircuitBreaker:
+    """Create circuit breaker for the configured backend"""
+    cls = RedisCircuitBreaker if settings.circuit_breaker_backend == "redis" else CircuitBreaker
+    return cls(
+        failure_threshold=settings.circuit_breaker_failure_threshold,
+        timeout=settings.circuit_breaker_timeout
+    )
+
+
 # Singleton instance
-circuit_breaker = CircuitBreaker(
-    failure_threshold=settings.circuit_breaker_failure_threshold,
-    timeout=settings.circuit_breaker_timeout
-)
+circuit_breaker = create_circuit_breaker()
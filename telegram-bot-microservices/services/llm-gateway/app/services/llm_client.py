@@ -3,7 +3,7 @@ LLM Client with retry logic and streaming support
 """
 import asyncio
 import time
-from typing import List, AsyncIterator, Optional
+from typing import List, AsyncIterator, Optional, Union
 from openai import AsyncOpenAI, APIError, APITimeoutError
 from tenacity import (
     retry,
@@ -37,8 +37,8 @@ class LLMClient:
         stop=stop_after_attempt(settings.llm_max_retries),
         wait=wait_exponential(
             multiplier=settings.llm_backoff_factor,
-            min=2,
-            max=10
+            min=settings.llm_backoff_min,
+            max=settings.llm_backoff_max
         ),
         retry=retry_if_exception_type((APITimeoutError, APIError)),
         before_sleep=before_sleep_log(logger, logging.WARNING)
@@ -50,7 +50,9 @@ class LLMClient:
         temperature: float = 0.7,
         max_tokens: Optional[int] = None,
         presence_penalty: Optional[float] = None,
-        frequency_penalty: Optional[float] = None
+        frequency_penalty: Optional[float] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[Union[str, List[str]]] = None
     ) -> str:
         """
         Complete chat with retry logic
@@ -62,6 +64,8 @@ class LLMClient:
             max_tokens: Max tokens in response
             presence_penalty: Penalty for token presence (-2.0 to 2.0, positive = new topics)
             frequency_penalty: Penalty for frequent tokens (-2.0 to 2.0, positive = less repetition)
+            top_p: Nucleus sampling threshold
+            stop: Stop sequence(s)
 
         Returns:
             str: Assistant's response
@@ -83,6 +87,10 @@ class LLMClient:
                 params["presence_penalty"] = presence_penalty
             if frequency_penalty is not None:
                 params["frequency_penalty"] = frequency_penalty
+            if top_p is not None:
+                params["top_p"] = top_p
+            if stop is not None:
+                params["stop"] = stop
 
             # DEBUG: Log exact params sent to DeepSeek
             logger.warning(f"DeepSeek API params: model={params.get('model')}, temp={params.get('temperature')}, "
@@ -139,7 +147,11 @@ class LLMClient:
         messages: List[Message],
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        presence_penalty: Optional[float] = None,
+        frequency_penalty: Optional[float] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[Union[str, List[str]]] = None
     ) -> AsyncIterator[str]:
         """
         Complete chat with streaming
@@ -149,6 +161,10 @@ class LLMClient:
             model: Model to use
             temperature: Sampling temperature
             max_tokens: Max tokens in response
+            presence_penalty: Penalty for token presence (-2.0 to 2.0)
+            frequency_penalty: Penalty for frequent tokens (-2.0 to 2.0)
+            top_p: Nucleus sampling threshold
+            stop: Stop sequence(s)
 
         Yields:
             str: Text chunks as they arrive
@@ -157,13 +173,24 @@ class LLMClient:
             Streaming does NOT use retry logic - if it fails, it fails immediately
         """
         try:
-            stream = await self.client.chat.completions.create(
-                model=model or self.default_model,
-                messages=[m.model_dump() for m in messages],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
+            params = {
+                "model": model or self.default_model,
+                "messages": [m.model_dump() for m in messages],
+                "temperature": temperature,
+                "stream": True,
+            }
+            if max_tokens is not None:
+                params["max_tokens"] = max_tokens
+            if presence_penalty is not None:
+                params["presence_penalty"] = presence_penalty
+            if frequency_penalty is not None:
+                params["frequency_penalty"] = frequency_penalty
+            if top_p is not None:
+                params["top_p"] = top_p
+            if stop is not None:
+                params["stop"] = stop
+
+            stream = await self.client.chat.completions.create(**params)
 
             async for chunk in stream:
                 if chunk.choices and chunk.choices[0].delta.content:
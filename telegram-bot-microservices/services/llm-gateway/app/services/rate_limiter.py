@@ -1,15 +1,49 @@
 """
 Rate limiter for LLM API requests
+
+Token buckets with reservation semantics: acquire() takes a token right
+away, letting the bucket go negative when it is empty; the negative
+balance is the queue of waiters ahead. Each caller computes its own wait
+and sleeps without holding any lock, so waiters are served in arrival
+order and never block unrelated requests.
+
+Buckets: global, per model (settings.rate_limit_model_rpm) and per tenant
+(X-LLM-Tenant header, settings.rate_limit_tenant_rpm). A request needs a
+token from every bucket that applies.
+
+Backends (settings.rate_limit_backend):
+- "local": buckets in process memory (limit applies per replica). A bucket
+  that has refilled to capacity is the same as a missing one, so such
+  buckets are swept once per window; memory stays proportional to tenants
+  active in the last window, not to every tenant ever seen.
+- "redis": buckets in Redis, updated atomically by one Lua script, so the
+  limit holds across replicas. Falls back to local buckets on Redis errors.
 """
 import time
+import heapq
 import asyncio
 import logging
-from collections import deque
+from typing import Dict, List, Optional, Tuple
+import redis.asyncio as aioredis
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# (bucket key, rate, per_seconds)
+Bucket = Tuple[str, int, int]
+
+# Buckets listed in get_state (the most depleted ones)
+STATE_BUCKETS_LIMIT = 20
+
+
+class RateLimitExceeded(Exception):
+    """Wait for a token would exceed rate_limit_max_wait"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+
 
 class TokenBucketRateLimiter:
     """
@@ -18,63 +52,234 @@ class TokenBucketRateLimiter:
     Allows bursts while maintaining average rate limit
     """
 
-    def __init__(self, rate: int, per_seconds: int = 60):
+    backend = "local"
+
+    def __init__(
+        self,
+        rate: int,
+        per_seconds: int = 60,
+        model_rates: Optional[Dict[str, int]] = None,
+        tenant_rate: int = 0,
+        max_wait: float = 30.0
+    ):
         """
         Args:
-            rate: Number of requests allowed
+            rate: Number of requests allowed (global bucket)
             per_seconds: Time window (default: 60 seconds = 1 minute)
+            model_rates: Per-model request limits per window
+            tenant_rate: Per-tenant request limit per window (0 = off)
+            max_wait: Reject instead of waiting longer than this (seconds)
         """
         self.rate = rate
         self.per_seconds = per_seconds
-        self.tokens = rate
-        self.last_update = time.time()
-        self.lock = asyncio.Lock()
+        self.model_rates = model_rates or {}
+        self.tenant_rate = tenant_rate
+        self.max_wait = max_wait
+
+        # key -> [tokens, last_update, full_at]
+        self._buckets: Dict[str, List[float]] = {}
+        self._next_sweep = 0.0
+
+        # Metrics
+        self.acquired = 0
+        self.waited = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
 
-    async def acquire(self):
+    async def connect(self):
+        """No external state for local backend"""
+
+    async def disconnect(self):
+        """No external state for local backend"""
+
+    def _buckets_for(self, model: Optional[str], tenant: Optional[str]) -> List[Bucket]:
+        """Buckets a request must take a token from"""
+        buckets = [("global", self.rate, self.per_seconds)]
+        if model and model in self.model_rates:
+            buckets.append((f"model:{model}", self.model_rates[model], self.per_seconds))
+        if tenant and self.tenant_rate > 0:
+            buckets.append((f"tenant:{tenant}", self.tenant_rate, self.per_seconds))
+        return buckets
+
+    def _reserve_local(self, buckets: List[Bucket]) -> Tuple[bool, float]:
+        """
+        Reserve one token in every bucket (synchronous, no awaits inside)
+
+        Returns:
+            (reserved, wait_seconds)
+        """
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        refilled = []
+        wait = 0.0
+        for key, rate, per in buckets:
+            tokens, last_update, _ = self._buckets.get(key, (rate, now, now))
+            tokens = min(rate, tokens + (now - last_update) * rate / per)
+            refilled.append(tokens)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) * per / rate)
+
+        reserved = wait <= self.max_wait
+        for (key, rate, per), tokens in zip(buckets, refilled):
+            if reserved:
+                tokens -= 1
+            self._buckets[key] = [tokens, now, now + (rate - tokens) * per / rate]
+        return reserved, wait
+
+    def _sweep(self, now: float):
+        """Drop buckets that have refilled to capacity (absent = full)"""
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+        self._next_sweep = now + self.per_seconds
+
+    async def _reserve(self, buckets: List[Bucket]) -> Tuple[bool, float]:
+        return self._reserve_local(buckets)
+
+    async def acquire(self, model: Optional[str] = None, tenant: Optional[str] = None):
         """
         Acquire token (wait if bucket is empty)
 
+        Args:
+            model: Model name (per-model bucket, if configured)
+            tenant: Tenant id (per-tenant bucket, if enabled)
+
         Raises:
-            asyncio.TimeoutError: If waiting too long
+            RateLimitExceeded: If the wait would exceed max_wait
         """
-        async with self.lock:
-            now = time.time()
-            time_passed = now - self.last_update
-            self.last_update = now
-
-            # Refill tokens based on time passed
-            self.tokens = min(
-                self.rate,
-                self.tokens + (time_passed * self.rate / self.per_seconds)
-            )
+        reserved, wait_time = await self._reserve(self._buckets_for(model, tenant))
 
-            if self.tokens >= 1:
-                # Token available - consume it
-                self.tokens -= 1
-                logger.debug(f"Rate limiter: token acquired ({self.tokens:.1f} remaining)")
-                return
+        if not reserved:
+            self.rejected += 1
+            logger.warning(f"Rate limit exceeded (model={model}, tenant={tenant}), wait {wait_time:.2f}s")
+            raise RateLimitExceeded(wait_time)
 
-            # No tokens - calculate wait time
-            wait_time = (1 - self.tokens) * self.per_seconds / self.rate
+        self.acquired += 1
+        if wait_time > 0:
+            self.waited += 1
+            self.total_wait_seconds += wait_time
             logger.warning(f"Rate limit reached, waiting {wait_time:.2f}s...")
-
             await asyncio.sleep(wait_time)
 
-            # After waiting, token should be available
-            self.tokens = 0
-
     def get_state(self) -> dict:
         """Get rate limiter state for monitoring"""
         return {
+            "backend": self.backend,
             "rate": self.rate,
             "per_seconds": self.per_seconds,
-            "tokens_available": round(self.tokens, 2),
-            "last_update": self.last_update
+            "model_rates": self.model_rates,
+            "tenant_rate": self.tenant_rate,
+            "max_wait": self.max_wait,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "total_wait_seconds": round(self.total_wait_seconds, 2),
+            "local_buckets_count": len(self._buckets),
+            "local_buckets": {
+                key: round(tokens, 2)
+                for key, (tokens, _, _) in heapq.nsmallest(
+                    STATE_BUCKETS_LIMIT, self._buckets.items(), key=lambda item: item[1][0]
+                )
+            }
         }
 
 
+# KEYS = bucket keys
+# ARGV[1] = max_wait, then rate_i, per_i for each key
+# Returns: {reserved (0/1), wait seconds as string}
+_RESERVE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local max_wait = tonumber(ARGV[1])
+local refilled = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local per = tonumber(ARGV[i * 2 + 1])
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or rate
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(rate, tokens + (now - ts) * rate / per)
+    refilled[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) * per / rate)
+    end
+end
+local reserved = 0
+if wait <= max_wait then
+    reserved = 1
+end
+for i, key in ipairs(KEYS) do
+    local per = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tostring(refilled[i] - reserved), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(per * 2 + max_wait))
+end
+return {reserved, tostring(wait)}
+"""
+
+
+class RedisTokenBucketRateLimiter(TokenBucketRateLimiter):
+    """Token buckets shared by all gateway replicas"""
+
+    backend = "redis"
+    key_prefix = "llm:rl:"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.redis: Optional[aioredis.Redis] = None
+        self._script = None
+
+    async def connect(self):
+        """Connect to Redis and register the reservation script"""
+        try:
+            self.redis = await aioredis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            await self.redis.ping()
+            self._script = self.redis.register_script(_RESERVE_SCRIPT)
+            logger.info("Rate limiter: shared buckets in Redis")
+        except Exception as e:
+            logger.error(f"Rate limiter: Redis unavailable, using local buckets: {e}")
+            self.redis = None
+
+    async def disconnect(self):
+        """Disconnect from Redis"""
+        if self.redis:
+            await self.redis.close()
+
+    async def _reserve(self, buckets: List[Bucket]) -> Tuple[bool, float]:
+        if self.redis is None:
+            return self._reserve_local(buckets)
+
+        args: list = [self.max_wait]
+        for _, rate, per in buckets:
+            args.extend([rate, per])
+        try:
+            reserved, wait = await self._script(
+                keys=[self.key_prefix + key for key, _, _ in buckets],
+                args=args
+            )
+        except Exception as e:
+            logger.error(f"Rate limiter Redis error, using local buckets: {e}")
+            return self._reserve_local(buckets)
+        return bool(int(reserved)), float(wait)
+
+
+def create_rate_limiter() -> TokenBucketRateLimiter:
+    """Create rate limiter for the configured backend"""
+    cls = RedisTokenBucketRateLimiter if settings.rate_limit_backend == "redis" else TokenBucketRateLimiter
+    return cls(
+        rate=settings.rate_limit_requests_per_minute,
+        per_seconds=60,
+        model_rates=settings.rate_limit_model_rpm,
+        tenant_rate=settings.rate_limit_tenant_rpm,
+        max_wait=settings.rate_limit_max_wait
+    )
+
+
 # Singleton instance
-rate_limiter = TokenBucketRateLimiter(
-    rate=settings.rate_limit_requests_per_minute,
-    per_seconds=60
-)
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,386 @@
+"""
+Singleflight: coalesce identical in-flight LLM requests
+
+Duplicate requests (double taps, Telegram redelivery) with the same
+fingerprint attach to one upstream call instead of each paying for it.
+
+Two levels:
+- Local: one flight per fingerprint per replica. The upstream call runs in
+  a background task; every subscriber (first one included) replays the
+  chunks produced so far and then follows new ones, so streaming requests
+  fan out and a disconnecting client does not cancel the others.
+- Redis: the replica that wins SET NX on the lock key is the leader and
+  publishes chunks to a Redis Stream; other replicas follow that stream
+  instead of calling upstream. If the leader disappears before producing
+  anything, followers fall back to calling upstream themselves. A leader's
+  error is replayed to followers with its HTTP status and headers (429 +
+  Retry-After stays a 429 on every replica). The leader refreshes its lock
+  while producing; publishing and releasing check that the lock is still
+  its own, so a leader that lost the lock never writes into (or deletes)
+  the next leader's flight.
+
+Coalescing only shares the upstream call: every request still takes its
+own rate limiter token before joining a flight.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from typing import AsyncIterator, Callable, Dict, Optional
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Producer = Callable[[], AsyncIterator[str]]
+
+LOCK_PREFIX = "llm:sf:lock:"
+STREAM_PREFIX = "llm:sf:stream:"
+
+# KEYS[1] = lock, KEYS[2] = stream, ARGV[1] = replica id, ARGV[2..] = field/value pairs
+# Appends the entry only if this replica still holds the lock
+_PUBLISH_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('XADD', KEYS[2], '*', unpack(ARGV, 2))
+return 1
+"""
+
+# KEYS[1] = lock, ARGV[1] = replica id, ARGV[2] = lock ttl (s)
+_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1] = lock, KEYS[2] = stream, ARGV[1] = replica id, ARGV[2] = result ttl (s)
+# Drops the lock (and schedules the stream cleanup) only if this replica holds it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('DEL', KEYS[1])
+"""
+
+
+class SingleflightError(Exception):
+    """Upstream call failed on another replica"""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        """
+        Args:
+            message: Leader's error message
+            status_code: HTTP status of the leader's error (None = upstream failure)
+            headers: HTTP headers of the leader's error (Retry-After, ...)
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers
+
+
+class _Flight:
+    """One in-flight upstream call and its produced chunks"""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Replay produced chunks, then follow new ones until done"""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class Singleflight:
+    """Local + Redis request coalescing"""
+
+    def __init__(self):
+        self.enabled = settings.singleflight_enabled
+        self.redis_enabled = settings.singleflight_redis_enabled
+        self.lock_ttl = settings.singleflight_lock_ttl
+        self.result_ttl = settings.singleflight_result_ttl
+        self.poll_interval = 5.0  # XREAD block per poll, seconds
+        # A leader may legitimately retry upstream for llm_call_max_seconds
+        self.wait_timeout = max(
+            settings.singleflight_wait_timeout,
+            settings.llm_call_max_seconds + self.poll_interval
+        )
+
+        self.redis: Optional[aioredis.Redis] = None
+        self.replica_id = uuid.uuid4().hex[:12]
+        self._flights: Dict[str, _Flight] = {}
+        self._publish_entry = None
+        self._refresh = None
+        self._release_lock = None
+
+        # Metrics
+        self.leader_calls = 0
+        self.local_joins = 0
+        self.remote_joins = 0
+        self.remote_fallbacks = 0
+        self.lost_locks = 0
+
+    async def connect(self):
+        """Connect to Redis for cross-replica coalescing"""
+        if not self.enabled or not self.redis_enabled:
+            logger.info("Singleflight: Redis coordination disabled")
+            return
+
+        try:
+            self.redis = await aioredis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            await self.redis.ping()
+            self._publish_entry = self.redis.register_script(_PUBLISH_SCRIPT)
+            self._refresh = self.redis.register_script(_REFRESH_SCRIPT)
+            self._release_lock = self.redis.register_script(_RELEASE_SCRIPT)
+            logger.info(f"Singleflight connected to Redis (replica={self.replica_id})")
+        except Exception as e:
+            logger.error(f"Singleflight: failed to connect to Redis, local only: {e}")
+            self.redis = None
+
+    async def disconnect(self):
+        """Disconnect from Redis"""
+        if self.redis:
+            await self.redis.close()
+
+    # === Public API ===
+
+    async def stream(self, key: str, producer: Producer) -> AsyncIterator[str]:
+        """
+        Stream chunks of the (possibly shared) upstream call
+
+        Args:
+            key: Request fingerprint
+            producer: Factory for the upstream chunk iterator; called only
+                by the leader
+        """
+        if not self.enabled:
+            async for chunk in producer():
+                yield chunk
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, producer))
+        else:
+            self.local_joins += 1
+            logger.info(f"Singleflight: joined local flight {key[:16]}...")
+
+        async for chunk in flight.follow():
+            yield chunk
+
+    async def do(self, key: str, producer: Producer) -> str:
+        """Run (or join) the upstream call and return the full text"""
+        return "".join([chunk async for chunk in self.stream(key, producer)])
+
+    def get_stats(self) -> dict:
+        """Singleflight metrics"""
+        return {
+            "enabled": self.enabled,
+            "redis": self.redis is not None,
+            "in_flight": len(self._flights),
+            "leader_calls": self.leader_calls,
+            "local_joins": self.local_joins,
+            "remote_joins": self.remote_joins,
+            "remote_fallbacks": self.remote_fallbacks,
+            "lost_locks": self.lost_locks,
+        }
+
+    # === Internals ===
+
+    async def _run(self, key: str, flight: _Flight, producer: Producer):
+        """Produce chunks into the local flight (as leader or remote follower)"""
+        try:
+            if self.redis is not None and not await self._try_lead(key):
+                if await self._follow_remote(key, flight):
+                    return
+                self.remote_fallbacks += 1
+                logger.warning(f"Singleflight: remote leader vanished, calling upstream {key[:16]}...")
+                await self._lead(key, flight, producer, publish=False)
+            else:
+                await self._lead(key, flight, producer, publish=self.redis is not None)
+        except BaseException as e:
+            flight.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            flight.finish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def _try_lead(self, key: str) -> bool:
+        """Try to become cluster-wide leader for this fingerprint"""
+        try:
+            acquired = await self.redis.set(
+                LOCK_PREFIX + key, self.replica_id, nx=True, ex=self.lock_ttl
+            )
+            if acquired:
+                # Drop the stream of a previous (finished) flight
+                await self.redis.delete(STREAM_PREFIX + key)
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Singleflight lock error, proceeding as leader: {e}")
+            return True
+
+    async def _lead(self, key: str, flight: _Flight, producer: Producer, publish: bool):
+        """Call upstream, feed local subscribers and (optionally) other replicas"""
+        self.leader_calls += 1
+        keeper = asyncio.create_task(self._keep_lock(key)) if publish else None
+        try:
+            async for chunk in producer():
+                flight.push(chunk)
+                if publish:
+                    publish = await self._publish(key, {"c": chunk})
+            flight.finish()
+            if publish:
+                await self._publish(key, {"d": "1"})
+        except Exception as e:
+            flight.finish(e)
+            if publish:
+                await self._publish(key, self._error_fields(e))
+        finally:
+            if keeper is not None:
+                keeper.cancel()
+            if publish:
+                await self._release(key)
+
+    async def _keep_lock(self, key: str):
+        """Refresh the leader lock while producing (upstream may retry for minutes)"""
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            try:
+                if not await self._refresh(keys=[LOCK_PREFIX + key], args=[self.replica_id, self.lock_ttl]):
+                    return
+            except Exception as e:
+                logger.error(f"Singleflight lock refresh error: {e}")
+
+    @staticmethod
+    def _error_fields(error: Exception) -> dict:
+        """Stream entry for a failed flight (HTTP errors keep status and headers)"""
+        fields = {"e": str(getattr(error, "detail", None) or error) or type(error).__name__}
+        status_code = getattr(error, "status_code", None)
+        if isinstance(status_code, int):
+            fields["s"] = str(status_code)
+            headers = getattr(error, "headers", None)
+            if headers:
+                fields["h"] = json.dumps(dict(headers))
+        return fields
+
+    async def _publish(self, key: str, fields: dict) -> bool:
+        """Append entry to the flight stream; False disables further publishing"""
+        args = [self.replica_id]
+        for name, value in fields.items():
+            args += [name, value]
+        try:
+            if await self._publish_entry(keys=[LOCK_PREFIX + key, STREAM_PREFIX + key], args=args):
+                return True
+            self.lost_locks += 1
+            logger.warning(f"Singleflight: lock of {key[:16]}... taken over, stopped publishing")
+            return False
+        except Exception as e:
+            logger.error(f"Singleflight publish error: {e}")
+            return False
+
+    async def _release(self, key: str):
+        """Release leader lock (if still ours), keep the stream briefly for late followers"""
+        try:
+            await self._release_lock(
+                keys=[LOCK_PREFIX + key, STREAM_PREFIX + key],
+                args=[self.replica_id, self.result_ttl]
+            )
+        except Exception as e:
+            logger.error(f"Singleflight release error: {e}")
+
+    async def _follow_remote(self, key: str, flight: _Flight) -> bool:
+        """
+        Feed the local flight from another replica's stream
+
+        Returns:
+            bool: True if the flight completed, False if the leader vanished
+                before producing anything (caller should call upstream)
+
+        Raises:
+            SingleflightError: leader failed or stalled mid-stream
+        """
+        self.remote_joins += 1
+        logger.info(f"Singleflight: following remote flight {key[:16]}...")
+
+        stream_key = STREAM_PREFIX + key
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        last_id = "0-0"
+        received = 0
+
+        while True:
+            response = await self.redis.xread(
+                {stream_key: last_id},
+                count=100,
+                block=int(self.poll_interval * 1000)
+            )
+
+            if not response:
+                if received == 0 and not await self.redis.exists(LOCK_PREFIX + key):
+                    return False
+                if loop.time() > deadline:
+                    raise SingleflightError("Timed out waiting for coalesced request")
+                continue
+
+            for entry_id, fields in response[0][1]:
+                last_id = entry_id
+                if "c" in fields:
+                    flight.push(fields["c"])
+                    received += 1
+                elif "e" in fields:
+                    raise SingleflightError(
+                        fields["e"],
+                        status_code=int(fields["s"]) if "s" in fields else None,
+                        headers=json.loads(fields["h"]) if "h" in fields else None
+                    )
+                elif "d" in fields:
+                    flight.finish()
+                    return True
+
+
+# Singleton instance
+singleflight = Singleflight()
@@ -21,6 +21,7 @@ from shared.database.models import (
     NotificationLog,
     Broadcast,
     BroadcastLog,
+    BroadcastGiftCredit,
     # Enums
     AccessStatus,
     PersonaKind,
@@ -40,6 +41,8 @@ from shared.database.services import (
     create_subscription,
     update_subscription,
     increment_subscription_usage,
+    get_daily_message_limit,
+    FREE_DAILY_MESSAGES_LIMIT,
     # Dialog services
     get_dialog_by_id,
     get_user_dialogs,
@@ -59,8 +62,11 @@ from shared.database.image_service import (
     ImageQuotaResult,
     check_and_reset_daily_quota,
     get_images_remaining,
+    reserve_image_quota,
+    refund_image_quota,
     use_image_quota,
     add_purchased_images,
+    credit_broadcast_gift_images,
 )
 
 __all__ = [
@@ -86,6 +92,7 @@ __all__ = [
     "NotificationLog",
     "Broadcast",
     "BroadcastLog",
+    "BroadcastGiftCredit",
     # Enums
     "AccessStatus",
     "PersonaKind",
@@ -103,6 +110,8 @@ __all__ = [
     "create_subscription",
     "update_subscription",
     "increment_subscription_usage",
+    "get_daily_message_limit",
+    "FREE_DAILY_MESSAGES_LIMIT",
     # Dialog services
     "get_dialog_by_id",
     "get_user_dialogs",
@@ -121,6 +130,9 @@ __all__ = [
     "ImageQuotaResult",
     "check_and_reset_daily_quota",
     "get_images_remaining",
+    "reserve_image_quota",
+    "refund_image_quota",
     "use_image_quota",
     "add_purchased_images",
+    "credit_broadcast_gift_images",
 ]
@@ -4,16 +4,22 @@ Image Balance Service - управление квотой изображений
 Логика:
 - Free: 3 изображения разово (remaining_purchased_images)
 - Premium: безлимитная генерация (daily_subscription_quota > 0 = признак подписки)
+
+Списание атомарное: reserve_image_quota() одним условным UPDATE уменьшает
+remaining_purchased_images, параллельные генерации не могут потратить одно
+и то же изображение дважды. Если генерация не удалась - refund_image_quota()
+возвращает изображение.
 """
 
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Sequence
 from dataclasses import dataclass
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, exists, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from .models import ImageBalance, Subscription
+from .models import BroadcastGiftCredit, ImageBalance, Subscription
 
 
 @dataclass
@@ -37,33 +43,30 @@ async def check_and_reset_daily_quota(
     ВАЖНО: Квота НЕ накапливается!
     Если вчера осталось 10 из 20, сегодня будет снова 20, а не 30.
 
+    Статус подписки проверяется в том же запросе (EXISTS), отдельного
+    запроса к Subscription нет.
+
     Returns:
         ImageBalance или None если не найден
     """
+    subscription_active = exists().where(
+        Subscription.user_id == ImageBalance.user_id,
+        Subscription.is_active.is_(True),
+        Subscription.expires_at > datetime.now(timezone.utc),
+    )
     result = await db.execute(
-        select(ImageBalance).where(ImageBalance.user_id == user_id)
+        select(ImageBalance, subscription_active.label("subscription_active"))
+        .where(ImageBalance.user_id == user_id)
     )
-    image_balance = result.scalar_one_or_none()
+    row = result.one_or_none()
 
-    if not image_balance:
+    if not row:
         return None
 
-    # Если флаг подписки выставлен — проверяем актуальность подписки
-    if image_balance.daily_subscription_quota > 0:
-        now = datetime.now(timezone.utc)
-        sub_result = await db.execute(
-            select(Subscription).where(Subscription.user_id == user_id)
-        )
-        subscription = sub_result.scalar_one_or_none()
-        sub_active = (
-            subscription is not None
-            and subscription.is_active
-            and subscription.expires_at is not None
-            and subscription.expires_at > now
-        )
-        if not sub_active:
-            # Подписка истекла — сбрасываем флаг
-            image_balance.daily_subscription_quota = 0
+    image_balance, sub_active = row
+    if image_balance.daily_subscription_quota > 0 and not sub_active:
+        # Подписка истекла — сбрасываем флаг
+        image_balance.daily_subscription_quota = 0
 
     await db.flush()
     return image_balance
@@ -101,47 +104,44 @@ async def get_images_remaining(
     )
 
 
-async def use_image_quota(
+async def reserve_image_quota(
     db: AsyncSession,
     user_id: int
 ) -> ImageQuotaResult:
     """
-    Использовать 1 изображение из квоты.
+    Зарезервировать (списать) 1 купленное изображение одним запросом.
+
+    Условие и списание в одном UPDATE ... WHERE remaining > 0 RETURNING:
+    параллельные резервы выстраиваются в очередь на строке баланса и не
+    уводят остаток в минус.
 
-    Приоритет списания:
-    1. Сначала из ежедневной квоты Premium (daily)
-    2. Потом из купленных (purchased)
+    Резерв нужно зафиксировать коммитом транзакции. Если генерация
+    не удалась — вернуть через refund_image_quota(db, user_id, result.source).
 
     Returns:
-        ImageQuotaResult с обновлённой информацией
+        ImageQuotaResult с обновлённой информацией (source - откуда списали)
     """
-    # Проверяем и сбрасываем квоту если нужно
-    image_balance = await check_and_reset_daily_quota(db, user_id)
-
-    if not image_balance:
-        return ImageQuotaResult(
-            can_generate=False,
-            remaining_daily=0,
-            remaining_purchased=0,
-            total_remaining=0,
-            error="Баланс изображений не найден"
-        )
-
-    remaining_purchased = image_balance.remaining_purchased_images
-
-    if remaining_purchased <= 0:
-        return ImageQuotaResult(
-            can_generate=False,
-            remaining_daily=0,
-            remaining_purchased=0,
-            total_remaining=0,
-            error="Лимит изображений исчерпан"
+    result = await db.execute(
+        update(ImageBalance)
+        .where(
+            ImageBalance.user_id == user_id,
+            ImageBalance.remaining_purchased_images > 0,
         )
+        .values(remaining_purchased_images=ImageBalance.remaining_purchased_images - 1)
+        .returning(ImageBalance.remaining_purchased_images)
+        .execution_options(synchronize_session=False)
+    )
+    remaining = result.scalar_one_or_none()
 
-    image_balance.remaining_purchased_images -= 1
-    await db.flush()
+    if remaining is None:
+        # Баланса нет или квота исчерпана - различаем только для сообщения
+        quota = await get_images_remaining(db, user_id)
+        if quota.error:
+            return quota
+        quota.can_generate = False
+        quota.error = "Лимит изображений исчерпан"
+        return quota
 
-    remaining = image_balance.remaining_purchased_images
     return ImageQuotaResult(
         can_generate=True,
         remaining_daily=0,
@@ -151,6 +151,48 @@ async def use_image_quota(
     )
 
 
+async def refund_image_quota(
+    db: AsyncSession,
+    user_id: int,
+    source: Optional[str]
+) -> bool:
+    """
+    Вернуть изображение, зарезервированное reserve_image_quota().
+
+    Один UPDATE без предварительного чтения.
+
+    Args:
+        user_id: ID пользователя
+        source: ImageQuotaResult.source резерва
+
+    Returns:
+        True если изображение возвращено
+    """
+    if source != "purchased":
+        return False
+
+    result = await db.execute(
+        update(ImageBalance)
+        .where(ImageBalance.user_id == user_id)
+        .values(remaining_purchased_images=ImageBalance.remaining_purchased_images + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+async def use_image_quota(
+    db: AsyncSession,
+    user_id: int
+) -> ImageQuotaResult:
+    """
+    Использовать 1 изображение из квоты (резерв без последующего возврата).
+
+    Returns:
+        ImageQuotaResult с обновлённой информацией
+    """
+    return await reserve_image_quota(db, user_id)
+
+
 async def add_purchased_images(
     db: AsyncSession,
     user_id: int,
@@ -192,10 +234,76 @@ async def add_purchased_images(
     return await get_images_remaining(db, user_id)
 
 
+async def credit_broadcast_gift_images(
+    db: AsyncSession,
+    broadcast_id: int,
+    user_ids: Sequence[int],
+    count: int
+) -> int:
+    """
+    Начислить подарочные изображения рассылки пачке получателей одним запросом.
+
+    Вызывать в той же транзакции, что и запись BroadcastLog этой пачки.
+    Начисляется только тем, для кого удалось вставить отметку
+    BroadcastGiftCredit (первичный ключ broadcast_id + user_id, ON CONFLICT
+    DO NOTHING) - повторная отправка тому же пользователю (перезапуск, дубль
+    задачи, параллельная транзакция) второй раз не начислит.
+
+    Args:
+        broadcast_id: ID рассылки
+        user_ids: Получатели пачки
+        count: Изображений каждому
+
+    Returns:
+        Скольким пользователям начислено
+    """
+    if count <= 0 or not user_ids:
+        return 0
+
+    # Отметки вставляются только для тех, кому ещё не начисляли
+    credited = (
+        pg_insert(BroadcastGiftCredit)
+        .values([{"broadcast_id": broadcast_id, "user_id": user_id} for user_id in set(user_ids)])
+        .on_conflict_do_nothing(index_elements=[BroadcastGiftCredit.broadcast_id, BroadcastGiftCredit.user_id])
+        .returning(BroadcastGiftCredit.user_id)
+        .cte("credited")
+    )
+    first_delivery = select(
+        credited.c.user_id,
+        literal(count).label("total_purchased_images"),
+        literal(count).label("remaining_purchased_images"),
+        literal(0).label("daily_subscription_quota"),
+        literal(0).label("daily_subscription_used"),
+    )
+    stmt = pg_insert(ImageBalance).from_select(
+        [
+            "user_id",
+            "total_purchased_images",
+            "remaining_purchased_images",
+            "daily_subscription_quota",
+            "daily_subscription_used",
+        ],
+        first_delivery,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImageBalance.user_id],
+        set_={
+            "total_purchased_images": ImageBalance.total_purchased_images + stmt.excluded.total_purchased_images,
+            "remaining_purchased_images": ImageBalance.remaining_purchased_images + stmt.excluded.remaining_purchased_images,
+        },
+    ).returning(ImageBalance.user_id)
+
+    result = await db.execute(stmt)
+    return len(result.all())
+
+
 __all__ = [
     "ImageQuotaResult",
     "check_and_reset_daily_quota",
     "get_images_remaining",
+    "reserve_image_quota",
+    "refund_image_quota",
     "use_image_quota",
     "add_purchased_images",
+    "credit_broadcast_gift_images",
 ]
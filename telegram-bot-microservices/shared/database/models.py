@@ -431,6 +431,16 @@ class Broadcast(Base):
     sent_count = Column(Integer, default=0, nullable=False)
     failed_count = Column(Integer, default=0, nullable=False)
 
+    # Чекпоинт SCHEDULED рассылки: получатели идут по возрастанию user id,
+    # все до last_user_id включительно обработаны (продолжение после рестарта)
+    last_user_id = Column(BigInteger, nullable=True)
+
+    # Владелец RUNNING рассылки: воркер, который её выполняет, и его heartbeat
+    # (обновляется на каждой пачке). Другой воркер забирает рассылку только
+    # когда heartbeat устарел
+    runner_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     started_at = Column(DateTime(timezone=True), nullable=True)
@@ -466,6 +476,20 @@ class BroadcastLog(Base):
         return f"<BroadcastLog(broadcast_id={self.broadcast_id}, user_id={self.user_id}, success={self.success})>"
 
 
+class BroadcastGiftCredit(Base):
+    """Отметка о начислении подарка рассылки пользователю (не больше одной на пару)"""
+    __tablename__ = "broadcast_gift_credits"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<BroadcastGiftCredit(broadcast_id={self.broadcast_id}, user_id={self.user_id})>"
+
+
 class BroadcastMedia(Base):
     """Медиа файлы для рассылок"""
     __tablename__ = "broadcast_media"
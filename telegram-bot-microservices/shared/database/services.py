@@ -4,6 +4,7 @@ Database service layer with caching
 This module provides cached functions for database operations.
 All read operations are cached, write operations invalidate caches.
 """
+from datetime import datetime, timezone
 from typing import Optional
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -308,6 +309,44 @@ async def increment_subscription_usage(
     return subscription
 
 
+FREE_DAILY_MESSAGES_LIMIT = 20
+
+# Messages per day by plan (None = unlimited)
+DAILY_MESSAGE_LIMITS = {
+    "free": FREE_DAILY_MESSAGES_LIMIT,
+    "premium": None,
+    "enterprise": None,
+}
+
+
+def get_daily_message_limit(subscription: Optional[Subscription]) -> Optional[int]:
+    """
+    Daily message limit for the user's subscription tier
+
+    - Active paid subscription: DAILY_MESSAGE_LIMITS[plan]
+    - Free plan, no subscription, expired paid: FREE_DAILY_MESSAGES_LIMIT
+      (subscription.messages_limit defaults to 100 at registration and
+      is not the free tier allowance)
+
+    Args:
+        subscription: User subscription or None
+
+    Returns:
+        Messages per day or None if unlimited
+    """
+    if subscription is None:
+        return FREE_DAILY_MESSAGES_LIMIT
+
+    if subscription.plan != "free":
+        expires_at = subscription.expires_at
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if subscription.is_active and expires_at and expires_at > datetime.now(timezone.utc):
+            return DAILY_MESSAGE_LIMITS.get(subscription.plan)
+
+    return FREE_DAILY_MESSAGES_LIMIT
+
+
 # ==================== CACHE UTILITIES ====================
 
 async def invalidate_user_cache(user_id: int, username: Optional[str] = None):
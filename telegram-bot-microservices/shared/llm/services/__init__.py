@@ -22,6 +22,8 @@ from .prompt_builder import (
     PromptBuilder,
     build_chat_messages,
     build_system_prompt,
+    invalidate_prompt_cache,
+    get_prompt_cache_stats,
 )
 
 __all__ = [
@@ -43,4 +45,6 @@ __all__ = [
     "PromptBuilder",
     "build_chat_messages",
     "build_system_prompt",
+    "invalidate_prompt_cache",
+    "get_prompt_cache_stats",
 ]
@@ -10,9 +10,15 @@ Prompt Builder - модульный конструктор промптов дл
 6. Блок недавнего диалога
 7. Блок памяти
 8. Блок запрещённых фраз (динамический)
+
+Блоки 1-5 зависят только от (персонаж, история, язык, режим, атмосфера),
+поэтому собираются один раз и кэшируются (см. _PrefixCache). На каждый
+запрос подставляются только динамические блоки. Статический префикс
+идёт первым и побайтово стабилен — провайдер может кэшировать его.
 """
 
 import re
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any, Set
 
@@ -39,6 +45,9 @@ _PERSONA_EN_NAMES = {
     "hani": "Hani",
 }
 
+BLOCK_SEPARATOR = "\n\n---\n\n"
+PREFIX_CACHE_SIZE = 512  # mode/atmosphere приходят из запроса - ограничиваем размер
+
 
 @dataclass
 class Message:
@@ -77,6 +86,75 @@ class ChatPromptContext:
     language: str = "ru"
 
 
+class _PrefixCache:
+    """
+    LRU-кэш статических префиксов system prompt.
+
+    Ключ содержит сами строки base_prompt и prompt истории: при перезагрузке
+    модулей персонажей появляются новые объекты и старые записи просто
+    перестают совпадать. Хэш строки в CPython вычисляется один раз,
+    сравнение с тем же объектом - по identity, так что ключ дешёвый.
+    """
+
+    def __init__(self, maxsize: int = PREFIX_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[tuple, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        prefix = self._data.get(key)
+        if prefix is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return prefix
+
+    def put(self, key: tuple, prefix: str) -> None:
+        self._data[key] = prefix
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, persona_key: Optional[str] = None) -> int:
+        """Удалить записи персонажа (или все). Возвращает число удалённых."""
+        if persona_key is None:
+            removed = len(self._data)
+            self._data.clear()
+            return removed
+        keys = [k for k in self._data if k[0] == persona_key]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_prefix_cache = _PrefixCache()
+
+
+def invalidate_prompt_cache(persona_key: Optional[str] = None) -> int:
+    """
+    Сбросить кэш статических префиксов.
+
+    Вызывать при изменении персонажа (строка в БД, модуль промпта).
+
+    Args:
+        persona_key: Ключ персонажа или None - сбросить весь кэш
+
+    Returns:
+        Количество удалённых записей
+    """
+    return _prefix_cache.invalidate(persona_key)
+
+
+def get_prompt_cache_stats() -> Dict[str, int]:
+    """Размер кэша и счётчики hit/miss (для логов и метрик)."""
+    return _prefix_cache.stats()
+
+
 class PromptBuilder:
     """Конструктор промптов."""
 
@@ -294,19 +372,50 @@ If you don't know what to write — it's BETTER to write a short but unique resp
 
         return base_instruction
 
+    def _static_prefix_key(self) -> tuple:
+        """Ключ кэша: всё, от чего зависят статические блоки."""
+        story = self.stories.get(self.ctx.story_key) if self.ctx.story_key else None
+        return (
+            self.ctx.persona_key,
+            self.ctx.story_key,
+            self.ctx.language,
+            self.ctx.mode,
+            self.ctx.atmosphere,
+            self.base_prompt,
+            story["prompt"] if story else None,
+        )
+
+    def build_static_prefix(self) -> str:
+        """
+        Статическая часть system prompt: персонаж, история, безопасность,
+        интимность, режим/атмосфера. Берётся из кэша, если уже собрана.
+
+        Returns:
+            Текст статического префикса
+        """
+        key = self._static_prefix_key()
+        prefix = _prefix_cache.get(key)
+        if prefix is None:
+            blocks = [
+                self._build_persona_block(),
+                self._build_story_block(),
+                self._build_safety_block(),
+                self._build_intimacy_block(),
+                self._build_mode_block(),
+            ]
+            prefix = BLOCK_SEPARATOR.join(b for b in blocks if b.strip())
+            _prefix_cache.put(key, prefix)
+        return prefix
+
     def build_system_prompt(self) -> str:
         """
-        Собрать полный system prompt из всех блоков.
+        Собрать полный system prompt: кэшированный префикс + динамические блоки.
 
         Returns:
             Полный текст system prompt
         """
         blocks = [
-            self._build_persona_block(),
-            self._build_story_block(),
-            self._build_safety_block(),
-            self._build_intimacy_block(),
-            self._build_mode_block(),
+            self.build_static_prefix(),
             self._build_memory_block(),
             self._build_features_block(),
             self._build_no_repetition_block(),  # Инструкция против повторений - в конце!
@@ -315,7 +424,7 @@ If you don't know what to write — it's BETTER to write a short but unique resp
         # Фильтруем пустые блоки
         blocks = [b for b in blocks if b.strip()]
 
-        return "\n\n---\n\n".join(blocks)
+        return BLOCK_SEPARATOR.join(blocks)
 
     def build_messages(self, user_message: Optional[str] = None) -> List[Dict[str, str]]:
         """
@@ -383,4 +492,6 @@ __all__ = [
     "PromptBuilder",
     "build_chat_messages",
     "build_system_prompt",
+    "invalidate_prompt_cache",
+    "get_prompt_cache_stats",
 ]
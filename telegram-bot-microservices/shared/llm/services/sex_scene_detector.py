@@ -141,6 +141,7 @@ async def detect_sex_scene(
             messages=messages,
             temperature=0.1,
             max_tokens=20,
+            route="scene_detect",
         )
 
         if not result:
@@ -6,6 +6,8 @@ import logging
 import os
 from typing import Optional, Dict, Any
 
+from shared.utils.telegram_pacer import telegram_pacer
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,6 +48,8 @@ async def send_telegram_notification(
         data["reply_markup"] = reply_markup
 
     try:
+        # Shares the bot-wide pace with broadcasts (Telegram ~30 msg/sec per bot)
+        await telegram_pacer.acquire()
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 f"{telegram_api_url}/sendMessage",
@@ -60,6 +64,9 @@ async def send_telegram_notification(
                 logger.info(f"Notification sent to {chat_id}, message_id={message_id}")
                 return message_id
             else:
+                if response.status_code == 429:
+                    retry_after = (result.get("parameters") or {}).get("retry_after", 1)
+                    await telegram_pacer.pause(float(retry_after))
                 logger.error(f"Failed to send notification: {result.get('description')}")
                 return None
 
@@ -1,8 +1,19 @@
 """Utils module exports"""
 from shared.utils.logger import get_logger
-from shared.utils.redis import RedisClient, redis_client, DateTimeEncoder
+from shared.utils.redis import (
+    RedisClient,
+    redis_client,
+    DateTimeEncoder,
+    DAILY_MESSAGES_KEY,
+    BROADCAST_CANCEL_KEY,
+    BROADCAST_CANCEL_TTL,
+    next_day_boundary,
+)
 from shared.utils.minio import MinIOClient, minio_client
 from shared.utils.rate_limiter import RateLimiter, rate_limiter
+from shared.utils.telegram_files import TelegramFileCache, telegram_file_cache
+from shared.utils.telegram_pacer import TelegramPacer, telegram_pacer
+from shared.utils.async_runtime import AsyncWorkerRuntime, worker_runtime, run_async
 from shared.utils.qdrant import QdrantMemoryClient, qdrant_client
 from shared.utils.cache import (
     cached,
@@ -32,9 +43,23 @@ __all__ = [
     "RedisClient",
     "redis_client",
     "DateTimeEncoder",
+    "DAILY_MESSAGES_KEY",
+    "BROADCAST_CANCEL_KEY",
+    "BROADCAST_CANCEL_TTL",
+    "next_day_boundary",
     # Rate Limiter
     "RateLimiter",
     "rate_limiter",
+    # Telegram file_id cache
+    "TelegramFileCache",
+    "telegram_file_cache",
+    # Bot-wide Telegram send pacing
+    "TelegramPacer",
+    "telegram_pacer",
+    # Celery worker event loop
+    "AsyncWorkerRuntime",
+    "worker_runtime",
+    "run_async",
     # Cache decorators and utilities
     "cached",
     "cache_invalidate",
@@ -0,0 +1,167 @@
+"""
+Long-lived event loop for Celery worker processes
+
+Celery tasks are synchronous; running each one with asyncio.run() creates a
+new event loop per task, so pooled clients (SQLAlchemy engine, Redis pool,
+HTTP sessions) either get rebuilt every time or end up bound to a closed loop.
+
+AsyncWorkerRuntime keeps one event loop per worker process, running in a
+background thread. Tasks submit coroutines with run() and block until they
+finish; pooled clients created inside those coroutines live on the same loop
+for the life of the process. Shutdown hooks (engine dispose, session close)
+run on the loop when the worker process exits.
+
+Usage (in the Celery app module):
+    worker_runtime.install()
+    worker_runtime.on_shutdown(close_db)
+
+    @celery_app.task
+    def my_task():
+        return run_async(my_task_async())
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Coroutine, List, Optional
+
+from shared.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+ShutdownHook = Callable[[], Awaitable[Any]]
+
+
+class AsyncWorkerRuntime:
+    """One event loop per process, driven by a daemon thread"""
+
+    def __init__(self, shutdown_timeout: float = 30.0):
+        """
+        Args:
+            shutdown_timeout: Max seconds for shutdown hooks to finish
+        """
+        self.shutdown_timeout = shutdown_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._shutdown_hooks: List[ShutdownHook] = []
+
+        # Metrics
+        self.tasks_run = 0
+        self.tasks_failed = 0
+        self.total_run_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        # A loop thread inherited through fork() does not exist in the child
+        return self._loop is not None and self._pid == os.getpid()
+
+    def start(self):
+        """Start the loop thread (idempotent; restarts after fork)"""
+        with self._lock:
+            if self.running:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=self._run_loop,
+                args=(loop,),
+                name="async-worker-loop",
+                daemon=True,
+            )
+            thread.start()
+            self._loop, self._thread, self._pid = loop, thread, os.getpid()
+        logger.info(f"Async worker loop started (pid={self._pid})")
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Run coroutine on the worker loop and wait for its result.
+
+        Args:
+            coro: Coroutine to run
+            timeout: Max seconds to wait (None = no limit; Celery time
+                limits still apply)
+
+        Returns:
+            Coroutine result (exceptions are re-raised in the caller)
+        """
+        if not self.running:
+            self.start()
+
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Includes SoftTimeLimitExceeded / timeouts - don't leave it running
+            future.cancel()
+            self.tasks_failed += 1
+            raise
+        finally:
+            self.tasks_run += 1
+            self.total_run_seconds += time.monotonic() - started
+
+    def on_shutdown(self, hook: ShutdownHook):
+        """Register async cleanup to run on the loop at process shutdown"""
+        self._shutdown_hooks.append(hook)
+
+    async def _run_shutdown_hooks(self):
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Worker shutdown hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+
+    def stop(self):
+        """Run shutdown hooks, stop the loop and join its thread"""
+        with self._lock:
+            if not self.running:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._pid = None
+
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._run_shutdown_hooks(), loop
+            ).result(self.shutdown_timeout)
+        except Exception as e:
+            logger.error(f"Worker shutdown hooks did not complete: {e}")
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        if not thread.is_alive():
+            loop.close()
+        logger.info("Async worker loop stopped")
+
+    def install(self):
+        """Start with each Celery worker process, stop when it exits"""
+        from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+
+        worker_process_init.connect(lambda **kwargs: self.start(), weak=False)
+        worker_process_shutdown.connect(lambda **kwargs: self.stop(), weak=False)
+        # solo / threads pools have no child processes
+        worker_shutdown.connect(lambda **kwargs: self.stop(), weak=False)
+
+    def get_stats(self) -> dict:
+        """Runtime metrics"""
+        return {
+            "running": self.running,
+            "tasks_run": self.tasks_run,
+            "tasks_failed": self.tasks_failed,
+            "avg_run_seconds": round(self.total_run_seconds / self.tasks_run, 3) if self.tasks_run else 0.0,
+            "shutdown_hooks": len(self._shutdown_hooks),
+        }
+
+
+# Global runtime instance (one loop per worker process)
+worker_runtime = AsyncWorkerRuntime()
+
+
+def run_async(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """Run coroutine on this process's worker loop (see AsyncWorkerRuntime.run)"""
+    return worker_runtime.run(coro, timeout)
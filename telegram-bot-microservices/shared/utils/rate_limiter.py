@@ -1,21 +1,64 @@
 """
 Redis-based rate limiter utility
 
-Uses Token Bucket algorithm for rate limiting with Redis backend
+Sliding-window log per (resource, user) in a Redis sorted set. All windows
+that apply to a request are checked and recorded by one Lua script, so a
+check is a single round trip and concurrent requests cannot slip past the
+limit between read and write (or at a fixed window edge).
 """
-import time
-from typing import Optional, Tuple
+import math
+import uuid
+from typing import Optional, Sequence, Tuple
 from shared.utils.redis import redis_client
 from shared.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# (resource, limit, window seconds)
+Window = Tuple[str, int, int]
+
+# KEYS = one sorted set per window
+# ARGV[1] = request id, then limit_i, window_ms_i for each key
+# Returns: {allowed (0/1), retry after ms, 1-based index of violated window}
+# A request is recorded in every window only if all of them allow it.
+_SLIDING_WINDOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local retry = 0
+local violated = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    if count >= limit then
+        -- Slot frees when the oldest request that keeps us at the limit expires
+        local oldest = redis.call('ZRANGE', key, count - limit, count - limit, 'WITHSCORES')
+        local wait = tonumber(oldest[2]) + window - now
+        if wait > retry then
+            retry = wait
+            violated = i
+        end
+    end
+end
+if violated > 0 then
+    return {0, retry, violated}
+end
+local member = now .. ':' .. ARGV[1]
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, member)
+    redis.call('PEXPIRE', key, tonumber(ARGV[i * 2 + 1]))
+end
+return {1, 0, 0}
+"""
+
 
 class RateLimiter:
     """
-    Token Bucket rate limiter with Redis backend
+    Sliding-window rate limiter with Redis backend
 
-    Supports multiple time windows (e.g., 10/minute, 100/hour)
+    Supports multiple time windows checked together
+    (e.g., 3/5 seconds and 10/minute)
     """
 
     def __init__(self, prefix: str = "rate_limit"):
@@ -26,6 +69,72 @@ class RateLimiter:
             prefix: Redis key prefix for rate limit data
         """
         self.prefix = prefix
+        self._script = None
+        self._script_client = None
+
+    def _key(self, resource: str, user_id: int) -> str:
+        return f"{self.prefix}:sw:{resource}:{user_id}"
+
+    async def _get_script(self):
+        """Register the sliding-window script on the current Redis client"""
+        await redis_client.connect()
+        if self._script is None or self._script_client is not redis_client.client:
+            self._script = redis_client.client.register_script(_SLIDING_WINDOW_SCRIPT)
+            self._script_client = redis_client.client
+        return self._script
+
+    async def check_limits(
+        self,
+        user_id: int,
+        windows: Sequence[Window]
+    ) -> Tuple[bool, Optional[int], Optional[str]]:
+        """
+        Check and record a request against several windows in one Redis call
+
+        Args:
+            user_id: User ID to check
+            windows: (resource, limit, window seconds) for every limit that applies
+
+        Returns:
+            Tuple of (is_allowed, retry_after_seconds, violated_resource)
+            - retry_after / violated_resource are None if allowed; when several
+              windows are exceeded, the one with the longest wait is reported
+
+        Example:
+            allowed, retry, resource = await limiter.check_limits(
+                user_id=123,
+                windows=[("antiflood", 3, 5), ("messages", 10, 60)]
+            )
+        """
+        if not windows:
+            return True, None, None
+
+        args: list = [uuid.uuid4().hex[:8]]
+        for _, limit, window in windows:
+            args.extend([limit, window * 1000])
+
+        try:
+            script = await self._get_script()
+            allowed, retry_ms, violated = await script(
+                keys=[self._key(resource, user_id) for resource, _, _ in windows],
+                args=args
+            )
+        except Exception as e:
+            logger.error(f"Rate limiter error: {e}")
+            # Fail open - allow request on error to avoid blocking users
+            return True, None, None
+
+        if allowed:
+            return True, None, None
+
+        resource, limit, window = windows[int(violated) - 1]
+        retry_after = max(1, math.ceil(int(retry_ms) / 1000))
+        logger.warning(
+            f"Rate limit exceeded for user {user_id}, "
+            f"resource={resource}, limit={limit}/{window}s, "
+            f"retry_after={retry_after}s"
+        )
+        return False, retry_after, resource
 
     async def check_rate_limit(
         self,
@@ -60,69 +169,8 @@ class RateLimiter:
             if not allowed:
                 await message.answer(f"Too many requests. Wait {retry}s")
         """
-        key = f"{self.prefix}:{resource}:{user_id}"
-        current_time = int(time.time())
-
-        try:
-            await redis_client.connect()
-
-            # Get current count and timestamp
-            data = await redis_client.get_json(key)
-
-            if not data:
-                # First request - allow and set initial data
-                await redis_client.set_json(
-                    key,
-                    {
-                        "count": 1,
-                        "window_start": current_time
-                    },
-                    expire=window
-                )
-                return True, None
-
-            count = data.get("count", 0)
-            window_start = data.get("window_start", current_time)
-            elapsed = current_time - window_start
-
-            # Check if window expired - reset counter
-            if elapsed >= window:
-                await redis_client.set_json(
-                    key,
-                    {
-                        "count": 1,
-                        "window_start": current_time
-                    },
-                    expire=window
-                )
-                return True, None
-
-            # Within window - check limit
-            if count < limit:
-                # Increment counter
-                await redis_client.set_json(
-                    key,
-                    {
-                        "count": count + 1,
-                        "window_start": window_start
-                    },
-                    expire=window - elapsed
-                )
-                return True, None
-
-            # Rate limit exceeded
-            retry_after = window - elapsed
-            logger.warning(
-                f"Rate limit exceeded for user {user_id}, "
-                f"resource={resource}, limit={limit}/{window}s, "
-                f"retry_after={retry_after}s"
-            )
-            return False, retry_after
-
-        except Exception as e:
-            logger.error(f"Rate limiter error: {e}")
-            # Fail open - allow request on error to avoid blocking users
-            return True, None
+        allowed, retry_after, _ = await self.check_limits(user_id, [(resource, limit, window)])
+        return allowed, retry_after
 
     async def get_remaining(
         self,
@@ -143,14 +191,13 @@ class RateLimiter:
         Returns:
             Number of remaining requests
         """
-        key = f"{self.prefix}:{resource}:{user_id}"
+        key = self._key(resource, user_id)
 
         try:
-            data = await redis_client.get_json(key)
-            if not data:
-                return limit
-
-            count = data.get("count", 0)
+            await redis_client.connect()
+            seconds, microseconds = await redis_client.client.time()
+            now_ms = seconds * 1000 + microseconds // 1000
+            count = await redis_client.client.zcount(key, f"({now_ms - window * 1000}", "+inf")
             return max(0, limit - count)
         except Exception as e:
             logger.error(f"Error getting remaining limit: {e}")
@@ -171,7 +218,7 @@ class RateLimiter:
         Returns:
             True if reset successful
         """
-        key = f"{self.prefix}:{resource}:{user_id}"
+        key = self._key(resource, user_id)
 
         try:
             deleted = await redis_client.delete(key)
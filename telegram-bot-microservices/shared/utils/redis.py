@@ -4,11 +4,44 @@ Redis client utility with caching support
 import os
 import json
 import redis.asyncio as aioredis
-from typing import Optional, Any, Dict
-from datetime import datetime, date
+from typing import Optional, Any, Dict, Tuple
+from datetime import datetime, date, timedelta, timezone
 from decimal import Decimal
 
 
+# Daily message counter (read by bot menu, admin analytics)
+DAILY_MESSAGES_KEY = "user:{user_id}:messages:daily"
+
+# Set by admin on cancel, checked by the broadcast worker once per batch
+BROADCAST_CANCEL_KEY = "broadcast:{broadcast_id}:cancelled"
+BROADCAST_CANCEL_TTL = 7 * 24 * 3600
+
+# Check-and-increment in one server-side step.
+# KEYS[1] = counter, ARGV[1] = limit (-1 = unlimited), ARGV[2] = amount,
+# ARGV[3] = unix expire-at (0 = no expiry, set only when the key is created)
+# Returns: {allowed (0/1), counter value}
+_INCREMENT_CAPPED_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local amount = tonumber(ARGV[2])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if limit >= 0 and current + amount > limit then
+    return {0, current}
+end
+local value = redis.call('INCRBY', KEYS[1], amount)
+if value == amount and tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIREAT', KEYS[1], ARGV[3])
+end
+return {1, value}
+"""
+
+
+def next_day_boundary(now: Optional[datetime] = None) -> int:
+    """Unix timestamp of the next midnight (UTC) - daily counters reset there"""
+    now = now or datetime.now(timezone.utc)
+    tomorrow = (now + timedelta(days=1)).date()
+    return int(datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc).timestamp())
+
+
 class DateTimeEncoder(json.JSONEncoder):
     """Custom JSON encoder for datetime objects"""
     def default(self, obj):
@@ -25,6 +58,7 @@ class RedisClient:
     def __init__(self):
         self.client: Optional[aioredis.Redis] = None
         self.redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+        self._increment_capped = None
         # Cache statistics
         self._stats = {
             "hits": 0,
@@ -50,6 +84,7 @@ class RedisClient:
         if self.client:
             await self.client.close()
             self.client = None
+            self._increment_capped = None
 
     async def get(self, key: str) -> Optional[str]:
         """Get value by key"""
@@ -158,6 +193,40 @@ class RedisClient:
             await self.connect()
         return await self.client.incrby(key, amount)
 
+    async def increment_capped(
+        self,
+        key: str,
+        limit: Optional[int],
+        amount: int = 1,
+        expire_at: Optional[int] = None
+    ) -> Tuple[bool, int]:
+        """
+        Atomically increment counter unless it would exceed limit (one round trip)
+
+        Args:
+            key: Counter key
+            limit: Max counter value (None = unlimited)
+            amount: Increment
+            expire_at: Unix timestamp to expire the key at (set on creation)
+
+        Returns:
+            (allowed, counter value) - counter is unchanged when not allowed
+        """
+        if not self.client:
+            await self.connect()
+        if self._increment_capped is None:
+            self._increment_capped = self.client.register_script(_INCREMENT_CAPPED_SCRIPT)
+
+        allowed, value = await self._increment_capped(
+            keys=[key],
+            args=[-1 if limit is None else limit, amount, expire_at or 0]
+        )
+        return bool(allowed), int(value)
+
+    async def increment_daily(self, key: str, limit: Optional[int], amount: int = 1) -> Tuple[bool, int]:
+        """Capped counter that resets at the day boundary (UTC midnight)"""
+        return await self.increment_capped(key, limit, amount, expire_at=next_day_boundary())
+
     async def expire(self, key: str, seconds: int) -> bool:
         """Set expiration on existing key"""
         if not self.client:
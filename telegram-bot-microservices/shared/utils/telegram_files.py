@@ -0,0 +1,90 @@
+"""
+Telegram file_id cache
+
+Maps an image source (public URL, or any stable content key such as a hash)
+to the file_id Telegram returned the first time this bot sent it. Later
+sends pass the file_id: no MinIO download, no multipart upload.
+
+file_ids are only valid for the bot that received them, so keys include
+the bot id (from BOT_TOKEN). A stale file_id must be dropped with forget()
+before re-uploading.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from shared.utils.redis import redis_client
+from shared.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TELEGRAM_FILE_ID_TTL = 30 * 24 * 3600  # Generated images are rarely resent - let them age out
+
+
+class TelegramFileCache:
+    """Redis-backed image source -> Telegram file_id mapping"""
+
+    def __init__(self, prefix: str = "tg:file_id", ttl: int = TELEGRAM_FILE_ID_TTL):
+        """
+        Args:
+            prefix: Redis key prefix
+            ttl: Seconds a mapping is kept (refreshed on every store)
+        """
+        self.prefix = prefix
+        self.ttl = ttl
+        self.bot_id = os.getenv("BOT_TOKEN", "").split(":", 1)[0] or "bot"
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _key(self, source: str) -> str:
+        digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        return f"{self.prefix}:{self.bot_id}:{digest}"
+
+    async def get(self, source: str) -> Optional[str]:
+        """Cached file_id for source, None if unknown (or Redis is down)"""
+        try:
+            file_id = await redis_client.get(self._key(source))
+        except Exception as e:
+            logger.error(f"file_id cache get error: {e}")
+            return None
+        if file_id:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return file_id
+
+    async def set(self, source: str, file_id: str):
+        """Remember file_id returned by Telegram for source"""
+        try:
+            await redis_client.set(self._key(source), file_id, expire=self.ttl)
+            self.stores += 1
+        except Exception as e:
+            logger.error(f"file_id cache set error: {e}")
+
+    async def forget(self, source: str):
+        """Drop a file_id Telegram rejected"""
+        try:
+            await redis_client.delete(self._key(source))
+            self.invalidations += 1
+            logger.warning(f"Dropped stale Telegram file_id for {source}")
+        except Exception as e:
+            logger.error(f"file_id cache delete error: {e}")
+
+    def get_stats(self) -> dict:
+        """Cache metrics"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+        }
+
+
+# Global file_id cache instance
+telegram_file_cache = TelegramFileCache()
@@ -0,0 +1,205 @@
+"""
+Bot-wide Telegram send pacing
+
+Telegram allows a bot ~30 messages/sec across all chats and answers 429
+with retry_after above that. Every worker process and every task type
+(broadcasts, new-user broadcasts, notifications) sends as the same bot, so
+the pace and the 429 pause are kept in Redis instead of per process:
+
+- acquire(): one Lua script reserves the next slot on a shared schedule
+  (slot = max(now, next free slot, paused until); next free slot += interval)
+  and returns how long the caller has to sleep. Callers are served in
+  reservation order and no lock is held while sleeping.
+- pause(retry_after): moves the shared pause deadline (and the schedule)
+  forward, so all processes stop sending until Telegram allows it again.
+
+If Redis is unavailable the same schedule is kept in process memory (Redis
+is retried after REDIS_RETRY_SECONDS, not on every message).
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from shared.utils.redis import redis_client
+from shared.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# After a Redis error, pace locally this long before trying Redis again
+REDIS_RETRY_SECONDS = 5.0
+
+# KEYS[1] = next free slot (ms), KEYS[2] = paused until (ms)
+# ARGV[1] = interval (ms)
+# Returns: ms to wait before sending
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local slot = math.max(
+    now,
+    tonumber(redis.call('GET', KEYS[1]) or '0'),
+    tonumber(redis.call('GET', KEYS[2]) or '0')
+)
+local next_slot = slot + tonumber(ARGV[1])
+redis.call('SET', KEYS[1], next_slot, 'PX', next_slot - now + 1000)
+return slot - now
+"""
+
+# KEYS[1] = next free slot (ms), KEYS[2] = paused until (ms)
+# ARGV[1] = retry_after (ms)
+# Returns: ms the pause was extended by (0 if already paused long enough)
+_PAUSE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local paused_until = now + tonumber(ARGV[1])
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+if paused_until <= current then
+    return 0
+end
+redis.call('SET', KEYS[2], paused_until, 'PX', tonumber(ARGV[1]))
+if tonumber(redis.call('GET', KEYS[1]) or '0') < paused_until then
+    redis.call('SET', KEYS[1], paused_until, 'PX', tonumber(ARGV[1]) + 1000)
+end
+return paused_until - math.max(current, now)
+"""
+
+
+class TelegramPacer:
+    """Shared send schedule and 429 pause for one bot"""
+
+    def __init__(self, rate_limit: float = 25.0, prefix: str = "tg:pace"):
+        """
+        Args:
+            rate_limit: Messages per second for the whole bot (all processes)
+            prefix: Redis key prefix
+        """
+        self.interval = 1.0 / rate_limit
+        bot_id = os.getenv("BOT_TOKEN", "").split(":", 1)[0] or "bot"
+        self.slot_key = f"{prefix}:{bot_id}:next"
+        self.pause_key = f"{prefix}:{bot_id}:paused"
+
+        self._acquire = None
+        self._pause = None
+        self._script_client = None
+        self._redis_retry_at = 0.0
+
+        # Fallback schedule (ms) when Redis is unavailable
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+        # Metrics
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait_seconds = 0.0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.redis_errors = 0
+
+    async def _scripts(self):
+        """Register scripts on the current Redis client"""
+        await redis_client.connect()
+        if self._acquire is None or self._script_client is not redis_client.client:
+            self._acquire = redis_client.client.register_script(_ACQUIRE_SCRIPT)
+            self._pause = redis_client.client.register_script(_PAUSE_SCRIPT)
+            self._script_client = redis_client.client
+        return self._acquire, self._pause
+
+    def _use_redis(self) -> bool:
+        return time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, action: str, error: Exception):
+        self.redis_errors += 1
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+        logger.error(f"Telegram pacer Redis error, {action} locally: {error}")
+
+    def _acquire_local(self, interval_ms: float) -> float:
+        now = time.time() * 1000
+        slot = max(now, self._next_slot, self._paused_until)
+        self._next_slot = slot + interval_ms
+        return slot - now
+
+    def _pause_local(self, retry_after_ms: float) -> float:
+        now = time.time() * 1000
+        paused_until = now + retry_after_ms
+        if paused_until <= self._paused_until:
+            return 0.0
+        extended = paused_until - max(self._paused_until, now)
+        self._paused_until = paused_until
+        self._next_slot = max(self._next_slot, paused_until)
+        return extended
+
+    async def _paused_ms(self) -> float:
+        """Remaining pause (a 429 may arrive while waiting for the slot)"""
+        if self._use_redis():
+            try:
+                await redis_client.connect()
+                return max(0, await redis_client.client.pttl(self.pause_key))
+            except Exception as e:
+                self._redis_failed("pausing", e)
+        return max(0.0, self._paused_until - time.time() * 1000)
+
+    async def acquire(self, interval: Optional[float] = None):
+        """
+        Wait for this process's turn to send one message
+
+        Args:
+            interval: Seconds between messages (default: bot-wide rate)
+        """
+        interval_ms = round((interval or self.interval) * 1000)
+        wait_ms = None
+        if self._use_redis():
+            try:
+                acquire, _ = await self._scripts()
+                wait_ms = float(await acquire(keys=[self.slot_key, self.pause_key], args=[interval_ms]))
+            except Exception as e:
+                self._redis_failed("pacing", e)
+        if wait_ms is None:
+            wait_ms = self._acquire_local(interval_ms)
+
+        self.acquired += 1
+        if wait_ms > 0:
+            self.waited += 1
+            self.total_wait_seconds += wait_ms / 1000
+            await asyncio.sleep(wait_ms / 1000)
+
+        while (paused_ms := await self._paused_ms()) > 0:
+            await asyncio.sleep(paused_ms / 1000)
+
+    async def pause(self, retry_after: float) -> float:
+        """
+        Stop all sends of this bot for retry_after seconds (after a 429)
+
+        Returns:
+            Seconds the shared pause was extended by
+        """
+        retry_after_ms = round(retry_after * 1000)
+        extended_ms = None
+        if self._use_redis():
+            try:
+                _, pause = await self._scripts()
+                extended_ms = float(await pause(keys=[self.slot_key, self.pause_key], args=[retry_after_ms]))
+            except Exception as e:
+                self._redis_failed("pausing", e)
+        if extended_ms is None:
+            extended_ms = self._pause_local(retry_after_ms)
+
+        if extended_ms > 0:
+            self.pauses += 1
+            self.paused_seconds += extended_ms / 1000
+            logger.warning(f"Telegram rate limit hit, pausing all sends for {retry_after}s")
+        return extended_ms / 1000
+
+    def get_stats(self) -> dict:
+        """Pacer metrics (this process)"""
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "total_wait_seconds": round(self.total_wait_seconds, 1),
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 1),
+            "redis_errors": self.redis_errors,
+        }
+
+
+# Global pacer instance (Telegram: ~30 messages/sec per bot)
+telegram_pacer = TelegramPacer(rate_limit=float(os.getenv("TELEGRAM_RATE_LIMIT", 25)))